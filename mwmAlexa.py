@@ -1,7 +1,107 @@
 
 from __future__ import print_function
 
-from mwmApi import MwmApi
+import os
+import threading
+import time
+
+from mwmApi import MwmApi, HTTPS, get_connection_stats, response_cache, inflight_requests, conn_stats_store
+from mwmMetrics import flush_metrics
+from mwmDeadline import Deadline, DeadlineExceeded
+from mwmCache import SingleFlight, FlightTimeout
+from mwmRollup import get_locations_with_inactive_aps
+from mwmSessionStore import open_session_store
+from mwmConnTestScheduler import ConnTestScheduler
+from mwmRateLimit import get_rate_limiter_stats
+
+# Lambda environment variables override the host, MWM_SCHEME=http only for a
+# local stand-in server (mwmFakeServer.py)
+MWM_HOST = os.environ.get("MWM_HOST", "alpha-mwm.mojonetworks.com")
+#MWM_HOST = "dashboard-l3stagingblr.dt.airtightnw.com"
+MWM_SCHEME = os.environ.get("MWM_SCHEME", HTTPS)
+
+# Login to MWM using KVS
+MWM_CLIENT = "api-client"
+MWM_LOGIN_TIMEOUT = "3000"
+#MWM_KVS_AUTH_DATA = {
+#    "keyId": "KEY-ATN14-20",
+#    "keyValue": "850151c6cc4860e123455853d6ebc811",
+#    "cname": "ATN19",
+#}
+MWM_KVS_AUTH_DATA = {
+    "keyId": "KEY-ATN8-02", # This keyId is invalid, replace it by your KeyId
+    "keyValue": "0abc2f8664b123450ebc406276929320", # This keyValue is invalid, replace it with your keyValue
+    "cname": "ATN9" # Replace this with you cname
+}
+
+# Seconds an intent waits for a live network test before answering that it is
+# still running. Alexa expects an answer within a few seconds.
+CONN_TEST_INTENT_WAIT = 5
+
+# Time budget of an invocation: Alexa waits 8 seconds for the answer, some of
+# the Lambda remaining time is kept to build and return the response
+ALEXA_RESPONSE_BUDGET = 7.0
+RESPONSE_RESERVE = 0.5
+# Client counts of NetworkStatus are skipped with less budget than this (seconds)
+CLIENT_COUNTS_MIN_BUDGET = 1.5
+# Seconds kept for the last live network test status poll and result fetch
+CONN_TEST_POLL_RESERVE = 1.5
+# Locations with inactive APs named in a RegionStatus answer, the others are only counted
+REGION_STATUS_SPOKEN_LOCATIONS = 3
+# Same named locations offered when asking which one was meant
+LOCATION_CHOICES_SPOKEN = 3
+
+# Status snapshot written by snapshot_refresh_handler (scheduled event).
+# NetworkStatus answers from it without API calls while it is younger than
+# SNAPSHOT_MAX_AGE seconds, and with live calls otherwise.
+SNAPSHOT_PATH = os.environ.get("MWM_SNAPSHOT_PATH", "/tmp/mwm_status_snapshot.sqlite3")
+SNAPSHOT_MAX_AGE = 300
+snapshot_store = None
+snapshot_store_lock = threading.Lock()
+
+# Completed live network tests (rendered result and latencies) by location and
+# time. LastSuccessfulTest and LatencyTrend are answered from it without API calls.
+TEST_HISTORY_PATH = os.environ.get("MWM_TEST_HISTORY_PATH", "/tmp/mwm_test_history.sqlite3")
+# Days covered by a LatencyTrend answer
+LATENCY_TREND_DAYS = 7
+# Spoken metric name (LatencyTrend "metric" slot) => (test history column, name said back)
+LATENCY_TREND_METRICS = {
+    "dhcp": ("dhcp_ms", "D H C P latency"),
+    "gateway": ("gateway_ms", "latency to the default gateway"),
+    "default gateway": ("gateway_ms", "latency to the default gateway"),
+    "dns": ("dns_ms", "D N S latency"),
+    "wan": ("wan_ms", "WAN latency"),
+    "internet": ("wan_ms", "WAN latency"),
+    "ping": ("ping_ms", "ping latency"),
+}
+test_history = None
+test_history_lock = threading.Lock()
+
+# Managed and virtual APs synced incrementally, device counts and APsDown are answered from it
+INVENTORY_PATH = os.environ.get("MWM_INVENTORY_PATH", "/tmp/mwm_inventory.sqlite3")
+# Hours covered by an APsDown answer, and the APs named in it
+APS_DOWN_HOURS = 24
+APS_DOWN_SPOKEN = 3
+inventory = None
+inventory_lock = threading.Lock()
+
+# Association failures are summed up over this many hours, listing this many APs, SSIDs and reasons
+ASSOCIATION_SUMMARY_HOURS = 24
+ASSOCIATION_SUMMARY_SPOKEN = 2
+
+# Authenticated MwmApi instances keyed by (host, keyId). Module globals survive
+# between invocations of a warm Lambda container, so login is done once per
+# session timeout instead of once per intent.
+mwm_api_cache = {}
+mwm_api_cache_lock = threading.Lock()     # held for lookups and inserts only, never during login
+# Concurrent invocations without a cached MwmApi of the key wait for a single login
+mwm_api_logins = SingleFlight()
+
+# Login sessions shared by all invocations and voice sessions, kept until they
+# expire (no logout on goodbye). In memory per container, or in the file named
+# by MWM_SESSION_STORE_PATH (on EFS to share them between containers).
+session_store = open_session_store(os.environ.get("MWM_SESSION_STORE_PATH"))
+
 # --------------- Helpers that build all of the responses ----------------------
 
 def build_speechlet_response(output, reprompt_text, should_end_session, directives):
@@ -36,14 +136,13 @@ def build_response(session_attributes, speechlet_response):
 
 # --------------- Functions that control the skill's behavior ------------------
 
-def get_welcome_response(session):
+def get_welcome_response(session, deadline=None):
     """ If we wanted to initialize the session to have some attributes we could
     add those here
     """
-    session_attributes = {}
-    mwm_api = get_mwm_api(session)
-    if mwm_api is not None:
-        session_attributes['cookiejar_dict'] = mwm_api.get_cookiejar_dict()
+    # Login (or take the stored session) now, so the first question is answered faster
+    get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
 
     card_title = "Welcome"
     speech_output = "Hello, welcome to mojo aware. What can I do?"
@@ -54,6 +153,18 @@ def get_welcome_response(session):
     return build_response(session_attributes, build_speechlet_response(
         speech_output, reprompt_text, should_end_session, None))
 
+def new_session_attributes(session):
+    """ Session attributes carried over to the next request of the voice session
+
+    Login cookies are not among them, they are in the session store.
+    """
+    session_attributes = {}
+    attributes = session.get('attributes') or {}
+    # Live network test still running in the background
+    if 'conn_test' in attributes:
+        session_attributes['conn_test'] = attributes['conn_test']
+    return session_attributes
+
 def get_delegate_directive():
         return [{"type":"Dialog.Delegate"}]
 
@@ -63,57 +174,194 @@ def handle_session_end_request(session):
                     "Have a nice day! "
     # Setting this to true ends the session and exits the skill.
     should_end_session = True
-    close_mwm_api(session)
     return build_response({}, build_speechlet_response(
         speech_output, None, should_end_session, None))
 
 def get_network_status_speech_output(ap_count, client_count, location):
     rv = "Unable to get network status at location " + location + ". Please try again"
 
-    if not isinstance(ap_count, dict) or not isinstance(client_count, dict):
+    # Either count may be missing (failed or skipped for time), the other is still reported
+    if not isinstance(ap_count, dict) or "active" not in ap_count or "inactive" not in ap_count:
+        ap_count = None
+    if not isinstance(client_count, dict) or "successCount" not in client_count or "failureCount" not in client_count:
+        client_count = None
+    if ap_count is None and client_count is None:
         return rv
-    if "active" not in ap_count or "inactive" not in ap_count:
-        return rv
-    if "successCount" not in client_count or "failureCount" not in client_count:
-        return rv
-
-    active_aps = ap_count['active']
-    inactive_aps = ap_count['inactive']
-    cl_succ = client_count['successCount']
-    cl_fail = client_count['failureCount']
 
     rv = "Network status for location " + location + " is as follows. "
-    rv = rv + "There are " + str(active_aps) + " active Access Points and " + str(inactive_aps) + " inactive Access Points. "
-    rv = rv + str(cl_succ) + " clients have successfully connected to the network and " + str(cl_fail) + " clients have failed to connect to the network."
+    if ap_count is not None:
+        active_aps = ap_count['active']
+        inactive_aps = ap_count['inactive']
+        rv = rv + "There are " + str(active_aps) + " active Access Points and " + str(inactive_aps) + " inactive Access Points. "
+    else:
+        rv = rv + "Access Point status is not available right now. "
+    if client_count is not None:
+        cl_succ = client_count['successCount']
+        cl_fail = client_count['failureCount']
+        rv = rv + str(cl_succ) + " clients have successfully connected to the network and " + str(cl_fail) + " clients have failed to connect to the network."
+    else:
+        rv = rv + "Client connection status is not available right now. Please ask again in a moment."
 
     return rv
 
+def get_call_result(future, deadline):
+    """ Result of a call submitted to the MwmApi worker pool, None if it failed
+    or did not finish within the deadline
+    """
+    timeout = None
+    if deadline is not None:
+        timeout = max(0, deadline.remaining())
+    try:
+        return future.result(timeout)
+    except Exception as e:
+        print("Call failed: " + str(e))
+        return None
+
+
+def get_snapshot_store():
+    global snapshot_store
+    with snapshot_store_lock:
+        if snapshot_store is None:
+            # Imported on first use like requests (mwmApi._load_requests), not at cold start
+            from mwmSnapshot import open_snapshot_store
+            snapshot_store = open_snapshot_store(SNAPSHOT_PATH)
+        return snapshot_store
 
-def get_network_status(dialogState, intent, session):
+
+def get_fresh_snapshot():
+    """ Status snapshot of this host and API key, None if missing, older than
+    SNAPSHOT_MAX_AGE or unreadable
+    """
+    try:
+        snapshot = get_snapshot_store().load(get_snapshot_scope())
+    except Exception as e:
+        print("Snapshot read failed: " + str(e))
+        return None
+    if snapshot is None or snapshot.age() > SNAPSHOT_MAX_AGE:
+        return None
+    return snapshot
+
+
+def get_test_history():
+    """ Test history store, opened on first use (None without sqlite3) """
+    global test_history
+    with test_history_lock:
+        if test_history is None:
+            from mwmTestHistory import open_test_history
+            test_history = open_test_history(TEST_HISTORY_PATH)
+        return test_history
+
+
+def get_inventory():
+    """ Device inventory store, opened on first use (None without sqlite3) """
+    global inventory
+    with inventory_lock:
+        if inventory is None:
+            from mwmInventory import open_inventory
+            inventory = open_inventory(INVENTORY_PATH)
+        return inventory
+
+
+def get_test_history_key():
+    # MwmApi.get_session_key() the tests are recorded under, without logging in
+    mwm_api = MwmApi(MWM_HOST, None, scheme=MWM_SCHEME)
+    mwm_api.set_credentials(MWM_CLIENT, MWM_LOGIN_TIMEOUT, MWM_KVS_AUTH_DATA)
+    return mwm_api.get_session_key()
+
+
+def get_age_phrase(seconds):
+    """ Spoken time elapsed: "3 minutes ago", "2 hours ago", "5 days ago" """
+    for unit, length in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        count = int(seconds // length)
+        if count > 0:
+            return str(count) + " " + unit + ("s" if count > 1 else "") + " ago"
+    return "less than a minute ago"
+
+
+def get_slot_value(intent, name):
+    slot = (intent.get('slots') or {}).get(name) or {}
+    return slot.get('value')
+
+
+def get_location_choice_speech(index, location):
+    """ Question asking which of several same named locations was meant,
+    None if the name is not ambiguous. The answer ("corporate in campus a")
+    is resolved by LocationIndex.find().
+    """
+    if index is None:
+        return None
+    ids = index.find_ids(location)
+    if len(ids) < 2:
+        return None
+    names = index.get_distinguishing_names(ids)
+    choices = [names[locid] for locid in ids[:LOCATION_CHOICES_SPOKEN]]
+    if len(ids) > len(choices):
+        choices.append(str(len(ids) - len(choices)) + " others")
+    return "There are " + str(len(ids)) + " locations named " + location + ": " + ", ".join(choices[:-1]) + \
+        " and " + choices[-1] + ". Which one do you mean?"
+
+
+def get_snapshot_scope():
+    return MWM_HOST + "/" + MWM_KVS_AUTH_DATA["keyId"]
+
+
+def get_network_status(dialogState, intent, session, deadline=None):
 
     card_title = intent['name']
-    session_attributes = {}
-    mwm_api = get_mwm_api(session)
-    if mwm_api is not None:
-        session_attributes['cookiejar_dict'] = mwm_api.get_cookiejar_dict()
     should_end_session = False
     print("dialogState: " + str(dialogState))
     if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
         print("Dialog state is not yet complete, returning Dialog.Delegate...")
         resp = build_response(session_attributes, build_speechlet_response(
             None, None, should_end_session, get_delegate_directive()))
         print(resp)
         return resp
 
+    if 'location' in intent['slots'] and intent['slots']['location']['value'] != None:
+        # Answer from the scheduled snapshot while it is fresh, no API call needed
+        location = intent['slots']['location']['value']
+        snapshot = get_fresh_snapshot()
+        locid = None
+        if snapshot is not None:
+            choice_speech = get_location_choice_speech(snapshot.get_index(), location)
+            if choice_speech is not None:
+                return build_response(new_session_attributes(session), build_speechlet_response(
+                    choice_speech, choice_speech, should_end_session, None))
+            locid = snapshot.find(location)
+        if locid is not None:
+            print("Answering from the status snapshot taken " + str(int(snapshot.age())) + " seconds ago")
+            session_attributes = new_session_attributes(session)
+            session_attributes['location'] = location
+            speech_output = get_network_status_speech_output(
+                snapshot.get_ap_count(locid), snapshot.get_client_count(locid), location)
+            reprompt_text = "You can ask me for network status at a location or perform a live network test. Please go ahead. "
+            return build_response(session_attributes, build_speechlet_response(
+                speech_output, reprompt_text, should_end_session, None))
+
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+
     if 'location' in intent['slots'] and intent['slots']['location']['value'] != None:
         location = intent['slots']['location']['value']
+        choice_speech = get_location_choice_speech(mwm_api.get_location_index(), location)
         locid = mwm_api.get_location_id_by_name(location)
         ap_count = 0
         client_count = 0
-        if locid != -2:
+        if choice_speech is not None:
+            speech_output = reprompt_text = choice_speech
+        elif locid != -2:
             session_attributes['location'] = location
-            ap_count = mwm_api.get_device_count_at_location(locid)
-            client_count = mwm_api.get_client_counts_at_loc(locid)
+            # AP and client counts are independent, fetch them concurrently.
+            # Client counts are left out when the time budget is low, and
+            # whatever is ready by the deadline is reported.
+            ap_future = mwm_api.submit(mwm_api.get_device_count_at_location, locid)
+            client_future = None
+            if deadline is None or deadline.allows(CLIENT_COUNTS_MIN_BUDGET):
+                client_future = mwm_api.submit(mwm_api.get_client_counts_at_loc, locid)
+            ap_count = get_call_result(ap_future, deadline)
+            if client_future is not None:
+                client_count = get_call_result(client_future, deadline)
             speech_output = get_network_status_speech_output(ap_count, client_count, location)
             reprompt_text = "You can ask me for network status at a location or perform a live network test. Please go ahead. "
         else:
@@ -128,64 +376,411 @@ def get_network_status(dialogState, intent, session):
         speech_output, reprompt_text, should_end_session, None))
 
 
-def get_result_of_last_successful_test(dialogState, intent, session):
-    session_attributes = {}
+def get_region_status_speech_output(rollup, location):
+    locations = rollup['locations']
+    total = locations[rollup['locid']]
+    rv = "Status of " + location
+    if len(locations) > 1:
+        rv = rv + " with " + str(len(locations) - 1) + " locations"
+    rv = rv + ". There are " + str(total['active']) + " active Access Points and " + str(total['inactive']) + \
+        " inactive Access Points serving " + str(total['clients']) + " clients. "
+    rv = rv + str(rollup['successCount']) + " clients have successfully connected to the network and " + \
+        str(rollup['failureCount']) + " clients have failed to connect to the network. "
+
+    inactive = get_locations_with_inactive_aps(locations)
+    if len(inactive) == 0:
+        return rv + "All Access Points are active."
+    spoken = inactive[:REGION_STATUS_SPOKEN_LOCATIONS]
+    rv = rv + "Locations with inactive Access Points are " + \
+        ", ".join(locations[locid]['name'] + " with " + str(count) for locid, count in spoken)
+    if len(inactive) > len(spoken):
+        rv = rv + ", and " + str(len(inactive) - len(spoken)) + " other locations"
+    return rv + "."
+
+
+def get_region_status(dialogState, intent, session, deadline=None):
+    """ Rolled up status of a location and everything below it (the whole network without a location) """
+    should_end_session = False
+    reprompt_text = "You can ask me for network status at a location or perform a live network test. Please go ahead. "
+    print("dialogState: " + str(dialogState))
+    if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
+        print("Dialog state is not yet complete, returning Dialog.Delegate...")
+        resp = build_response(session_attributes, build_speechlet_response(
+            None, None, should_end_session, get_delegate_directive()))
+        print(resp)
+        return resp
+
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+
+    location = None
+    if 'location' in intent.get('slots', {}) and intent['slots']['location'].get('value') != None:
+        location = intent['slots']['location']['value']
+        choice_speech = get_location_choice_speech(mwm_api.get_location_index(), location)
+        if choice_speech is not None:
+            return build_response(session_attributes, build_speechlet_response(
+                choice_speech, choice_speech, should_end_session, None))
+        locid = mwm_api.get_location_id_by_name(location)
+    else:
+        index = mwm_api.get_location_index()
+        locid = -2
+        if index is not None and len(index.get_roots()) > 0:
+            locid = index.get_roots()[0]
+    if locid == -2:
+        if location is None:
+            speech_output = "Unable to read the location tree. Please try again"
+        else:
+            speech_output = "Could not find location named " + location + ". Please try again with a valid location name"
+        return build_response(session_attributes, build_speechlet_response(
+            speech_output, reprompt_text, should_end_session, None))
+
+    rollup = mwm_api.get_status_rollup(locid)
+    if rollup is None:
+        speech_output = "Unable to get network status. Please try again"
+    else:
+        if location is None:
+            location = "the whole network"
+        else:
+            session_attributes['location'] = location
+        speech_output = get_region_status_speech_output(rollup, location)
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, reprompt_text, should_end_session, None))
+
+
+def get_result_of_last_successful_test(dialogState, intent, session, deadline=None):
     should_end_session = False
-    mwm_api = get_mwm_api(session)
-    if mwm_api is not None:
-        session_attributes['cookiejar_dict'] = mwm_api.get_cookiejar_dict()
     reprompt_text = None
     print("dialogState: " + str(dialogState))
     if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
         print("Dialog state is not yet complete, returning Dialog.Delegate...")
         resp = build_response(session_attributes, build_speechlet_response(
             None, None, should_end_session, get_delegate_directive()))
         print(resp)
         return resp
 
-    tresult = mwm_api.get_client_conn_test_result(95)
-    print(tresult)
-    result_text = mwm_api.convert_conn_test_result_to_text(tresult)
-    if result_text != None:
-        speech_output = "Result of last successful test is as follows. " + result_text
+    session_attributes = new_session_attributes(session)
+    history = get_test_history()
+    key = get_test_history_key()
+    location = get_slot_value(intent, 'location')
+
+    # Answered from the local test history, no API call
+    locid = None
+    if history is None:
+        speech_output = "Network test history is not available."
+    elif location is not None and history.find_location(key, location) is None:
+        speech_output = "No network test has been recorded at location " + location + "."
     else:
-        speech_output = "Unable to fetch the result of last successful test. Please try again"
-    
+        if location is not None:
+            locid = history.find_location(key, location)
+        last = history.get_last(key, locid)
+        if last is None:
+            speech_output = "No successful network test has been recorded yet. You can ask me to perform a live network test at a location."
+        else:
+            speech_output = "The last successful network test at " + str(last['location_name'] or location or "an unknown location") + \
+                " was " + get_age_phrase(time.time() - last['completed_at']) + ". Here are the results. " + last['result_text']
+
     # Setting reprompt_text to None signifies that we do not want to reprompt
     # the user. If the user does not respond or says something that is not
     # understood, the session will end.
     return build_response(session_attributes, build_speechlet_response(
         speech_output, reprompt_text, should_end_session, None))
 
-def perform_client_test(dialogState, intent, session):
-    session_attributes = {}
+def get_latency_trend_speech_output(stats, metric_name, location, days):
+    where = ""
+    if location is not None:
+        where = " at " + location
+    if stats['count'] == 0:
+        return "No " + metric_name + " has been measured" + where + " in the last " + str(days) + " days."
+    sout = "Over the last " + str(days) + " days, " + metric_name + where + " averaged " + \
+        str(int(round(stats['avg']))) + " milli-seconds over " + str(stats['count']) + " test"
+    if stats['count'] > 1:
+        sout += "s, ranging from " + str(int(round(stats['min']))) + " to " + str(int(round(stats['max']))) + " milli-seconds"
+    return sout + "."
+
+def get_latency_trend(dialogState, intent, session, deadline=None):
+    """ Average of a test latency over the last days, from the local test history """
+    should_end_session = False
+    reprompt_text = None
+    print("dialogState: " + str(dialogState))
+    if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
+        print("Dialog state is not yet complete, returning Dialog.Delegate...")
+        resp = build_response(session_attributes, build_speechlet_response(
+            None, None, should_end_session, get_delegate_directive()))
+        print(resp)
+        return resp
+
+    session_attributes = new_session_attributes(session)
+    history = get_test_history()
+    key = get_test_history_key()
+    location = get_slot_value(intent, 'location')
+    metric = get_slot_value(intent, 'metric')
+
+    if metric is None or metric.lower() not in LATENCY_TREND_METRICS:
+        speech_output = "Please ask for D H C P, gateway, D N S, WAN or ping latency."
+    elif history is None:
+        speech_output = "Network test history is not available."
+    else:
+        column, metric_name = LATENCY_TREND_METRICS[metric.lower()]
+        locid = None
+        if location is not None:
+            locid = history.find_location(key, location)
+        if location is not None and locid is None:
+            speech_output = "No network test has been recorded at location " + location + "."
+        else:
+            since = time.time() - LATENCY_TREND_DAYS * 86400
+            stats = history.get_latency_stats(key, column, since, locid)
+            speech_output = get_latency_trend_speech_output(stats, metric_name, location, LATENCY_TREND_DAYS)
+
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, reprompt_text, should_end_session, None))
+
+def get_percent_phrase(rate):
+    if rate is None:
+        return ""
+    return " (" + str(round(rate * 100, 1)) + " percent)"
+
+
+def get_client_failure_trend_speech_output(trend, location):
+    current = trend['current']
+    previous = trend['previous']
+    rv = "In the last hour, " + str(current['failureCount']) + " of " + \
+        str(current['successCount'] + current['failureCount']) + " client connections failed at " + location + \
+        get_percent_phrase(current['failureRate']) + ". In the same hour yesterday, " + \
+        str(previous['failureCount']) + " of " + str(previous['successCount'] + previous['failureCount']) + \
+        " failed" + get_percent_phrase(previous['failureRate']) + ". "
+    change = current['failureCount'] - previous['failureCount']
+    if change > 0:
+        return rv + "That is " + str(change) + " more failures than yesterday."
+    if change < 0:
+        return rv + "That is " + str(-change) + " fewer failures than yesterday."
+    return rv + "That is the same as yesterday."
+
+
+def get_client_failure_trend(dialogState, intent, session, deadline=None):
+    """ Client connection failures of the last hour versus the same hour yesterday """
+    should_end_session = False
+    reprompt_text = None
+    print("dialogState: " + str(dialogState))
+    if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
+        print("Dialog state is not yet complete, returning Dialog.Delegate...")
+        resp = build_response(session_attributes, build_speechlet_response(
+            None, None, should_end_session, get_delegate_directive()))
+        print(resp)
+        return resp
+
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+
+    location = get_slot_value(intent, 'location')
+    if location is not None:
+        choice_speech = get_location_choice_speech(mwm_api.get_location_index(), location)
+        if choice_speech is not None:
+            return build_response(session_attributes, build_speechlet_response(
+                choice_speech, choice_speech, should_end_session, None))
+        locid = mwm_api.get_location_id_by_name(location)
+    else:
+        index = mwm_api.get_location_index()
+        locid = -2
+        if index is not None and len(index.get_roots()) > 0:
+            locid = index.get_roots()[0]
+
+    if locid == -2:
+        if location is None:
+            speech_output = "Unable to read the location tree. Please try again"
+        else:
+            speech_output = "Could not find location named " + location + ". Please try again with a valid location name"
+    else:
+        # Only the stats added since the last question are fetched
+        trend = mwm_api.get_client_conn_stats_trend(locid)
+        if trend is None:
+            speech_output = "Unable to get client connectivity stats. Please try again"
+        else:
+            speech_output = get_client_failure_trend_speech_output(trend, location or "the whole network")
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, reprompt_text, should_end_session, None))
+
+def get_aps_down_speech_output(down, inactive_count, location, hours):
+    where = ""
+    if location is not None:
+        where = " at " + location
+    if len(down) == 0:
+        rv = "No Access Point went down" + where + " in the last " + str(hours) + " hours."
+    else:
+        spoken = down[:APS_DOWN_SPOKEN]
+        names = [str(change['name'] or change['id']) + " " + get_age_phrase(time.time() - change['changed_at'])
+                 for change in spoken]
+        if len(down) > len(spoken):
+            names.append(str(len(down) - len(spoken)) + " others")
+        if len(names) > 1:
+            names = [", ".join(names[:-1]) + " and " + names[-1]]
+        rv = str(len(down)) + " Access Point" + (" went" if len(down) == 1 else "s went") + " down" + where + \
+            " in the last " + str(hours) + " hours: " + names[0] + "."
+    return rv + " " + str(inactive_count) + " Access Points are inactive now."
+
+
+def get_aps_down(dialogState, intent, session, deadline=None):
+    """ Access Points that went down lately, from the local device inventory """
+    should_end_session = False
+    reprompt_text = None
+    print("dialogState: " + str(dialogState))
+    if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
+        print("Dialog state is not yet complete, returning Dialog.Delegate...")
+        resp = build_response(session_attributes, build_speechlet_response(
+            None, None, should_end_session, get_delegate_directive()))
+        print(resp)
+        return resp
+
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+    location = get_slot_value(intent, 'location')
+
+    locids = None
+    speech_output = None
+    if location is not None:
+        index = mwm_api.get_location_index()
+        choice_speech = get_location_choice_speech(index, location)
+        if choice_speech is not None:
+            return build_response(session_attributes, build_speechlet_response(
+                choice_speech, choice_speech, should_end_session, None))
+        locid = mwm_api.get_location_id_by_name(location)
+        if locid == -2:
+            speech_output = "Could not find location named " + location + ". Please try again with a valid location name"
+        else:
+            locids = set(index.get_descendants(locid))
+    if speech_output is None:
+        # Only read, the inventory is synced by inventory_sync_handler
+        if not mwm_api.is_inventory_fresh():
+            speech_output = "The device inventory is not up to date. Please try again later"
+        else:
+            from mwmInventory import CHANGE_DOWN
+            key = mwm_api.get_session_key()
+            since = time.time() - APS_DOWN_HOURS * 3600
+            down = [change for change in get_inventory().get_changes(key, since, (CHANGE_DOWN,))
+                    if locids is None or change['locid'] in locids]
+            inactive = [row for row in get_inventory().get_inactive(key) if locids is None or row[1] in locids]
+            speech_output = get_aps_down_speech_output(down, len(inactive), location, APS_DOWN_HOURS)
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, reprompt_text, should_end_session, None))
+
+def get_association_summary_speech_output(summary, hours):
+    rv = "In the last " + str(hours) + " hours"
+    if not summary['complete']:
+        # Time budget ran out, the chunks summed up cover the start of the range
+        covered = int(summary['to'] - summary['from'])
+        if covered >= 3600:
+            rv = "In the first " + str(covered // 3600) + " of the last " + str(hours) + " hours"
+        else:
+            rv = "In the first " + str(covered // 60) + " minutes of the last " + str(hours) + " hours"
+    if summary['total'] == 0:
+        return rv + ", no client associations were recorded."
+    rv = rv + ", " + str(summary['failures']) + " of " + str(summary['total']) + " client associations failed" + \
+        get_percent_phrase(summary['failureRate']) + "."
+    if len(summary['reasons']) > 0:
+        rv = rv + " The most common reason was " + summary['reasons'][0][0] + " with " + \
+            str(summary['reasons'][0][1]) + " failures."
+    places = []
+    if len(summary['aps']) > 0:
+        places.append("at " + ", ".join(ap['name'] + " with " + str(ap['failures']) for ap in summary['aps']))
+    if len(summary['ssids']) > 0:
+        places.append("on SSID " + ", ".join(ssid['ssid'] + " with " + str(ssid['failures'])
+                                             for ssid in summary['ssids']))
+    if len(places) > 0:
+        rv = rv + " Most failures were " + ", and ".join(places) + "."
+    if summary['p50'] is not None:
+        rv = rv + " Clients took " + str(int(round(summary['p50']))) + " milli-seconds to associate, " + \
+            str(int(round(summary['p90']))) + " milli-seconds at the 90th percentile."
+    return rv
+
+
+def get_association_failures(dialogState, intent, session, deadline=None):
+    """ Association failures of the last ASSOCIATION_SUMMARY_HOURS hours, per AP and SSID """
+    should_end_session = False
+    reprompt_text = None
+    print("dialogState: " + str(dialogState))
+    if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
+        print("Dialog state is not yet complete, returning Dialog.Delegate...")
+        resp = build_response(session_attributes, build_speechlet_response(
+            None, None, should_end_session, get_delegate_directive()))
+        print(resp)
+        return resp
+
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+
+    end_time = int(time.time())
+    summary = mwm_api.get_association_summary(end_time - ASSOCIATION_SUMMARY_HOURS * 3600, end_time,
+                                              ASSOCIATION_SUMMARY_SPOKEN)
+    if summary is None:
+        speech_output = "Unable to get association data. Please try again"
+    else:
+        speech_output = get_association_summary_speech_output(summary, ASSOCIATION_SUMMARY_HOURS)
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, reprompt_text, should_end_session, None))
+
+def get_client_test_speech_output(status, location):
+    if status['rv'] != 0:
+        return "Could not perform client connectivity test at location " + location + " due to error: '" + status['error_string'] + "."
+    if not status['completed']:
+        return "The network test at location " + location + " is running. Ask me for the network test result in a few seconds."
+    return "Network test complete. Here are the results. " + status['result_text']
+
+def check_client_test(mwm_api, session_attributes, deadline=None):
+    """ Polls the pending live network test of the session, forgetting it once it is done """
+    conn_test = session_attributes['conn_test']
+    max_wait = CONN_TEST_INTENT_WAIT
+    if deadline is not None:
+        # Keep time for the last status poll and result fetch
+        max_wait = max(0, min(max_wait, deadline.remaining() - CONN_TEST_POLL_RESERVE))
+    status = mwm_api.wait_client_conn_test(conn_test, max_wait)
+    if status['rv'] != 0 or status['completed']:
+        del session_attributes['conn_test']
+    return get_client_test_speech_output(status, conn_test['location'])
+
+def perform_client_test(dialogState, intent, session, deadline=None):
     should_end_session = False
-    mwm_api = get_mwm_api(session)
-    if mwm_api is not None:
-        session_attributes['cookiejar_dict'] = mwm_api.get_cookiejar_dict()
     reprompt_text = None
     print("dialogState: " + str(dialogState))
     if dialogState != None and dialogState != "COMPLETED":
+        session_attributes = new_session_attributes(session)
         print("Dialog state is not yet complete, returning Dialog.Delegate...")
         resp = build_response(session_attributes, build_speechlet_response(
             None, None, should_end_session, get_delegate_directive()))
         print(resp)
         return resp
 
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+
     if 'location' in intent['slots'] and intent['slots']['location']['value'] != None:
         location = intent['slots']['location']['value']
         locid = mwm_api.get_location_id_by_name(location)
         if locid != -2:
-            resp = mwm_api.do_client_conn_test_at_loc(locid)
-            if resp['rv'] != 0:
-                speech_output = "Could not perform client connectivity test at location " + location + " due to error: '" + resp['error_string'] + "."
+            pending = session_attributes.get('conn_test')
+            if pending is not None and pending['locid'] == locid:
+                speech_output = check_client_test(mwm_api, session_attributes, deadline)
             else:
-                speech_output = "Network test complete. Here are the results. " + resp['result_text']
+                # Start the test and wait only briefly, the result is fetched
+                # by a later intent if the test takes longer
+                resp = mwm_api.start_client_conn_test_at_loc(locid)
+                if resp['rv'] != 0:
+                    speech_output = get_client_test_speech_output(resp, location)
+                else:
+                    resp['test']['location'] = location
+                    session_attributes['conn_test'] = resp['test']
+                    speech_output = check_client_test(mwm_api, session_attributes, deadline)
         else:
             speech_output = "Could not find location named " + location +". Please try again with a valid location name"
     else:
         speech_output = "Please try again by specifying a valid location name"
     
+    if 'conn_test' in session_attributes:
+        reprompt_text = "You can ask me for the network test result. "
     
     # Setting reprompt_text to None signifies that we do not want to reprompt
     # the user. If the user does not respond or says something that is not
@@ -193,6 +788,22 @@ def perform_client_test(dialogState, intent, session):
     return build_response(session_attributes, build_speechlet_response(
         speech_output, reprompt_text, should_end_session, None))
 
+def get_client_test_result(dialogState, intent, session, deadline=None):
+    should_end_session = False
+    mwm_api = get_mwm_api(deadline)
+    session_attributes = new_session_attributes(session)
+    reprompt_text = None
+
+    if 'conn_test' in session_attributes:
+        speech_output = check_client_test(mwm_api, session_attributes, deadline)
+    else:
+        speech_output = "There is no network test running. You can ask me to perform a live network test at a location."
+    if 'conn_test' in session_attributes:
+        reprompt_text = "You can ask me for the network test result. "
+
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, reprompt_text, should_end_session, None))
+
 
 # --------------- Events ------------------
 
@@ -202,53 +813,68 @@ def on_session_started(session_started_request, session):
     print("on_session_started requestId=" + session_started_request['requestId']
           + ", sessionId=" + session['sessionId'])
           
-def create_mwm_api(cookiejar_dict):
-    host = "alpha-mwm.mojonetworks.com"
-    #host = dashboard-l3stagingblr.dt.airtightnw.com
-    mwm_api = MwmApi(host, None)
-
-    # Login to MWM using KVS
-    client = "api-client"
-    login_timeout = "3000"
-    #kvs_auth_data = {
-    #    "keyId": "KEY-ATN14-20",
-    #    "keyValue": "850151c6cc4860e123455853d6ebc811",
-    #    "cname": "ATN19",
-    #}
-    kvs_auth_data = {
-        "keyId": "KEY-ATN8-02", # This keyId is invalid, replace it by your KeyId
-        "keyValue": "0abc2f8664b123450ebc406276929320", # This keyValue is invalid, replace it with your keyValue
-        "cname": "ATN9" # Replace this with you cname
-    }
+def create_mwm_api(deadline=None):
+    mwm_api = MwmApi(MWM_HOST, None, scheme=MWM_SCHEME)
+    mwm_api.set_credentials(MWM_CLIENT, MWM_LOGIN_TIMEOUT, MWM_KVS_AUTH_DATA)
+    mwm_api.set_session_store(session_store)
+    # Opened when first used, intents using neither do not load sqlite3
+    mwm_api.set_test_history(get_test_history)
+    mwm_api.set_inventory(get_inventory)
+    mwm_api.set_deadline(deadline)
+    mwm_api.acquire_session()
+    return mwm_api
 
-    if cookiejar_dict is None:
-        print("Cookiejar is empty. Calling login method...")
-        mwm_api.login(client, login_timeout, kvs_auth_data)
-    else:
-        print("Cookiejar exists. Setting it...")
-        mwm_api.set_cookiejar_from_dict(cookiejar_dict)
+def create_cached_mwm_api(key, deadline=None):
+    # Logs in and caches the MwmApi of key, unless one was cached meanwhile
+    with mwm_api_cache_lock:
+        mwm_api = mwm_api_cache.get(key)
+    if mwm_api is None:
+        mwm_api = create_mwm_api(deadline)
+        with mwm_api_cache_lock:
+            mwm_api_cache[key] = mwm_api
     return mwm_api
 
-def get_mwm_api(session):
-    cookiejar_dict = None
-    
-    if  "cookiejar_dict" in session.get('attributes', {}):
-        cookiejar_dict = session['attributes']['cookiejar_dict']
+def get_mwm_api_cache_key():
+    return (MWM_HOST, MWM_KVS_AUTH_DATA["keyId"])
 
-    return create_mwm_api(cookiejar_dict)    
-    
-def close_mwm_api(session):
-    mwm_api = get_mwm_api(session)
-    if mwm_api is not None:
-        mwm_api.logout()
+def get_mwm_api(deadline=None):
+    """ Returns an authenticated MwmApi, reusing the one cached by an earlier
+    invocation of this (warm) container. Its login session is taken again from
+    the session store once expired.
+
+    The MwmApi is shared by the threads serving invocations at the same time,
+    the deadline is kept for the calling thread only.
+
+    :param deadline: mwmDeadline.Deadline bounding the requests of this invocation
+    """
+    key = get_mwm_api_cache_key()
+    with mwm_api_cache_lock:
+        mwm_api = mwm_api_cache.get(key)
+    if mwm_api is None:
+        wait = None
+        if deadline is not None:
+            wait = max(0, deadline.remaining())
+        try:
+            mwm_api, shared = mwm_api_logins.do(key, lambda: create_cached_mwm_api(key, deadline), wait)
+        except FlightTimeout:
+            raise DeadlineExceeded("Time budget exhausted waiting for login")
+        if not shared:
+            # Logged in by this call, or cached meanwhile by an earlier one
+            mwm_api.set_deadline(deadline)
+            return mwm_api
+    print("Reusing cached MwmApi for " + str(key))
+    mwm_api.set_deadline(deadline)
+    if mwm_api.is_session_expired():
+        mwm_api.acquire_session()
+    return mwm_api
 
 def good_bye_msg(dialogState, intent, session):
-    close_mwm_api(session)
+    # The login session stays in the session store for the next voice session
     speech_output = "You are welcome. I love Mojo Cognitive Cloud WiFi. Good Bye.."
     return build_response({}, build_speechlet_response(
         speech_output, None, True, None))
 
-def on_launch(launch_request, session):
+def on_launch(launch_request, session, deadline=None):
     """ Called when the user launches the skill without specifying what they
     want
     """
@@ -256,11 +882,14 @@ def on_launch(launch_request, session):
     print("on_launch requestId=" + launch_request['requestId'] +
           ", sessionId=" + session['sessionId'])
     # Dispatch to your skill's launch
-    return get_welcome_response(session)
+    return get_welcome_response(session, deadline)
 
 
-def on_intent(intent_request, session):
-    """ Called when the user specifies an intent for this skill """
+def on_intent(intent_request, session, deadline=None):
+    """ Called when the user specifies an intent for this skill
+
+    :param deadline: mwmDeadline.Deadline by which the answer must be ready
+    """
 
     print("on_intent requestId=" + intent_request['requestId'] +
           ", sessionId=" + session['sessionId'])
@@ -275,17 +904,29 @@ def on_intent(intent_request, session):
 
     # Dispatch to your skill's intent handlers
     if intent_name == "NetworkStatus":
-        return get_network_status(dialogState, intent, session)
+        return get_network_status(dialogState, intent, session, deadline)
+    elif intent_name == "RegionStatus":
+        return get_region_status(dialogState, intent, session, deadline)
     elif intent_name == "GoodBye":
         return good_bye_msg(dialogState, intent, session)
     elif intent_name == "ClientTest":
-        return perform_client_test(dialogState, intent, session)
+        return perform_client_test(dialogState, intent, session, deadline)
     elif intent_name == "LiveNetworkTest":
-        return perform_client_test(dialogState, intent, session)
+        return perform_client_test(dialogState, intent, session, deadline)
+    elif intent_name == "NetworkTestResult":
+        return get_client_test_result(dialogState, intent, session, deadline)
     elif intent_name == "LastSuccessfulTest":
-        return get_result_of_last_successful_test(dialogState, intent, session)
+        return get_result_of_last_successful_test(dialogState, intent, session, deadline)
+    elif intent_name == "LatencyTrend":
+        return get_latency_trend(dialogState, intent, session, deadline)
+    elif intent_name == "ClientFailureTrend":
+        return get_client_failure_trend(dialogState, intent, session, deadline)
+    elif intent_name == "APsDown":
+        return get_aps_down(dialogState, intent, session, deadline)
+    elif intent_name == "AssociationFailures":
+        return get_association_failures(dialogState, intent, session, deadline)
     elif intent_name == "AMAZON.HelpIntent":
-        return get_welcome_response(session)
+        return get_welcome_response(session, deadline)
     elif intent_name == "AMAZON.CancelIntent" or intent_name == "AMAZON.StopIntent":
         return handle_session_end_request(session)
     else:
@@ -299,7 +940,6 @@ def on_session_ended(session_ended_request, session):
     """
     print("on_session_ended requestId=" + session_ended_request['requestId'] +
           ", sessionId=" + session['sessionId'])
-    close_mwm_api(session)
     # add cleanup logic here
 
 
@@ -325,10 +965,113 @@ def lambda_handler(event, context):
         on_session_started({'requestId': event['request']['requestId']},
                            event['session'])
 
-    if event['request']['type'] == "LaunchRequest":
-        return on_launch(event['request'], event['session'])
-    elif event['request']['type'] == "IntentRequest":
-        return on_intent(event['request'], event['session'])
-    elif event['request']['type'] == "SessionEndedRequest":
-        return on_session_ended(event['request'], event['session'])
+    # Every API request of this invocation must finish before Alexa gives up
+    deadline = Deadline.from_lambda_context(context, RESPONSE_RESERVE, ALEXA_RESPONSE_BUDGET)
+
+    resp = None
+    dimensions = {"RequestType": event['request']['type']}
+    if event['request']['type'] == "IntentRequest":
+        dimensions["Intent"] = event['request']['intent']['name']
+    try:
+        if event['request']['type'] == "LaunchRequest":
+            resp = on_launch(event['request'], event['session'], deadline)
+        elif event['request']['type'] == "IntentRequest":
+            resp = on_intent(event['request'], event['session'], deadline)
+        elif event['request']['type'] == "SessionEndedRequest":
+            resp = on_session_ended(event['request'], event['session'])
+    except DeadlineExceeded as e:
+        print("Time budget exhausted: " + str(e))
+        resp = build_response(event['session'].get('attributes') or {}, build_speechlet_response(
+            "Mojo cloud is taking longer than usual to respond. Please ask again in a moment.",
+            None, False, None))
+
+    # API latency per endpoint of this invocation and connection reuse of the
+    # keep-alive pool (survives warm invocations)
+    flush_metrics(dimensions)
+    print("connection stats: " + str(get_connection_stats()))
+    print("response cache stats: " + str(response_cache.stats()))
+    print("session store stats: " + str(session_store.stats()))
+    print("coalesced request stats: " + str(inflight_requests.stats()))
+    print("rate limit stats: " + str(get_rate_limiter_stats()))
+    print("connectivity stats series: " + str(conn_stats_store.stats()))
+    return resp
+
+
+def snapshot_refresh_handler(event, context):
+    """ Scheduled (CloudWatch Events) entry point, recomputes the status snapshot
+    NetworkStatus answers from
+
+    The snapshot is saved at MWM_SNAPSHOT_PATH. The default under /tmp is
+    local to the container running the schedule, which is rarely the one
+    answering NetworkStatus: set MWM_SNAPSHOT_PATH to a shared file system
+    (EFS) for the other containers to answer from the snapshot.
+    """
+    deadline = Deadline.from_lambda_context(context, RESPONSE_RESERVE)
+    start = time.time()
+    mwm_api = get_mwm_api(deadline)
+    from mwmSnapshot import take_snapshot
+    snapshot = take_snapshot(mwm_api)
+    if snapshot is None:
+        print("Status snapshot not taken, location tree unavailable")
+        flush_metrics({"RequestType": "SnapshotRefresh"})
+        return {"rv": 1}
+    get_snapshot_store().save(get_snapshot_scope(), snapshot)
+    print("Status snapshot of " + str(len(snapshot)) + " locations taken in " + str(round(time.time() - start, 2)) + " seconds")
+    flush_metrics({"RequestType": "SnapshotRefresh"})
+    return {"rv": 0, "locations": len(snapshot), "taken_at": snapshot.taken_at}
+
+
+def inventory_sync_handler(event, context):
+    """ Scheduled (CloudWatch Events) entry point, syncs the local device inventory
+
+    Incremental where possible, {"full": true} in the event forces a full sync.
+    """
+    deadline = Deadline.from_lambda_context(context, RESPONSE_RESERVE)
+    mwm_api = get_mwm_api(deadline)
+    deltas = mwm_api.sync_inventory(full=bool((event or {}).get("full")))
+    flush_metrics({"RequestType": "InventorySync"})
+    if mwm_api.get_inventory() is not None:
+        print("inventory stats: " + str(mwm_api.get_inventory().stats()))
+    if deltas is None:
+        return {"rv": 1}
+    return {"rv": 0, "changes": dict((kind, len(deltas[kind])) for kind in deltas)}
+
+
+def conn_test_sweep_handler(event, context):
+    """ Scheduled (nightly sweep) or on demand entry point running the live
+    network test at many locations at once
+
+    :param event: {"locations": [names]} or {"locids": [ids]}, all locations
+                  without sub-locations if neither is given, optional
+                  "tests_per_location"
+    """
+    deadline = Deadline.from_lambda_context(context, RESPONSE_RESERVE)
+    mwm_api = get_mwm_api(deadline)
+    locids = event.get("locids")
+    if locids is None:
+        index = mwm_api.get_location_index()
+        if index is None:
+            print("Location tree unavailable, no test run")
+            return {"rv": 1}
+        if "locations" in event:
+            locids = [index.find(name) for name in event["locations"]]
+            for name, locid in zip(event["locations"], locids):
+                if locid is None:
+                    print("Location not found: " + name)
+            locids = [locid for locid in locids if locid is not None]
+        else:
+            locids = sorted(index.get_leaves())
+
+    scheduler = ConnTestScheduler(mwm_api, tests_per_location=event.get("tests_per_location", 1), deadline=deadline)
+    results = []
+    for result in scheduler.run(locids):
+        # Logged as each test ends
+        print("Live network test result: " + str(result))
+        results.append(result)
+    flush_metrics({"RequestType": "ConnTestSweep"})
+    pending = len([result for result in results if result.get('pending')])
+    failed = len([result for result in results if result['rv'] != 0]) - pending
+    print("Live network tests: " + str(len(results)) + " run, " + str(failed) + " failed, " + str(pending) +
+          " still running")
+    return {"rv": 0, "tests": len(results), "failed": failed, "pending": pending, "results": results}
 
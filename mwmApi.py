@@ -1,17 +1,82 @@
-# Import requests for making API requests
-import requests
-import urllib3
-urllib3.disable_warnings()
+# requests (and urllib3) for making API requests are imported on first use
+# by _load_requests(), they are a large part of the Lambda cold start
+requests = None
 # Import for building urls
-#import urllib.parse as urlparse
-import urlparse
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
 # Import for loading json into python dictionary
 import json
 import time
-
-REQUEST_TIMEOUT = 300  # 5 minutes
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from mwmLocations import LocationIndex
+from mwmStream import iter_response_items
+from mwmMetrics import api_metrics, endpoint_template
+from mwmJson import loads as json_loads
+from mwmCache import ResponseCache, SingleFlight, FlightTimeout
+from mwmDeadline import DeadlineExceeded, MIN_REQUEST_BUDGET
+from mwmRateLimit import get_rate_limiter, get_retry_delay, IDEMPOTENT_METHODS, RETRY_STATUS_CODES, RETRY_MAX_ATTEMPTS
+from mwmConnStats import ConnStatsStore, get_conn_stats_time
+from mwmAssociation import AssociationAggregate, ASSOCIATION_ITEMS_KEY, get_time_chunks
+from mwmInventory import (
+    InventorySyncError, INVENTORY_KINDS, INVENTORY_FULL_SYNC_INTERVAL, KIND_MANAGED_DEVICES, KIND_VIRTUAL_APS,
+    MODIFIED_TIME_PROPERTY
+)
+from mwmRollup import count_devices_by_location, count_clients_by_location, rollup_status
+
+REQUEST_TIMEOUT = 300  # 5 minutes, used as is when no deadline is set
+
+# Keep-alive connection pool shared by all MwmApi instances of the process.
+# The pool outlives a single Lambda invocation, so warm containers skip the
+# TCP connect and TLS handshake to the Mojo cloud host.
+HTTP_POOL_CONNECTIONS = 4   # number of hosts to keep connection pools for
+HTTP_POOL_MAXSIZE = 10      # max keep-alive connections per host
+
+# Max worker threads issuing independent API calls concurrently (MwmApi.gather).
+# Kept below HTTP_POOL_MAXSIZE so every worker gets a keep-alive connection.
+MAX_CONCURRENT_CALLS = 4
+
+# Seconds before the server side session timeout at which a session is
+# treated as expired, so it is not used right when the server drops it.
+SESSION_EXPIRY_MARGIN = 60
+
+# Seconds a fetched location tree is used for name lookups before it is fetched again
+LOCATION_INDEX_TTL = 600
+
+# Live network (client connectivity) test
+CONN_TEST_PROFILE_ID = 8
+CONN_TEST_CAPABLE_MODELS = ("C130",)   # models preferred as test target/client
+CONN_TEST_PAIRS_TTL = 900       # seconds candidate test device pairs of a location are cached
+CONN_TEST_MAX_PROBES = 32       # max APs of a location probed for observing devices
+CONN_TEST_COMPLETED = "CL_CONNEC_COMPLETED"
+CONN_TEST_TIMEOUT = 120         # seconds after start when a test is given up
+CONN_TEST_POLL_INITIAL = 1.0    # seconds before the first status poll
+CONN_TEST_POLL_MAX = 8.0        # max seconds between status polls
+CONN_TEST_POLL_BACKOFF = 1.5    # growth factor of the poll interval
+
+# Association analytics are fetched and summed up in chunks of this many seconds,
+# up to MAX_CONCURRENT_CALLS at once. No chunk is started with less than
+# ASSOCIATION_CHUNK_MIN_BUDGET seconds left of the deadline.
+ASSOCIATION_CHUNK = 3600
+ASSOCIATION_CHUNK_MIN_BUDGET = 1.0
+ASSOCIATION_DEADLINE_CHECK = 1000     # records summed up between deadline checks
+
+# Seconds after its last sync the local device inventory is used, the
+# scheduled sync (inventory_sync_handler) must run more often
+INVENTORY_MAX_AGE = 900
+
+# Client connectivity stats trend: window length, and how far back it is compared (seconds)
+CONN_STATS_TREND_WINDOW = 3600
+CONN_STATS_TREND_OFFSET = 86400
 
 HTTPS = "https"
+HTTP = "http"       # plain http, for local stand-in servers (mwmFakeServer)
 PATH_BASE = "{hostname}/new/"
 PATH_API_WEBSERVICE = "webservice/v4"
 PATH_LOGIN = "/login/key/{client_identifier}/{session_timeout}"
@@ -30,19 +95,390 @@ QUERY_LOCATION_ID = "locationid=%s"
 QUERY_NODE_ID = "nodeid=%s"
 QUERY_FILE_FORMAT = 'format="%s"'
 QUERY_MAC_OBFUSCATE = 'tohashmac="%s"'
+QUERY_PAGING = "pagingfrom=%d&pagingsize=%d"
+
+# Constant filters, serialized once at import
+QUERY_AP_MODE_FILTER = QUERY_FILTER % json.dumps({
+    "property": "devicemode",
+    "value": ["AP", "AP_SENSOR_COMBO"],
+    "operator": "="
+})
+QUERY_ACTIVE_FILTER = QUERY_FILTER % json.dumps({
+    "property": "active",
+    "value": [True],
+    "operator": "="
+})
+# Virtual AP with (boxid = 1) OR (group = AUTHORIZED)
+QUERY_VIRTUAL_APS_FILTER = QUERY_FILTER % json.dumps({
+    "value": [
+        {
+            "property": "boxid",
+            "value": [1],
+            "operator": "="
+        },
+        {
+            "property": "group",
+            "value": ['AUTHORIZED'],
+            "operator": "="
+        }
+    ],
+    "operator": "OR"
+})
+
+# Keys of the record lists in list responses
+ITEMS_MANAGED_DEVICES = "managedDevices"
+ITEMS_CLIENTS = "clients"
+ITEMS_VIRTUAL_ACCESS_POINTS = "aps"
+
+# Records fetched per request by the iter_* listings
+PAGE_SIZE = 500
+
+# Seconds GET responses of slowly changing endpoints are served from the
+# response cache, keyed by endpoint template (mwmMetrics.endpoint_template)
+RESPONSE_CACHE_TTLS = {
+    PATH_LOCATION_TREE: 300,
+    PATH_SSID_PROFILES: 600,
+    PATH_MANAGED_DEVICES: 60,
+    "devices/manageddevices/{id}/observingmanageddevices": 300,
+}
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Process wide, cached responses survive warm Lambda invocations
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+# Client connectivity stats fetched per location, reused by later trend questions
+conn_stats_store = ConnStatsStore()
+# Identical GETs of a tenant made at the same time by several threads (users
+# asking about the same site during an outage) share one call
+inflight_requests = SingleFlight()
 
 HEADER_JSON_CONTENT = {"Content-Type": "application/json"}
+# Compressed responses accepted, list and test result payloads are large and
+# repetitive. Brotli is left out: its decoder is an extra dependency on Lambda.
+ACCEPT_ENCODING = "gzip, deflate"
+
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+_api_url_bases = {}     # (scheme, hostname) => "https://{hostname}/new/webservice/v4"
+
+
+def _load_requests():
+    """ Imports requests on first use, returns the module """
+    global requests
+    if requests is None:
+        import requests as requests_module
+        import urllib3
+        urllib3.disable_warnings()
+        requests = requests_module
+    return requests
+
+
+def _new_no_cookie_policy():
+    """ Cookie policy keeping the shared session cookie jar empty.
+
+    Login cookies belong to a MwmApi instance (cookie_jar), not to the pooled
+    session that is shared between tenants. Defined with requests, cookielib
+    (http.cookiejar) is as slow to import.
+    """
+    class NoCookiePolicy(requests.cookies.cookielib.DefaultCookiePolicy):
+
+        def set_ok(self, cookie, request):
+            return False
+
+        def return_ok(self, cookie, request):
+            return False
+
+    return NoCookiePolicy()
+
+
+def get_http_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE):
+    """ Returns the process wide keep-alive session for the given pool limits
+
+    :param pool_connections: number of hosts to keep connection pools for
+    :param pool_maxsize: max keep-alive connections per host
+    :return: requests.Session
+    """
+    key = (pool_connections, pool_maxsize)
+    with _http_sessions_lock:
+        session = _http_sessions.get(key)
+        if session is None:
+            _load_requests()
+            session = requests.Session()
+            session.verify = False
+            session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+            session.cookies.set_policy(_new_no_cookie_policy())
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_sessions[key] = session
+        return session
+
+
+def get_response_json(response):
+    """ Decoded JSON body of a response, with the mwmJson decoder
+
+    Decoding time and decoded size are recorded per endpoint (api_metrics).
+    """
+    content = response.content
+    start = time.time()
+    value = json_loads(content)
+    api_metrics.record_decode(getattr(response, "endpoint", None), time.time() - start, len(content))
+    return value
+
+
+def get_wire_bytes(response):
+    """ Size of a read response body as received, compressed if it was """
+    length = response.headers.get("Content-Length")
+    if length is not None:
+        return int(length)
+    raw = getattr(response, "raw", None)
+    if raw is not None and hasattr(raw, "tell"):
+        try:
+            return raw.tell()
+        except Exception:
+            pass
+    return len(response.content)
+
+
+class CallFuture:
+    """ Result of a call submitted to the worker pool """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error = e
+        self.done.set()
+
+    def result(self, timeout=None):
+        """ Waits for the call and returns its value, re-raising its exception """
+        if not self.done.wait(timeout):
+            raise RuntimeError("Timeout waiting for " + getattr(self.func, "__name__", str(self.func)))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class WorkerPool:
+    """ Bounded pool of daemon threads, started on first use
+
+    The threads live as long as the process, so warm Lambda invocations reuse them.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.tasks = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def in_worker(self):
+        return getattr(self.local, "is_worker", False)
+
+    def submit(self, func, *args, **kwargs):
+        future = CallFuture(func, args, kwargs)
+        if self.in_worker():
+            # Waiting on the pool from one of its threads could deadlock, run inline
+            future.run()
+            return future
+        self._start()
+        self.tasks.put(future)
+        return future
+
+    def _start(self):
+        with self.lock:
+            while len(self.threads) < self.size:
+                thread = threading.Thread(target=self._work, name="mwm-worker-%d" % len(self.threads))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _work(self):
+        self.local.is_worker = True
+        while True:
+            self.tasks.get().run()
+
+
+_worker_pool = WorkerPool(MAX_CONCURRENT_CALLS)
+
+
+def get_connection_stats():
+    """ Connection reuse statistics of the shared keep-alive sessions
+
+    :return: dict with per host connection/request counts and the overall reuse rate
+             ({"hosts": {"https://training.mojonetworks.com": {"connections": 1, "requests": 4}},
+               "connections": 1, "requests": 4, "reuse_rate": 0.75})
+    """
+    hosts = {}
+    with _http_sessions_lock:
+        sessions = list(_http_sessions.values())
+    for session in sessions:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = "%s://%s" % (pool.scheme, pool.host)
+                stats = hosts.setdefault(host, {"connections": 0, "requests": 0})
+                stats["connections"] += pool.num_connections
+                stats["requests"] += pool.num_requests
+
+    connections = sum(stats["connections"] for stats in hosts.values())
+    num_requests = sum(stats["requests"] for stats in hosts.values())
+    reuse_rate = 0.0
+    if num_requests > 0:
+        reuse_rate = 1.0 - float(connections) / num_requests
+    return {"hosts": hosts, "connections": connections, "requests": num_requests, "reuse_rate": reuse_rate}
+
+
+def build_api_url(hostname, relative_path='', query_parameters='', scheme=HTTPS):
+    """ Webservice url for a resource path ("https://training.mojonetworks.com/new/webservice/v4/devices/clients?locationid=1")
+
+    Same result as urlparse.urlunparse, with the base url built once per host.
+    """
+    base = _api_url_bases.get((scheme, hostname))
+    if base is None:
+        base = urlparse.urlunparse((
+            scheme,                                                             # "https"
+            PATH_BASE.format(hostname=hostname) + PATH_API_WEBSERVICE,          # "training.mojonetworks.com/new/webservice/V4"
+            '', '', '', ''
+        ))
+        _api_url_bases[(scheme, hostname)] = base
+    url = base
+    if relative_path:
+        if relative_path[0] != "/":
+            url = url + "/"
+        url = url + relative_path                                               # "devices/clients"
+    if query_parameters:
+        url = url + "?" + query_parameters                                      # "locationid=1&nodeid=1"
+    return url
+
+
+def get_managed_ap_devices_query(locid, active_devices_only=False):
+    """ Query string for managed AP devices at a location """
+    query = "nodeid=0&locationid="+str(locid)
+    query = query + "&" + QUERY_AP_MODE_FILTER
+    if active_devices_only == True:
+        query = query + "&" + QUERY_ACTIVE_FILTER
+    return query
+
+
+def get_clients_query(locid):
+    """ Query string for clients at a location """
+    filter_value = {
+                "property": "locationid",
+                "value": [locid],
+                "operator": "="
+            }
+    return QUERY_FILTER % json.dumps(filter_value)
+
+
+def get_virtual_aps_query():
+    """ Query string for Virtual APs with (boxid = 1) OR (group = AUTHORIZED) """
+    return QUERY_VIRTUAL_APS_FILTER
+
+
+def get_client_conn_stats_query(locid, from_time, to_time):
+    """ Query string for client connectivity stats at a location between two epoch times """
+    return "locationid="+str(locid)+"&fromtime="+str(from_time)+"&totime="+str(to_time)
+
+
+def get_conn_test_capability(device, third_radio=False):
+    """ Capability score of a device for the live network test, higher is better
+
+    :param device: managed device record
+    :param third_radio: third radio support to assume when the record does not tell
+                        (observers fetched with isthirdradiosupported=true have one)
+    :return: int score, 0 if the device has no known capability
+    """
+    score = 0
+    if device.get('thirdRadioSupported', device.get('isThirdRadioSupported', third_radio)):
+        score += 2
+    model = device.get('model') or device.get('name') or ""
+    for capable_model in CONN_TEST_CAPABLE_MODELS:
+        if capable_model in model:
+            score += 1
+            break
+    if device.get('active', True):
+        score += 1
+    return score
+
+
+def rank_conn_test_pairs(managed_devices, observers_by_boxid):
+    """ Target AP / observing client AP pairs for the live network test, best first
+
+    :param managed_devices: active managed AP devices at the location
+    :param observers_by_boxid: boxId => observing third radio devices of that AP
+    :return: list of {'target_boxid', 'client_boxid', 'score'}
+    """
+    pairs = []
+    for md in managed_devices:
+        target_score = get_conn_test_capability(md)
+        for cld in observers_by_boxid.get(md['boxId']) or []:
+            if cld['boxId'] == md['boxId']:
+                continue
+            pairs.append({
+                'target_boxid': md['boxId'],
+                'client_boxid': cld['boxId'],
+                'score': target_score + get_conn_test_capability(cld, True)
+            })
+    # Stable sort keeps the server order between pairs of equal score
+    pairs.sort(key=lambda pair: -pair['score'])
+    return pairs
 
 
 class MwmApi:
 
-    def __init__(self, hostname, cookie_jar):
+    def __init__(self, hostname, cookie_jar, pool_connections=HTTP_POOL_CONNECTIONS,
+                 pool_maxsize=HTTP_POOL_MAXSIZE, scheme=HTTPS):
         """
         :param hostname: server hostname (Example: "training.mojonetworks.com")
+        :param cookie_jar: session cookies from a previous login (None if not logged in)
+        :param pool_connections: number of hosts to keep connection pools for
+        :param pool_maxsize: max keep-alive connections per host
+        :param scheme: url scheme, HTTP only for a local stand-in server ("127.0.0.1:8080")
         :return:
         """
         self.hostname = hostname
+        self.scheme = scheme
         self.cookie_jar = cookie_jar
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        # Shared keep-alive session, looked up on the first request
+        self.session = None
+        # (client_identifier, session_timeout, kvs_service_data) used to login again on 401
+        self.credentials = None
+        # time.time() after which the login session is expired (None if unknown)
+        self.session_expires_at = None
+        # mwmSessionStore shared by the MwmApi instances of a process, None to login per instance
+        self.session_store = None
+        # mwmTestHistory.TestHistory recording completed live network tests, None to keep no history
+        self.test_history = None
+        self.test_history_opener = None
+        # mwmInventory.InventoryStore of the managed and virtual APs, None to always fetch them
+        self.inventory = None
+        self.inventory_opener = None
+        self.location_index = None
+        self.location_index_lock = threading.Lock()
+        # Per thread state: 'deadline', the mwmDeadline.Deadline of the invocation
+        # served by the thread. Invocations served at the same time by other
+        # threads share this instance, each with its own time budget.
+        self.local = threading.local()
+        # locid => (time.time() of the probe, ranked live network test device pairs)
+        self.conn_test_pairs = {}
+        self.conn_test_pairs_lock = threading.Lock()
 
     def __enter__(self):
         return self
@@ -52,8 +488,171 @@ class MwmApi:
         self.hostname = None
         self.cookie_jar = None
 
+    def set_credentials(self, client_identifier, session_timeout, kvs_service_data):
+        """ Remember login parameters, used to login again when the session expires
+
+        :param client_identifier: string to identify caller
+        :param session_timeout: session timeout in seconds
+        :param kvs_service_data: kvs credentials (cname, keyId, keyValue)
+        """
+        self.credentials = (client_identifier, session_timeout, kvs_service_data)
+
+    def set_session_store(self, session_store):
+        """ Shares login sessions with the other users of the store (mwmSessionStore)
+
+        acquire_session() and the login on 401 then reuse the session of the
+        credentials stored by any instance, and log in only when there is none.
+        """
+        self.session_store = session_store
+
+    def set_test_history(self, test_history):
+        """ Records the live network tests completed through check_client_conn_test (mwmTestHistory)
+
+        Tests are recorded under get_session_key(), credentials must be set.
+
+        :param test_history: TestHistory, or a callable returning it (None if
+                             no history is kept) called when a test first completes
+        """
+        if callable(test_history):
+            self.test_history = None
+            self.test_history_opener = test_history
+        else:
+            self.test_history = test_history
+            self.test_history_opener = None
+
+    def get_test_history(self):
+        """ TestHistory set by set_test_history, opened on first use, None if none is kept """
+        opener = self.test_history_opener
+        if opener is not None:
+            self.test_history = opener()
+            self.test_history_opener = None
+        return self.test_history
+
+    def set_inventory(self, inventory):
+        """ Keeps the managed and virtual APs in a local store synced incrementally (mwmInventory)
+
+        Device counts then come from the store while it is younger than
+        INVENTORY_MAX_AGE, it is synced by sync_inventory(). Records are stored
+        under get_session_key().
+
+        :param inventory: InventoryStore, or a callable returning it (None if
+                          no inventory is kept) called when device counts are first needed
+        """
+        if callable(inventory):
+            self.inventory = None
+            self.inventory_opener = inventory
+        else:
+            self.inventory = inventory
+            self.inventory_opener = None
+
+    def get_inventory(self):
+        """ InventoryStore set by set_inventory, opened on first use, None if none is kept """
+        opener = self.inventory_opener
+        if opener is not None:
+            self.inventory = opener()
+            self.inventory_opener = None
+        return self.inventory
+
+    def get_session_key(self):
+        """ Key of the login session in the session store: (host, tenant, keyId) """
+        kvs_service_data = self.credentials[2]
+        return (self.hostname, kvs_service_data.get("cname"), kvs_service_data.get("keyId"))
+
+    def acquire_session(self):
+        """ Takes the stored login session of the credentials, logging in if there is none
+
+        Without a session store this always logs in. Credentials must be set.
+        """
+        if self.session_store is None:
+            self.login(*self.credentials)
+            return
+        record = self.session_store.get_or_login(self.get_session_key(), self._login_for_session_store)
+        self.set_cookiejar_from_dict(record["cookies"])
+        self.session_expires_at = record["expires_at"]
+
+    def _login_for_session_store(self):
+        self.login(*self.credentials)
+        return self.get_cookiejar_dict(), self.session_expires_at
+
+    def submit(self, func, *args, **kwargs):
+        """ Runs func(*args, **kwargs) on the shared worker pool, within the deadline of the caller
+
+        :return: CallFuture, result() returns the value or raises the exception of the call
+        """
+        return _worker_pool.submit(self._call_with_deadline, self.get_deadline(), func, args, kwargs)
+
+    def _call_with_deadline(self, deadline, func, args, kwargs):
+        # Runs a submitted call on a worker thread under the deadline of the thread that submitted it
+        previous = self.get_deadline()
+        self.local.deadline = deadline
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.local.deadline = previous
+
+    def gather(self, *calls):
+        """ Issues independent calls concurrently and waits for all of them
+
+        ap_count, client_count = mwm_api.gather(
+            (mwm_api.get_device_count_at_location, locid),
+            (mwm_api.get_client_counts_at_loc, locid))
+
+        :param calls: tuples of (function, arg1, arg2, ...)
+        :return: list of call results in the order of calls
+        :raises: the exception of the first failed call, once all calls have finished
+        """
+        futures = [self.submit(call[0], *call[1:]) for call in calls]
+        for future in futures:
+            future.done.wait()
+        return [future.result() for future in futures]
+
+    def set_deadline(self, deadline):
+        """ Bounds the timeouts of the following requests of the calling thread by a time budget
+
+        :param deadline: mwmDeadline.Deadline, None for the fixed REQUEST_TIMEOUT
+        """
+        self.local.deadline = deadline
+
+    def get_deadline(self):
+        """ mwmDeadline.Deadline set by the calling thread, None if it set none """
+        return getattr(self.local, "deadline", None)
+
+    def get_request_timeout(self):
+        """ (connect, read) timeout for a request started now
+
+        :raises DeadlineExceeded: if the deadline leaves no time for the request
+        """
+        deadline = self.get_deadline()
+        if deadline is None:
+            return REQUEST_TIMEOUT
+        return deadline.get_timeouts(REQUEST_TIMEOUT)
+
+    def get_tenant(self):
+        """ keyId of the login credentials, scopes cached responses (None if unknown) """
+        if self.credentials is None:
+            return None
+        return self.credentials[2].get("keyId")
+
+    def invalidate_response_cache(self, relative_path=None):
+        """ Drops cached responses of this tenant, only those of relative_path if given
+
+        :param relative_path: resource path ("locations/tree"), matched as url prefix
+        """
+        tenant = self.get_tenant()
+        prefix = None
+        if relative_path is not None:
+            prefix = build_api_url(self.hostname, relative_path, scheme=self.scheme)
+        response_cache.invalidate(
+            lambda key: key[0] == self.hostname and key[1] == tenant and (prefix is None or key[2].startswith(prefix)))
+
+    def is_session_expired(self):
+        """ True if the login session timeout (minus SESSION_EXPIRY_MARGIN) has passed """
+        if self.session_expires_at is None:
+            return False
+        return time.time() >= self.session_expires_at
+
     def request(self, relative_path='', query_parameters='', method="GET", body=None, url=None,
-                headers=HEADER_JSON_CONTENT):
+                headers=HEADER_JSON_CONTENT, relogin=True, stream=False):
         """ Common function for making API calls and returning content
 
         :param relative_path: resource path to be queried ("devices/clients")
@@ -62,30 +661,48 @@ class MwmApi:
         :param body: request body as string (used for methods like POST, PUT)
         :param url: used to specify custom url (https://www.mojo.com/new/webservice/V4/devices/clients?locationid=1")
         :param headers: request headers
+        :param relogin: login again and retry once if the server returns 401 and credentials are known
+        :param stream: do not read the body yet (response.iter_content), the caller must close the response
         :return: response object
         """
         if url is None:
-            url = urlparse.urlunparse((
-                HTTPS,                                                                  # "https"
-                PATH_BASE.format(hostname=self.hostname) + PATH_API_WEBSERVICE,         # "training.mojonetworks.com/new/webservice/V4"
-                relative_path,                                                          # "devices/clients"
-                '',
-                query_parameters,                                                       # "locationid=1&nodeid=1"
-                ''
-            ))
-        print(self.cookie_jar)
-        print(url)
-        # Makes the request
-        response = requests.request(
-            method,                             # request method ("GET", "PUT", "POST", "DELETE")
-            url,                                # constructed url
-            timeout=REQUEST_TIMEOUT,            # timeout for request
-            cookies=self.cookie_jar,            # session cookies to be passed after login
-            data=body,                          # request body
-            headers=headers,                    # headers to use ({"Content-Type": "application/json"})
-            verify=False
-        )
-        #print(response)
+            url = build_api_url(self.hostname, relative_path, query_parameters, self.scheme)
+            endpoint = endpoint_template(relative_path)
+        else:
+            endpoint = endpoint_template(urlparse.urlparse(url).path.split(PATH_API_WEBSERVICE, 1)[-1])
+
+        cache_key = None
+        cached = None
+        ttl = RESPONSE_CACHE_TTLS.get(endpoint)
+        if method == "GET" and not stream and ttl is not None and self.get_tenant() is not None:
+            cache_key = (self.hostname, self.get_tenant(), url)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                if cached.is_fresh():
+                    return cached.response
+                validators = cached.get_validators()
+                if validators:
+                    headers = dict(headers)
+                    headers.update(validators)
+                else:
+                    cached = None
+
+        if method == "GET" and not stream and self.get_tenant() is not None:
+            wait = None
+            deadline = self.get_deadline()
+            if deadline is not None:
+                wait = max(0, deadline.remaining())
+            try:
+                response, shared = inflight_requests.do(
+                    (self.hostname, self.get_tenant(), url),
+                    lambda: self._fetch(method, url, body, headers, stream, endpoint, relogin, cache_key, cached, ttl),
+                    wait)
+            except FlightTimeout:
+                raise DeadlineExceeded("Time budget exhausted waiting for " + str(endpoint))
+            if shared:
+                api_metrics.record_coalesced(endpoint)
+        else:
+            response = self._fetch(method, url, body, headers, stream, endpoint, relogin, cache_key, cached, ttl)
 
         try:
             # raise exception for error HTTP status (4xx, 5xx)
@@ -103,7 +720,164 @@ class MwmApi:
             #for error in response_dict["errors"]:
              #   print(error["errorCode"] + " => " + error["message"])
              #   print("DEBUG: " + error["moreInfo"])
-        
+
+    def _fetch(self, method, url, body, headers, stream, endpoint, relogin, cache_key, cached, ttl):
+        # Sends the request, with the login retry on 401 and the response cache update
+        response = self._send(method, url, body, headers, stream, endpoint)
+        #print(response)
+
+        if response.status_code == requests.codes.unauthorized and relogin and self.credentials is not None:
+            # Server session has expired, login again (or take a newer stored
+            # session) and replay the request once
+            print("Session expired. Calling login method...")
+            response.close()
+            if self.session_store is not None and self.cookie_jar is not None:
+                self.session_store.invalidate(self.get_session_key(), self.get_cookiejar_dict())
+            self.acquire_session()
+            response = self._send(method, url, body, headers, stream, endpoint, retry=True)
+
+        if cache_key is not None:
+            if response.status_code == requests.codes.not_modified and cached is not None:
+                response_cache.refresh(cached)
+                return cached.response
+            if response.status_code == requests.codes.ok:
+                response_cache.put(cache_key, response, ttl)
+        return response
+
+    def _send(self, method, url, body, headers, stream=False, endpoint=None, retry=False):
+        # Sends within the rate limits of the tenant, retrying idempotent
+        # requests the server throttled or failed to reach
+        limiter = get_rate_limiter(self.hostname, self.get_tenant())
+        deadline = self.get_deadline()
+        # Bound here, requests is loaded lazily and the error path must not depend on an earlier call
+        exceptions = _load_requests().exceptions
+        attempt = 0
+        while True:
+            wait = None
+            if deadline is not None:
+                wait = max(0, deadline.remaining() - MIN_REQUEST_BUDGET)
+            if not limiter.acquire(wait):
+                raise DeadlineExceeded("Time budget exhausted waiting for a request slot for " + str(endpoint))
+            try:
+                timeout = self.get_request_timeout()
+            except DeadlineExceeded:
+                limiter.cancel()
+                raise
+            start = time.time()
+            try:
+                response = self._session_request(method, url, body, headers, stream, timeout)
+            except Exception as e:
+                latency = time.time() - start
+                limiter.release(latency, None, retry or attempt > 0)
+                api_metrics.record(endpoint, latency, None, len(body or ""), 0, retry or attempt > 0)
+                if isinstance(e, exceptions.Timeout) and deadline is not None \
+                        and not deadline.allows(MIN_REQUEST_BUDGET):
+                    raise DeadlineExceeded("Time budget exhausted waiting for " + str(endpoint))
+                if isinstance(e, exceptions.ConnectionError) and method in IDEMPOTENT_METHODS \
+                        and self._wait_for_retry(limiter, attempt):
+                    print("Retrying " + str(endpoint) + " after error: " + str(e))
+                    attempt += 1
+                    continue
+                raise
+            latency = time.time() - start
+            limiter.release(latency, response.status_code, retry or attempt > 0)
+            # Endpoint of the decode metrics (get_response_json)
+            response.endpoint = endpoint
+            # Size on the wire, streamed bodies are not read here
+            bytes_received = 0
+            if not stream:
+                bytes_received = get_wire_bytes(response)
+            elif response.headers.get("Content-Length") is not None:
+                bytes_received = int(response.headers["Content-Length"])
+            api_metrics.record(endpoint, latency, response.status_code, len(body or ""), bytes_received,
+                               retry or attempt > 0)
+            if response.status_code in RETRY_STATUS_CODES and method in IDEMPOTENT_METHODS \
+                    and self._wait_for_retry(limiter, attempt, response.headers.get("Retry-After")):
+                print("Retrying " + str(endpoint) + " after HTTP " + str(response.status_code))
+                response.close()
+                attempt += 1
+                continue
+            return response
+
+    def _wait_for_retry(self, limiter, attempt, retry_after=None):
+        # Sleeps before a retry, False (no retry) when out of attempts, retry
+        # budget or time budget
+        if attempt >= RETRY_MAX_ATTEMPTS:
+            return False
+        delay = get_retry_delay(attempt, retry_after)
+        if delay is None:
+            return False
+        deadline = self.get_deadline()
+        if deadline is not None and not deadline.allows(delay + MIN_REQUEST_BUDGET):
+            return False
+        if not limiter.take_retry():
+            return False
+        time.sleep(delay)
+        return True
+
+    def _session_request(self, method, url, body, headers, stream, timeout=REQUEST_TIMEOUT):
+        if self.session is None:
+            self.session = get_http_session(self.pool_connections, self.pool_maxsize)
+        # Makes the request over the shared keep-alive session
+        return self.session.request(
+            method,                             # request method ("GET", "PUT", "POST", "DELETE")
+            url,                                # constructed url
+            timeout=timeout,                    # (connect, read) timeout for request
+            cookies=self.cookie_jar,            # session cookies to be passed after login
+            data=body,                          # request body
+            headers=headers,                    # headers to use ({"Content-Type": "application/json"})
+            verify=False,
+            stream=stream                       # body is read by the caller
+        )
+
+    def iter_pages(self, relative_path, query_parameters, items_key, page_size=PAGE_SIZE, errors=None):
+        """ Yields the records of a list resource, page by page
+
+        Each page is streamed and parsed record by record, so memory stays
+        bounded by one record whatever the size of the list.
+
+        :param relative_path: resource path of the list ("devices/manageddevices")
+        :param query_parameters: ampersand(&) separated query parameters, without paging
+        :param items_key: key of the record list in the response ("managedDevices")
+        :param page_size: records per request
+        :param errors: list the status code of a failed page is appended to (the records then stop early)
+        :return: generator of records
+        """
+        offset = 0
+        first_record = None
+        while True:
+            paging = QUERY_PAGING % (offset, page_size)
+            if query_parameters:
+                paging = query_parameters + "&" + paging
+            response = self.request(relative_path, paging, stream=True)
+            if response.status_code != requests.codes.ok:
+                print("Unrecognised status for " + relative_path + " fetch" + str(response.status_code))
+                response.close()
+                if errors is not None:
+                    errors.append(response.status_code)
+                return
+
+            count = 0
+            decode_stats = {"bytes": 0, "secs": 0.0}
+            try:
+                for record in iter_response_items(response, items_key, decode_stats):
+                    if count == 0:
+                        if offset > 0 and record == first_record:
+                            # Server ignores paging and sent the first page again
+                            return
+                        if offset == 0:
+                            first_record = record
+                    count += 1
+                    yield record
+            finally:
+                response.close()
+                api_metrics.record_decode(getattr(response, "endpoint", None), decode_stats["secs"],
+                                          decode_stats["bytes"])
+
+            # A short page is the last one. A server ignoring paging sends all records at once.
+            if count != page_size:
+                return
+            offset += count
 
     def login(self, client_identifier, session_timeout, kvs_service_data):
         """ Login to service
@@ -125,32 +899,39 @@ class MwmApi:
         response = self.request(
             PATH_LOGIN.format(client_identifier=client_identifier, session_timeout=session_timeout),
             method="POST",
-            body=json.dumps(auth_data)
+            body=json.dumps(auth_data),
+            relogin=False
         )
         #print("Response: " + response)
         if response.status_code == requests.codes.ok:
             #print(response.cookies)
             self.cookie_jar = response.cookies
-            return response.json()
+            self.set_credentials(client_identifier, session_timeout, kvs_service_data)
+            self.session_expires_at = time.time() + int(session_timeout) - SESSION_EXPIRY_MARGIN
+            return get_response_json(response)
         else:
             print("Unrecognised status for login" + str(response.status_code))
             raise
     
     def get_cookiejar_dict(self):
-            return requests.utils.dict_from_cookiejar(self.cookie_jar)
+            return _load_requests().utils.dict_from_cookiejar(self.cookie_jar)
 
     def set_cookiejar_from_dict(self, cookiejar_dict):
-        self.cookie_jar = requests.utils.cookiejar_from_dict(cookiejar_dict);
+        self.cookie_jar = _load_requests().utils.cookiejar_from_dict(cookiejar_dict);
 
     def logout(self):
         """ Logout from service """
 
         response = self.request(
             PATH_LOGOUT,
-            method="POST"
+            method="POST",
+            relogin=False
         )
 
         if response.status_code == requests.codes.ok:
+            if self.session_store is not None and self.credentials is not None:
+                self.session_store.invalidate(self.get_session_key(), self.get_cookiejar_dict())
+            self.session_expires_at = time.time()
             return
         else:
             print("Unrecognised status for logout" + str(response.status_code))
@@ -164,7 +945,7 @@ class MwmApi:
         response = self.request(PATH_SSID_PROFILES)
 
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for location tree fetch" + response.status_code)
 		
@@ -176,7 +957,7 @@ class MwmApi:
         response = self.request(PATH_LOCATION_TREE)
         
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for location tree fetch" + response.status_code)
 
@@ -185,26 +966,13 @@ class MwmApi:
 
         :return: response object
         """
-        query = "nodeid=0&locationid="+str(locid)
-        ap_mode_filter_value = {
-            "property": "devicemode",
-            "value": ["AP", "AP_SENSOR_COMBO"],
-            "operator": "="
-        }
-        query = query + "&" + QUERY_FILTER % json.dumps(ap_mode_filter_value)
-        if active_devices_only == True:
-            active_filter_value = {
-                    "property": "active",
-                    "value": [True],
-                    "operator": "="
-            }
-            query = query + "&" + QUERY_FILTER % json.dumps(active_filter_value)
+        query = get_managed_ap_devices_query(locid, active_devices_only)
         #print(query)
 
         response = self.request(PATH_MANAGED_DEVICES, query)
         print(response)
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for managed device fetch" + str(response.status_code))
 
@@ -215,17 +983,12 @@ class MwmApi:
         :return: response object
         """
 
-        filter_value = {
-                    "property": "locationid",
-                    "value": [locid],
-                    "operator": "="
-                }
-        query = QUERY_FILTER % json.dumps(filter_value)
+        query = get_clients_query(locid)
 
         response = self.request(PATH_CLIENTS, query)
 
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for managed device fetch" + response.status_code)
 
@@ -236,38 +999,43 @@ class MwmApi:
         :return: response object
         """
 
-        # Virtual AP with (boxid = 1) OR (group = AUTHORIZED)
-        filter_value = {
-            "value": [
-                {
-                    "property": "boxid",
-                    "value": [1],
-                    "operator": "="
-                },
-                {
-                    "property": "group",
-                    "value": ['AUTHORIZED'],
-                    "operator": "="
-                }
-            ],
-            "operator": "OR"
-        }
-        query = QUERY_FILTER % json.dumps(filter_value)
-
-        response = self.request(PATH_VIRTUAL_ACCESS_POINTS, query)
+        response = self.request(PATH_VIRTUAL_ACCESS_POINTS, get_virtual_aps_query())
 
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for virtual AP fetch" + response.status_code)
 
+    def iter_managed_ap_devices(self, locid, active_devices_only=False, page_size=PAGE_SIZE):
+        """ Managed AP devices at a location, streamed page by page
+
+        :return: generator of managed device records
+        """
+        query = get_managed_ap_devices_query(locid, active_devices_only)
+        return self.iter_pages(PATH_MANAGED_DEVICES, query, ITEMS_MANAGED_DEVICES, page_size)
+
+    def iter_clients(self, locid, page_size=PAGE_SIZE):
+        """ Clients at a location, streamed page by page
+
+        :return: generator of client records
+        """
+        return self.iter_pages(PATH_CLIENTS, get_clients_query(locid), ITEMS_CLIENTS, page_size)
+
+    def iter_virtual_aps(self, page_size=PAGE_SIZE):
+        """ Virtual APs, streamed page by page
+
+        :return: generator of virtual AP records
+        """
+        return self.iter_pages(PATH_VIRTUAL_ACCESS_POINTS, get_virtual_aps_query(), ITEMS_VIRTUAL_ACCESS_POINTS,
+                               page_size)
+
     def get_observing_managed_devices(self, boxid):
         print("Searching observing devices for boxid: " + str(boxid))
         query="isthirdradiosupported=true"
         response = self.request(PATH_OBSERVING_MANAGED_DEVICES.format(boxId=boxid), query)
 
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for managed device fetch" + response.status_code)
         
@@ -286,7 +1054,7 @@ class MwmApi:
         )
         print(response)
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status " + str(response.status_code))
 
@@ -297,7 +1065,7 @@ class MwmApi:
         response = self.request(PATH_CLIENT_CONN_TEST, query)
 
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for client conn test status" + str(response.status_code))
 
@@ -309,7 +1077,7 @@ class MwmApi:
             print("Unrecognised status for client conn test result: " + str(response.status_code))
             return {'rv': 1, 'error_string' : "Error reading test result"}
 
-        tresult = response.json()
+        tresult = get_response_json(response)
         return tresult
 
     def get_best_client_device_for_conn_test(self, target_boxid):
@@ -317,16 +1085,23 @@ class MwmApi:
         print(cldlist)
         if cldlist == None or len(cldlist) == 0:
             return None
+        pairs = rank_conn_test_pairs([{'boxId': target_boxid}], {target_boxid: cldlist})
         for cld in cldlist:
-            print("\n\nCLD:")
-            print(cld)
-            if "C130" not in cld['name']:
-                continue
-            if cld['boxId'] != target_boxid:
+            if len(pairs) > 0 and cld['boxId'] == pairs[0]['client_boxid']:
                 return cld
         return None
 
     def convert_conn_test_result_to_text(self, tresult):
+        outcome = self.get_conn_test_outcome(tresult)
+        if outcome == None:
+            return None
+        return outcome['sout']
+
+    def get_conn_test_outcome(self, tresult):
+        """ Spoken result of a live network test and whether it passed
+
+        :return: {'rv': 0 if an attempt passed else 1, 'sout'}, None if the result has no attempts
+        """
         if tresult == None or not isinstance(tresult, dict) or 'attempts' not in tresult:
             return None
         if len(tresult['attempts']) == 0:
@@ -339,12 +1114,12 @@ class MwmApi:
             if rv == None:
                 continue
             if rv['rv'] == 0:
-                return rv['sout']
+                return rv
             sout = rv['sout']
         if sout != None:
-            return sout
+            return {'rv': 1, 'sout': sout}
         
-        return "Unable to read result. Please try again"
+        return {'rv': 1, 'sout': "Unable to read result. Please try again"}
             
     def convert_conn_test_attemp_result_to_text(self, attempt):
         sout = ""
@@ -426,90 +1201,456 @@ class MwmApi:
         sout = sout + "End of test result."
         return {'rv': 0, 'sout': sout}
 
-    def do_client_conn_test_at_loc(self, locid):
+    def get_conn_test_pairs(self, locid, max_age=CONN_TEST_PAIRS_TTL):
+        """ Candidate device pairs for a live network test at a location, best first
+
+        The observing devices of the active APs are probed concurrently on the
+        worker pool, results are cached per location for max_age seconds.
+
+        :return: list of {'target_boxid', 'client_boxid', 'score'}, None on error
+        """
+        return self.get_conn_test_pairs_of_locations([locid], max_age)[locid]
+
+    def get_conn_test_pairs_of_locations(self, locids, max_age=CONN_TEST_PAIRS_TTL):
+        """ get_conn_test_pairs() of several locations, all probes issued together
+
+        The active APs of the locations are fetched concurrently, then the
+        probes of all locations are submitted to the worker pool at once.
+
+        :return: dict location id => list of pairs, None on error
+        """
+        pairs_by_locid = {}
+        with self.conn_test_pairs_lock:
+            for locid in locids:
+                cached = self.conn_test_pairs.get(locid)
+                if cached is not None and time.time() - cached[0] <= max_age:
+                    pairs_by_locid[locid] = cached[1]
+        pending = [locid for locid in locids if locid not in pairs_by_locid]
+
         #Get the list of managed AP devices that are active
-        resp = self.get_managed_ap_devices(locid, True)
-        if "managedDevices" not in resp:
-            return {'rv':1, 'error_string': "Internal error"}
-        #print(resp)
-        mdlist = resp['managedDevices']
-        #Iterate over the list and select the first device that 
-        #has a neighboring 3-radio AP to act as a client
-        test_devices_found = False
-        for md in mdlist:
-            print(md)
-            if "C130" not in md['name']:
+        device_futures = [(locid, self.submit(self.get_managed_ap_devices, locid, True)) for locid in pending]
+        deadline = self.get_deadline()
+        probes = []
+        for locid, future in device_futures:
+            try:
+                resp = future.result()
+            except Exception as e:
+                print("Managed devices fetch failed for location " + str(locid) + ": " + str(e))
+                resp = None
+            if resp is None or "managedDevices" not in resp:
+                pairs_by_locid[locid] = None
                 continue
-            target_boxid = md['boxId']
-            cld = self.get_best_client_device_for_conn_test(target_boxid)
-            if cld != None:
-                client_boxid = cld['boxId']
-                print("\nFound client device with boxid: " + str(client_boxid))
-                test_devices_found = True
-                break
-        if test_devices_found == False:
+            mdlist = sorted(resp['managedDevices'], key=lambda md: -get_conn_test_capability(md))
+            mdlist = mdlist[:CONN_TEST_MAX_PROBES]
+            if deadline is not None and not deadline.allows(MIN_REQUEST_BUDGET):
+                pairs_by_locid[locid] = None
+                continue
+            probes.append((locid, mdlist, [self.submit(self.get_observing_managed_devices, md['boxId'])
+                                           for md in mdlist]))
+
+        for locid, mdlist, futures in probes:
+            observers_by_boxid = {}
+            for md, future in zip(mdlist, futures):
+                try:
+                    observers_by_boxid[md['boxId']] = future.result()
+                except Exception as e:
+                    print("Observing devices fetch failed for boxid " + str(md['boxId']) + ": " + str(e))
+
+            pairs = rank_conn_test_pairs(mdlist, observers_by_boxid)
+            with self.conn_test_pairs_lock:
+                self.conn_test_pairs[locid] = (time.time(), pairs)
+            pairs_by_locid[locid] = pairs
+        return pairs_by_locid
+
+    def invalidate_conn_test_pairs(self, locid=None):
+        """ Drops cached test device pairs of a location (all locations if None) """
+        with self.conn_test_pairs_lock:
+            if locid is None:
+                self.conn_test_pairs.clear()
+            else:
+                self.conn_test_pairs.pop(locid, None)
+
+    def find_conn_test_devices_at_loc(self, locid):
+        """ Selects the target AP and the 3-radio AP acting as client for a live test
+
+        :return: (target_boxid, client_boxid), None if no suitable pair, -1 on error
+        """
+        pairs = self.get_conn_test_pairs(locid)
+        if pairs is None:
+            return -1
+        if len(pairs) == 0:
+            return None
+        print("\nFound client device with boxid: " + str(pairs[0]['client_boxid']))
+        return (pairs[0]['target_boxid'], pairs[0]['client_boxid'])
+
+    def start_client_conn_test_at_loc(self, locid):
+        """ Starts a live network test and returns without waiting for it
+
+        :return: {'rv': 0, 'test': {'session_id', 'locid', 'started_at'}} or {'rv': 1, 'error_string'}
+        """
+        devices = self.find_conn_test_devices_at_loc(locid)
+        if devices == -1:
+            return {'rv':1, 'error_string': "Internal error"}
+        if devices is None:
             return {'rv':1, 'error_string': "Suitable test devices not found at the location"}
 
-        test_profile_id = 8
-        tstatus = self.start_client_conn_test(locid, target_boxid, client_boxid, test_profile_id)
+        target_boxid, client_boxid = devices
+        tstatus = self.start_client_conn_test(locid, target_boxid, client_boxid, CONN_TEST_PROFILE_ID)
         if tstatus == None or 'sessionId' not in tstatus:
+            # Devices may have gone away, select them again on the next attempt
+            self.invalidate_conn_test_pairs(locid)
             return {'rv':1, 'error_string': "Unable to start connectivity test. Please try again"}
-        session_id = tstatus['sessionId']
-        wt = 0
-        while wt < 120:
-            print("Waiting for test result, polling after 10secs")
-            time.sleep(5)
-            wt += 10
-            tstatus = self.get_client_conn_test_status(locid, session_id)
-            print(tstatus)
-            if tstatus == None or len(tstatus) == 0 or 'sessionStatus' not in tstatus[0]:
-               return {'rv':1, 'error_string': "Unable to start connectivity test. Please try again"}
-            if tstatus[0]['sessionStatus'] == "CL_CONNEC_COMPLETED":
-                tresult = self.get_client_conn_test_result(session_id)
-                print(tresult)
-                result_text = self.convert_conn_test_result_to_text(tresult)
-                if result_text != None:
-                    return {'rv':0, 'result_text': result_text}
-
-        return {'rv':1, 'error_string': "Timeout waiting for test result. Please try again"}
+        return {'rv': 0, 'test': {'session_id': tstatus['sessionId'], 'locid': locid, 'started_at': time.time()}}
 
+    def check_client_conn_test(self, test):
+        """ Polls a started live network test once
+
+        :param test: test handle from start_client_conn_test_at_loc
+        :return: {'rv': 0, 'completed': False} while running,
+                 {'rv': 0, 'completed': True, 'result_text'} when done,
+                 {'rv': 1, 'error_string'} on failure or timeout
+        """
+        tstatus = self.get_client_conn_test_status(test['locid'], test['session_id'])
+        if tstatus == None or len(tstatus) == 0 or 'sessionStatus' not in tstatus[0]:
+            return {'rv':1, 'error_string': "Unable to get the test status. Please try again"}
+        if tstatus[0]['sessionStatus'] == CONN_TEST_COMPLETED:
+            tresult = self.get_client_conn_test_result(test['session_id'])
+            outcome = self.get_conn_test_outcome(tresult)
+            if outcome == None:
+                # Completed without a readable result, polling again would not change it
+                return {'rv':1, 'error_string': "Unable to read the test result. Please try again"}
+            self.record_conn_test(test, outcome, tresult)
+            return {'rv':0, 'completed': True, 'result_text': outcome['sout']}
+        if time.time() - test['started_at'] > CONN_TEST_TIMEOUT:
+            return {'rv':1, 'error_string': "Timeout waiting for test result. Please try again"}
+        return {'rv': 0, 'completed': False}
+
+    def record_conn_test(self, test, outcome, tresult):
+        """ Adds a completed test to the test history, if one is set
+
+        A failure to record is logged, it does not fail the test.
+        """
+        test_history = self.get_test_history()
+        if test_history is None:
+            return
+        location_name = test.get('location')
+        index = self.location_index
+        if index is not None and index.get_name(test['locid']) is not None:
+            location_name = index.get_name(test['locid'])
+        try:
+            test_history.record(self.get_session_key(), test['session_id'], test['locid'], location_name,
+                                outcome['rv'] == 0, outcome['sout'], tresult)
+        except Exception as e:
+            print("Test history record failed for session " + str(test['session_id']) + ": " + str(e))
+
+    def wait_client_conn_test(self, test, max_wait):
+        """ Polls a started live network test with growing intervals for at most max_wait seconds
+
+        :param test: test handle from start_client_conn_test_at_loc
+        :param max_wait: seconds to wait for completion
+        :return: last check_client_conn_test result
+        """
+        deadline = time.time() + max_wait
+        interval = CONN_TEST_POLL_INITIAL
+        while True:
+            time.sleep(max(0, min(interval, deadline - time.time())))
+            status = self.check_client_conn_test(test)
+            if status['rv'] != 0 or status['completed'] or time.time() >= deadline:
+                return status
+            interval = min(interval * CONN_TEST_POLL_BACKOFF, CONN_TEST_POLL_MAX)
+
+    def do_client_conn_test_at_loc(self, locid):
+        """ Runs a live network test and waits for its result (up to CONN_TEST_TIMEOUT seconds) """
+        started = self.start_client_conn_test_at_loc(locid)
+        if started['rv'] != 0:
+            return started
+        test = started['test']
+        status = self.wait_client_conn_test(test, CONN_TEST_TIMEOUT)
+        if status['rv'] != 0:
+            return status
+        if not status['completed']:
+            return {'rv':1, 'error_string': "Timeout waiting for test result. Please try again"}
+        return {'rv':0, 'result_text': status['result_text']}
+
+
+    def get_location_index(self, max_age=LOCATION_INDEX_TTL):
+        """ Location tree index, fetched again only when older than max_age seconds
+
+        :param max_age: max age in seconds of the cached index
+        :return: LocationIndex (None if the tree could not be fetched)
+        """
+        with self.location_index_lock:
+            index = self.location_index
+            if index is None or time.time() - index.built_at > max_age:
+                loctree = self.get_location_tree()
+                if loctree is None:
+                    return index
+                index = LocationIndex(loctree, time.time())
+                self.location_index = index
+            return index
+
+    def invalidate_location_index(self):
+        """ Drops the cached location index, the next lookup fetches the tree again """
+        with self.location_index_lock:
+            self.location_index = None
+        self.invalidate_response_cache(PATH_LOCATION_TREE)
 
     def get_location_id_by_name(self, location):
         if location == None:
             return -2
-        loctree = self.get_location_tree()
-        loclist = loctree['locations']
-        for loc in loclist:
-            if location.lower() == loclist[loc]['name'].lower():
-                return loclist[loc]['id']['id']
+        index = self.get_location_index()
+        if index is None:
+            return -2
+        locid = index.find(location)
+        if locid is None:
+            return -2
+        return locid
+
+    def _iter_inventory(self, kind, modified_since=None):
+        # All records of a kind, or those modified since a time; raises
+        # InventorySyncError at the end if a page could not be fetched
+        modified_filter = ""
+        if modified_since is not None:
+            modified_filter = "&" + QUERY_FILTER % json.dumps(
+                {"property": MODIFIED_TIME_PROPERTY, "value": [modified_since], "operator": ">="})
+        errors = []
+        if kind == KIND_VIRTUAL_APS:
+            pages = [(PATH_VIRTUAL_ACCESS_POINTS, get_virtual_aps_query(), ITEMS_VIRTUAL_ACCESS_POINTS)]
+        else:
+            index = self.get_location_index()
+            if index is None:
+                raise InventorySyncError("Location tree unavailable")
+            pages = [(PATH_MANAGED_DEVICES, get_managed_ap_devices_query(root_id), ITEMS_MANAGED_DEVICES)
+                     for root_id in index.get_roots()]
+        for relative_path, query, items_key in pages:
+            for record in self.iter_pages(relative_path, query + modified_filter, items_key, errors=errors):
+                yield record
+        if len(errors) > 0:
+            raise InventorySyncError("Inventory fetch failed with status " + str(errors[0]))
+
+    def sync_inventory(self, kinds=INVENTORY_KINDS, full=False):
+        """ Brings the local inventory up to date
+
+        A sync is incremental (records modified since the last sync) when the
+        records carry a modification time and the last full sync is less than
+        INVENTORY_FULL_SYNC_INTERVAL old, full otherwise. It reads the whole
+        inventory of the tenant, so it runs from a scheduled handler and not
+        while an answer is awaited. Failures are counted in the store stats.
+
+        :param kinds: mwmInventory kinds to sync
+        :param full: force a full sync
+        :return: dict kind => list of deltas (mwmInventory.InventoryStore.sync), None if
+                 no inventory is kept or a sync failed (the store is left as it was)
+        """
+        inventory = self.get_inventory()
+        if inventory is None:
+            return None
+        _load_requests()
+        key = self.get_session_key()
+        deltas = {}
+        for kind in kinds:
+            state = inventory.get_sync_state(key, kind)
+            incremental = not full and state is not None and state['modified_since'] is not None and \
+                time.time() - state['full_synced_at'] < INVENTORY_FULL_SYNC_INTERVAL
+            modified_since = None
+            if incremental:
+                modified_since = state['modified_since']
+            try:
+                deltas[kind] = inventory.sync(key, kind, self._iter_inventory(kind, modified_since), not incremental)
+            except (InventorySyncError, DeadlineExceeded, requests.exceptions.RequestException):
+                return None
+        return deltas
+
+    def is_inventory_fresh(self, kinds=(KIND_MANAGED_DEVICES,), max_age=INVENTORY_MAX_AGE):
+        """ True if the inventory is kept and its kinds were synced less than max_age seconds ago """
+        inventory = self.get_inventory()
+        if inventory is None:
+            return False
+        return inventory.is_fresh(self.get_session_key(), kinds, max_age)
+
+    def get_inventory_device_counts(self, locid):
+        """ Active and inactive AP counts per location of a subtree from the local inventory
+
+        The inventory is only read, never synced here (sync_inventory).
+
+        :return: dict location id => [active, inactive] (mwmRollup.count_devices_by_location),
+                 None when no inventory is kept or it is older than INVENTORY_MAX_AGE
+        """
+        if not self.is_inventory_fresh():
+            return None
+        index = self.get_location_index()
+        if index is None:
+            return None
+        return self.get_inventory().count_devices_by_location(self.get_session_key(),
+                                                              set(index.get_descendants(locid)))
 
-        return -2
+    def get_device_counts_by_location(self, locid):
+        """ Active and inactive AP counts per location of a subtree, from the local
+        inventory when one is kept, streamed from the API otherwise """
+        counts = self.get_inventory_device_counts(locid)
+        if counts is None:
+            counts = count_devices_by_location(self.iter_managed_ap_devices(locid))
+        return counts
 
     def get_device_count_at_location(self, locid):
-        mdresp = self.get_managed_ap_devices(locid)
+        counts = self.get_inventory_device_counts(locid)
+        if counts is not None:
+            return {'active': sum(count[0] for count in counts.values()),
+                    'inactive': sum(count[1] for count in counts.values())}
+
         active_devices = 0
         inactive_devices=0
-        if mdresp != None and "managedDevices" in mdresp:
-            mdlist = mdresp['managedDevices']
-            for md in mdlist:
-                if md['active'] == True:
-                    active_devices = active_devices + 1
-                else:
-                    inactive_devices = inactive_devices + 1
+        # Counted while streaming, the device list is never held in memory
+        for md in self.iter_managed_ap_devices(locid):
+            if md['active'] == True:
+                active_devices = active_devices + 1
+            else:
+                inactive_devices = inactive_devices + 1
 
         return {'active':active_devices, 'inactive':inactive_devices}
 
     def get_client_conn_stats_at_location(self, locid):
         time_secs = int(time.time()) - 300
-        query = "locationid="+str(locid)+"&fromtime="+str(time_secs)+"&totime="+str(time_secs)
+        query = get_client_conn_stats_query(locid, time_secs, time_secs)
 
         response = self.request(PATH_CLIENT_CONN_STATS, query)
 
         if response.status_code == requests.codes.ok:
-            return response.json()
+            return get_response_json(response)
         else:
             print("Unrecognised status for managed device fetch" + response.status_code)
 
+    def get_client_conn_stats_between(self, locid, from_time, to_time):
+        """ Client connection success and failure counts at a location over an interval
+
+        :param from_time: epoch seconds of the interval start
+        :param to_time: epoch seconds of the interval end
+        :return: (successCount, failureCount), None on failure
+        """
+        response = self.request(PATH_CLIENT_CONN_STATS, get_client_conn_stats_query(locid, from_time, to_time))
+        if response.status_code != requests.codes.ok:
+            print("Unrecognised status for connectivity stats fetch " + str(response.status_code))
+            return None
+        stats = get_response_json(response)
+        return stats.get('successCount', 0), stats.get('failureCount', 0)
+
+    def get_client_conn_stats_windows(self, locid, windows):
+        """ Client connection stats of several time windows at a location
+
+        Intervals fetched before (by any MwmApi of the tenant in the process)
+        are reused, only what the windows add is fetched (mwmConnStats).
+
+        :param windows: (start, end) pairs of epoch seconds, aligned to CONN_STATS_BUCKET
+        :return: list of mwmConnStats.get_window_stats() dicts, None on failure
+        """
+        return conn_stats_store.get_windows(
+            (self.hostname, self.get_tenant(), locid),
+            lambda from_time, to_time: self.get_client_conn_stats_between(locid, from_time, to_time),
+            windows)
+
+    def get_client_conn_stats_trend(self, locid, window=CONN_STATS_TREND_WINDOW, offset=CONN_STATS_TREND_OFFSET):
+        """ Client connection stats of the latest window and of the same window earlier
+
+        :param window: seconds of the windows (last hour)
+        :param offset: seconds between the windows (yesterday)
+        :return: {'current', 'previous'} get_window_stats() dicts, None on failure
+        """
+        end = get_conn_stats_time()
+        stats = self.get_client_conn_stats_windows(locid, [(end - window, end), (end - offset - window, end - offset)])
+        if stats is None:
+            return None
+        return {'current': stats[0], 'previous': stats[1]}
+
+    def iter_association_data(self, start_time, end_time):
+        """ Association records of a time range, streamed record by record
+
+        :param start_time: epoch seconds of the range start
+        :param end_time: epoch seconds of the range end
+        :return: generator of association records, None if the fetch failed
+        """
+        path = PATH_ASSOCIATION_ANALYTICS.format(start_time=start_time, end_time=end_time)
+        response = self.request(path, QUERY_FILE_FORMAT % "json" + "&" + QUERY_MAC_OBFUSCATE % "true", stream=True)
+        if response.status_code != requests.codes.ok:
+            print("Unrecognised status for association data fetch " + str(response.status_code))
+            response.close()
+            return None
+        return self._iter_streamed(response, ASSOCIATION_ITEMS_KEY)
+
+    def _iter_streamed(self, response, items_key):
+        decode_stats = {"bytes": 0, "secs": 0.0}
+        try:
+            for record in iter_response_items(response, items_key, decode_stats):
+                yield record
+        finally:
+            response.close()
+            api_metrics.record_decode(getattr(response, "endpoint", None), decode_stats["secs"], decode_stats["bytes"])
+
+    def get_association_aggregate(self, start_time, end_time):
+        """ AssociationAggregate of one time range, None if the fetch failed or the deadline passed """
+        records = self.iter_association_data(start_time, end_time)
+        if records is None:
+            return None
+        aggregate = AssociationAggregate()
+        deadline = self.get_deadline()
+        try:
+            for record in records:
+                aggregate.add(record)
+                if deadline is not None and aggregate.records % ASSOCIATION_DEADLINE_CHECK == 0 \
+                        and deadline.expired():
+                    print("Time budget exhausted summing up association data")
+                    return None
+        finally:
+            records.close()
+        return aggregate
+
+    def get_association_summary(self, start_time, end_time, top=3, chunk=ASSOCIATION_CHUNK):
+        """ Association failure summary over a time range, per AP and per SSID
+
+        The range is fetched in chunks, up to MAX_CONCURRENT_CALLS at once,
+        each streamed and summed up as it arrives, so memory does not grow
+        with the range. When the deadline runs short or a chunk fails, the
+        chunks done before it are summed up and 'complete' is False.
+
+        :param start_time: epoch seconds of the range start
+        :param end_time: epoch seconds of the range end
+        :param top: APs, SSIDs and failure reasons listed
+        :return: mwmAssociation.AssociationAggregate.get_summary() dict plus 'from', 'to'
+                 (end of the time summed up) and 'complete', None if no chunk could be fetched
+        """
+        chunks = get_time_chunks(start_time, end_time, chunk)
+        aggregate = AssociationAggregate()
+        covered_until = start_time
+        complete = True
+        deadline = self.get_deadline()
+        while len(chunks) > 0 and complete:
+            if deadline is not None and not deadline.allows(ASSOCIATION_CHUNK_MIN_BUDGET):
+                complete = False
+                break
+            batch = chunks[:MAX_CONCURRENT_CALLS]
+            chunks = chunks[MAX_CONCURRENT_CALLS:]
+            futures = [self.submit(self.get_association_aggregate, chunk_start, chunk_end)
+                       for chunk_start, chunk_end in batch]
+            # Chunks are summed up in time order, up to the first one missing
+            for (chunk_start, chunk_end), future in zip(batch, futures):
+                try:
+                    part = future.result()
+                except Exception as e:
+                    # A failed chunk (deadline, transport, decoding) ends the range like a missing one
+                    print("Association data of " + str(chunk_start) + "-" + str(chunk_end) + " failed: " + str(e))
+                    part = None
+                if part is None or not complete:
+                    complete = False
+                    continue
+                aggregate.merge(part)
+                covered_until = chunk_end
+        if covered_until == start_time and start_time < end_time:
+            return None
+        summary = aggregate.get_summary(top)
+        summary['from'] = start_time
+        summary['to'] = covered_until
+        summary['complete'] = complete
+        return summary
+
     def get_client_counts_at_loc(self, locid):
         cl_conn = self.get_client_conn_stats_at_location(locid)
         #print(cl_conn)
@@ -523,6 +1664,32 @@ class MwmApi:
 
         return {'successCount': cl_succ, 'failureCount': cl_fail}
 
+    def get_status_rollup(self, locid):
+        """ AP and client counts of every location of a subtree, summed up the hierarchy
+
+        The device and client lists of the subtree and its connectivity stats
+        are fetched once each (concurrently) and grouped by location while
+        streaming, whatever the number of locations. AP counts come from the
+        local inventory when one is kept (set_inventory).
+
+        :param locid: location id of the subtree root
+        :return: {'locid', 'locations': mwmRollup.rollup_status() dict, 'successCount', 'failureCount'},
+                 None if the location is unknown
+        """
+        index = self.get_location_index()
+        if index is None or index.get_name(locid) is None:
+            return None
+        device_counts, client_counts, conn_counts = self.gather(
+            (self.get_device_counts_by_location, locid),
+            (lambda: count_clients_by_location(self.iter_clients(locid)),),
+            (self.get_client_counts_at_loc, locid))
+        return {
+            'locid': locid,
+            'locations': rollup_status(index, locid, device_counts, client_counts),
+            'successCount': conn_counts['successCount'],
+            'failureCount': conn_counts['failureCount'],
+        }
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,179 @@
+# Association failure summaries over long time ranges
+#
+# analytics/associationdata is fetched in time chunks, each streamed record by
+# record, and folded into per AP and per SSID counters as it arrives. Memory is
+# bounded by the number of APs, SSIDs and failure reasons, not by the number of
+# records: association times go into log scale histograms, from which
+# percentiles are read to within half a bucket (ASSOCIATION_TIME_GROWTH). The
+# histograms are sparse, an AP holds only the buckets its times fall in.
+import math
+
+# Association record fields
+ASSOCIATION_ITEMS_KEY = "associationData"
+ASSOCIATION_SUCCESS = "SUCCESS"
+UNKNOWN_REASON = "unknown"
+
+# Association time histogram: bucket i holds times up to FIRST * GROWTH^i milli-seconds
+ASSOCIATION_TIME_FIRST = 1.0
+ASSOCIATION_TIME_GROWTH = 1.1
+ASSOCIATION_TIME_BUCKETS = 128      # up to about 200 seconds, longer times go in the last bucket
+ASSOCIATION_PERCENTILES = (50, 90, 99)
+_LOG_GROWTH = math.log(ASSOCIATION_TIME_GROWTH)
+
+
+def get_time_bucket(ms):
+    """ Histogram bucket of an association time """
+    if ms <= ASSOCIATION_TIME_FIRST:
+        return 0
+    return min(ASSOCIATION_TIME_BUCKETS - 1, int(math.ceil(math.log(ms / ASSOCIATION_TIME_FIRST) / _LOG_GROWTH)))
+
+
+class AssociationStats:
+    """ Association counts, failure reasons and time histogram of one group (AP, SSID or all) """
+
+    def __init__(self):
+        self.total = 0
+        self.failures = 0
+        self.reasons = {}       # failure reason => count
+        self.times = {}         # histogram bucket => count, buckets without times left out
+        self.timed = 0
+
+    def add(self, success, reason, ms):
+        self.total += 1
+        if not success:
+            self.failures += 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        if ms is not None:
+            bucket = get_time_bucket(ms)
+            self.times[bucket] = self.times.get(bucket, 0) + 1
+            self.timed += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.failures += other.failures
+        for reason in other.reasons:
+            self.reasons[reason] = self.reasons.get(reason, 0) + other.reasons[reason]
+        for bucket in other.times:
+            self.times[bucket] = self.times.get(bucket, 0) + other.times[bucket]
+        self.timed += other.timed
+
+    def get_percentile(self, percentile):
+        """ Association time (milli-seconds) below which the given percent of times fall, None without times """
+        if self.timed == 0:
+            return None
+        rank = int(math.ceil(self.timed * percentile / 100.0))
+        seen = 0
+        for i in sorted(self.times):
+            seen += self.times[i]
+            if seen >= max(1, rank):
+                break
+        # Geometric middle of the bucket
+        if i == 0:
+            return ASSOCIATION_TIME_FIRST
+        return ASSOCIATION_TIME_FIRST * ASSOCIATION_TIME_GROWTH ** (i - 0.5)
+
+    def get_summary(self, top_reasons=3):
+        """ {'total', 'failures', 'failureRate', 'reasons': [(reason, count)] most frequent first,
+             'p50', 'p90', 'p99' (milli-seconds)} """
+        summary = {
+            'total': self.total,
+            'failures': self.failures,
+            'failureRate': float(self.failures) / self.total if self.total > 0 else None,
+            'reasons': sorted(self.reasons.items(), key=lambda item: (-item[1], item[0]))[:top_reasons],
+        }
+        for percentile in ASSOCIATION_PERCENTILES:
+            summary['p' + str(percentile)] = self.get_percentile(percentile)
+        return summary
+
+
+class AssociationAggregate:
+    """ AssociationStats of all records, per AP (boxId) and per SSID """
+
+    def __init__(self):
+        self.all = AssociationStats()
+        self.aps = {}           # boxId => AssociationStats
+        self.ap_names = {}      # boxId => AP name when the records carry one
+        self.ssids = {}         # SSID => AssociationStats
+        self.records = 0
+
+    def add(self, record):
+        """ Counts one association record """
+        success = record.get('status') == ASSOCIATION_SUCCESS
+        reason = record.get('failureReason') or UNKNOWN_REASON
+        ms = record.get('associationTime')
+        if ms is not None:
+            try:
+                ms = float(ms)
+            except (TypeError, ValueError):
+                ms = None
+        self.records += 1
+        self.all.add(success, reason, ms)
+        boxid = record.get('boxId')
+        if boxid is not None:
+            stats = self.aps.get(boxid)
+            if stats is None:
+                stats = self.aps[boxid] = AssociationStats()
+                if record.get('apName'):
+                    self.ap_names[boxid] = record['apName']
+            stats.add(success, reason, ms)
+        ssid = record.get('ssid')
+        if ssid is not None:
+            stats = self.ssids.get(ssid)
+            if stats is None:
+                stats = self.ssids[ssid] = AssociationStats()
+            stats.add(success, reason, ms)
+
+    def add_all(self, records):
+        """ Counts records from an iterable (a streamed chunk), returns self """
+        for record in records:
+            self.add(record)
+        return self
+
+    def merge(self, other):
+        """ Adds the counts of another aggregate (of another time chunk) """
+        self.records += other.records
+        self.all.merge(other.all)
+        for groups, other_groups in ((self.aps, other.aps), (self.ssids, other.ssids)):
+            for key in other_groups:
+                stats = groups.get(key)
+                if stats is None:
+                    stats = groups[key] = AssociationStats()
+                stats.merge(other_groups[key])
+        for boxid in other.ap_names:
+            self.ap_names.setdefault(boxid, other.ap_names[boxid])
+
+    def get_summary(self, top=3):
+        """ Compact summary to speak
+
+        :param top: APs, SSIDs and failure reasons listed
+        :return: AssociationStats.get_summary() of all records, plus 'aps' and 'ssids':
+                 lists of group summaries with 'boxId' and 'name' / 'ssid', most failures first
+        """
+        summary = self.all.get_summary(top)
+        summary['aps'] = []
+        for boxid in _most_failures(self.aps, top):
+            ap = self.aps[boxid].get_summary(1)
+            ap['boxId'] = boxid
+            ap['name'] = self.ap_names.get(boxid, "Access Point " + str(boxid))
+            summary['aps'].append(ap)
+        summary['ssids'] = []
+        for ssid in _most_failures(self.ssids, top):
+            group = self.ssids[ssid].get_summary(1)
+            group['ssid'] = ssid
+            summary['ssids'].append(group)
+        return summary
+
+
+def _most_failures(groups, count):
+    ranked = sorted((key for key in groups if groups[key].failures > 0),
+                    key=lambda key: (-groups[key].failures, str(key)))
+    return ranked[:count]
+
+
+def get_time_chunks(start_time, end_time, chunk):
+    """ (start, end) pairs covering [start_time, end_time) in chunk seconds long pieces """
+    chunks = []
+    while start_time < end_time:
+        chunks.append((start_time, min(end_time, start_time + chunk)))
+        start_time += chunk
+    return chunks
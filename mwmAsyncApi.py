@@ -0,0 +1,478 @@
+# asyncio version of the MwmApi client (Python 3.5+, needs aiohttp)
+#
+# Same method names and return shapes as mwmApi.MwmApi, every call is a
+# coroutine. One event loop can serve many intents concurrently instead of
+# pinning a thread per in-flight request.
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from mwmApi import (
+    MwmApi, HTTPS, REQUEST_TIMEOUT, PATH_API_WEBSERVICE, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, SESSION_EXPIRY_MARGIN,
+    LOCATION_INDEX_TTL, CONN_TEST_PROFILE_ID, CONN_TEST_COMPLETED, CONN_TEST_TIMEOUT,
+    CONN_TEST_POLL_INITIAL, CONN_TEST_POLL_MAX, CONN_TEST_POLL_BACKOFF, HEADER_JSON_CONTENT, PATH_LOGIN, PATH_LOGOUT, PATH_LOCATION_TREE,
+    PATH_MANAGED_DEVICES, PATH_OBSERVING_MANAGED_DEVICES, PATH_CLIENTS, PATH_CLIENT_CONN_STATS,
+    PATH_VIRTUAL_ACCESS_POINTS, PATH_SSID_PROFILES, PATH_CLIENT_CONN_TEST,
+    build_api_url, get_managed_ap_devices_query, get_clients_query, get_virtual_aps_query,
+    get_client_conn_stats_query, get_conn_test_capability, rank_conn_test_pairs,
+    CONN_TEST_PAIRS_TTL, CONN_TEST_MAX_PROBES, MAX_CONCURRENT_CALLS, ACCEPT_ENCODING, get_response_json
+)
+from mwmLocations import LocationIndex
+from mwmMetrics import api_metrics, endpoint_template
+
+HTTP_OK = 200
+HTTP_UNAUTHORIZED = 401
+
+
+class AsyncResponse:
+    """ Fully read HTTP response, mirrors the requests.Response attributes MwmApi uses """
+
+    def __init__(self, status_code, headers, content, cookies, endpoint=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.cookies = cookies
+        self.endpoint = endpoint
+
+    def json(self):
+        return get_response_json(self)
+
+    def __repr__(self):
+        return "<AsyncResponse [%d]>" % self.status_code
+
+
+class AsyncMwmApi:
+
+    def __init__(self, hostname, cookie_jar, pool_connections=HTTP_POOL_CONNECTIONS,
+                 pool_maxsize=HTTP_POOL_MAXSIZE, scheme=HTTPS):
+        """
+        :param hostname: server hostname (Example: "training.mojonetworks.com")
+        :param cookie_jar: session cookies dict from a previous login (None if not logged in)
+        :param pool_connections: max hosts to keep connections for
+        :param pool_maxsize: max keep-alive connections per host
+        :param scheme: url scheme, HTTP only for a local stand-in server ("127.0.0.1:8080")
+        :return:
+        """
+        self.hostname = hostname
+        self.scheme = scheme
+        self.cookie_jar = cookie_jar
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.session = None
+        self.credentials = None
+        self.session_expires_at = None
+        self.location_index = None
+        # (event loop, asyncio.Lock) created on first use in the running loop,
+        # before Python 3.10 a lock is bound to the loop current when it is created
+        self.location_index_lock = None
+        self.conn_test_pairs = {}
+        self.deadline = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.logout()
+        await self.close()
+        self.hostname = None
+        self.cookie_jar = None
+
+    def get_session(self):
+        # Created lazily, aiohttp sessions must be created inside the running loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_connections * self.pool_maxsize,
+                limit_per_host=self.pool_maxsize,
+                ssl=False
+            )
+            # Login cookies belong to this instance (cookie_jar), not to the connection pool
+            self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                                 headers={"Accept-Encoding": ACCEPT_ENCODING})
+        return self.session
+
+    async def close(self):
+        """ Closes the pooled connections """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def set_deadline(self, deadline):
+        """ Bounds the timeouts of the following requests by a time budget (mwmDeadline.Deadline) """
+        self.deadline = deadline
+
+    def get_request_timeout(self):
+        if self.deadline is None:
+            return aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        connect, total = self.deadline.get_timeouts(REQUEST_TIMEOUT)
+        return aiohttp.ClientTimeout(total=total, connect=connect)
+
+    def set_credentials(self, client_identifier, session_timeout, kvs_service_data):
+        """ Remember login parameters, used to login again when the session expires """
+        self.credentials = (client_identifier, session_timeout, kvs_service_data)
+
+    def is_session_expired(self):
+        """ True if the login session timeout (minus SESSION_EXPIRY_MARGIN) has passed """
+        if self.session_expires_at is None:
+            return False
+        return time.time() >= self.session_expires_at
+
+    def get_cookiejar_dict(self):
+        return dict(self.cookie_jar or {})
+
+    def set_cookiejar_from_dict(self, cookiejar_dict):
+        self.cookie_jar = dict(cookiejar_dict)
+
+    async def gather(self, *calls):
+        """ Awaits independent calls concurrently
+
+        ap_count, client_count = await mwm_api.gather(
+            (mwm_api.get_device_count_at_location, locid),
+            (mwm_api.get_client_counts_at_loc, locid))
+
+        :param calls: tuples of (coroutine function, arg1, arg2, ...)
+        :return: list of call results in the order of calls
+        """
+        return list(await asyncio.gather(*[call[0](*call[1:]) for call in calls]))
+
+    async def request(self, relative_path='', query_parameters='', method="GET", body=None, url=None,
+                      headers=HEADER_JSON_CONTENT, relogin=True):
+        """ Common coroutine for making API calls and returning content
+
+        :param relative_path: resource path to be queried ("devices/clients")
+        :param query_parameters: ampersand(&) separated query parameters ("locationid=1&nodeid=1")
+        :param method: request method ("GET", "PUT", "POST", "DELETE")
+        :param body: request body as string (used for methods like POST, PUT)
+        :param url: used to specify custom url (https://www.mojo.com/new/webservice/V4/devices/clients?locationid=1")
+        :param headers: request headers
+        :param relogin: login again and retry once if the server returns 401 and credentials are known
+        :return: AsyncResponse
+        """
+        if url is None:
+            url = build_api_url(self.hostname, relative_path, query_parameters, self.scheme)
+        endpoint = endpoint_template(relative_path or url.split(PATH_API_WEBSERVICE, 1)[-1])
+        response = await self._send(method, url, body, headers, endpoint)
+
+        if response.status_code == HTTP_UNAUTHORIZED and relogin and self.credentials is not None:
+            print("Session expired. Calling login method...")
+            await self.login(*self.credentials)
+            response = await self._send(method, url, body, headers, endpoint, retry=True)
+
+        if response.status_code >= 400:
+            print("\nException: \n........................\n")
+            print("HTTP Error " + str(response.status_code) + " for url: " + url)
+        return response
+
+    async def _send(self, method, url, body, headers, endpoint=None, retry=False):
+        timeout = self.get_request_timeout()
+        start = time.time()
+        try:
+            async with self.get_session().request(
+                method,
+                url,
+                data=body,
+                headers=headers,
+                cookies=self.cookie_jar,
+                timeout=timeout
+            ) as resp:
+                latency = time.time() - start
+                content = await resp.read()
+                cookies = dict((name, morsel.value) for name, morsel in resp.cookies.items())
+        except Exception:
+            api_metrics.record(endpoint, time.time() - start, None, len(body or ""), 0, retry)
+            raise
+        api_metrics.record(endpoint, latency, resp.status, len(body or ""),
+                           int(resp.headers.get("Content-Length", len(content))), retry)
+        return AsyncResponse(resp.status, resp.headers, content, cookies, endpoint)
+
+    async def login(self, client_identifier, session_timeout, kvs_service_data):
+        """ Login to service
+
+        :param client_identifier: string to identify caller
+        :param session_timeout: session timeout in seconds
+        :param kvs_service_data: kvs credentials (cname, keyId, keyValue)
+        :return:
+        """
+        auth_data = {
+            "type": "apikeycredentials",
+            "keyId": kvs_service_data["keyId"],
+            "keyValue": kvs_service_data["keyValue"]
+        }
+        print("Calling login...")
+        response = await self.request(
+            PATH_LOGIN.format(client_identifier=client_identifier, session_timeout=session_timeout),
+            method="POST",
+            body=json.dumps(auth_data),
+            relogin=False
+        )
+        if response.status_code == HTTP_OK:
+            self.cookie_jar = response.cookies
+            self.set_credentials(client_identifier, session_timeout, kvs_service_data)
+            self.session_expires_at = time.time() + int(session_timeout) - SESSION_EXPIRY_MARGIN
+            return response.json()
+        else:
+            raise RuntimeError("Unrecognised status for login" + str(response.status_code))
+
+    async def logout(self):
+        """ Logout from service """
+        response = await self.request(PATH_LOGOUT, method="POST", relogin=False)
+
+        if response.status_code == HTTP_OK:
+            self.session_expires_at = time.time()
+            return
+        else:
+            raise RuntimeError("Unrecognised status for logout" + str(response.status_code))
+
+    async def _get_json(self, relative_path, query_parameters='', error_msg=""):
+        response = await self.request(relative_path, query_parameters)
+        if response.status_code == HTTP_OK:
+            return response.json()
+        else:
+            print(error_msg + str(response.status_code))
+
+    async def get_ssid_profiles(self):
+        """ Fetch all SSID profiles """
+        return await self._get_json(PATH_SSID_PROFILES, error_msg="Unrecognised status for SSID profiles fetch")
+
+    async def get_location_tree(self):
+        """ Fetch location tree """
+        return await self._get_json(PATH_LOCATION_TREE, error_msg="Unrecognised status for location tree fetch")
+
+    async def get_managed_ap_devices(self, locid, active_devices_only=False):
+        """ Fetch managed AP devices at a location """
+        return await self._get_json(PATH_MANAGED_DEVICES, get_managed_ap_devices_query(locid, active_devices_only),
+                                    "Unrecognised status for managed device fetch")
+
+    async def get_clients(self, locid):
+        """ Fetch clients at a location """
+        return await self._get_json(PATH_CLIENTS, get_clients_query(locid),
+                                    "Unrecognised status for clients fetch")
+
+    async def get_virtual_aps(self):
+        """ Fetch Virtual APs """
+        return await self._get_json(PATH_VIRTUAL_ACCESS_POINTS, get_virtual_aps_query(),
+                                    "Unrecognised status for virtual AP fetch")
+
+    async def get_observing_managed_devices(self, boxid):
+        print("Searching observing devices for boxid: " + str(boxid))
+        return await self._get_json(PATH_OBSERVING_MANAGED_DEVICES.format(boxId=boxid), "isthirdradiosupported=true",
+                                    "Unrecognised status for observing managed device fetch")
+
+    async def start_client_conn_test(self, locid, target_boxid, client_boxid, test_profile_id):
+        start_params = {
+            'testProfileId': test_profile_id,
+            'targetApBoxId': target_boxid,
+            'targetClientBoxId': client_boxid
+        }
+        response = await self.request(
+            PATH_CLIENT_CONN_TEST,
+            method="POST",
+            query_parameters="locationid="+str(locid),
+            body=json.dumps(start_params)
+        )
+        if response.status_code == HTTP_OK:
+            return response.json()
+        else:
+            print("Unrecognised status " + str(response.status_code))
+
+        return None
+
+    async def get_client_conn_test_status(self, locid, session_id):
+        return await self._get_json(PATH_CLIENT_CONN_TEST, "sessionid="+str(session_id),
+                                    "Unrecognised status for client conn test status")
+
+    async def get_client_conn_test_result(self, session_id):
+        response = await self.request(PATH_CLIENT_CONN_TEST + "/"+str(session_id), "locationid=0")
+
+        if response.status_code != HTTP_OK:
+            print("Unrecognised status for client conn test result: " + str(response.status_code))
+            return {'rv': 1, 'error_string': "Error reading test result"}
+
+        return response.json()
+
+    async def get_best_client_device_for_conn_test(self, target_boxid):
+        cldlist = await self.get_observing_managed_devices(target_boxid)
+        if cldlist == None or len(cldlist) == 0:
+            return None
+        pairs = rank_conn_test_pairs([{'boxId': target_boxid}], {target_boxid: cldlist})
+        for cld in cldlist:
+            if len(pairs) > 0 and cld['boxId'] == pairs[0]['client_boxid']:
+                return cld
+        return None
+
+    # Result rendering does not touch the network, shared with MwmApi
+    convert_conn_test_result_to_text = MwmApi.convert_conn_test_result_to_text
+    get_conn_test_outcome = MwmApi.get_conn_test_outcome
+    convert_conn_test_attemp_result_to_text = MwmApi.convert_conn_test_attemp_result_to_text
+
+    async def get_conn_test_pairs(self, locid, max_age=CONN_TEST_PAIRS_TTL):
+        """ Candidate device pairs for a live network test at a location, best first
+
+        Observing devices are probed concurrently, at most MAX_CONCURRENT_CALLS
+        at a time, results are cached per location for max_age seconds.
+        """
+        cached = self.conn_test_pairs.get(locid)
+        if cached is not None and time.time() - cached[0] <= max_age:
+            return cached[1]
+
+        resp = await self.get_managed_ap_devices(locid, True)
+        if resp is None or "managedDevices" not in resp:
+            return None
+        mdlist = sorted(resp['managedDevices'], key=lambda md: -get_conn_test_capability(md))
+        mdlist = mdlist[:CONN_TEST_MAX_PROBES]
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+
+        async def probe(boxid):
+            async with semaphore:
+                return await self.get_observing_managed_devices(boxid)
+
+        results = await asyncio.gather(*[probe(md['boxId']) for md in mdlist], return_exceptions=True)
+        observers_by_boxid = {}
+        for md, result in zip(mdlist, results):
+            if isinstance(result, Exception):
+                print("Observing devices fetch failed for boxid " + str(md['boxId']) + ": " + str(result))
+            else:
+                observers_by_boxid[md['boxId']] = result
+
+        pairs = rank_conn_test_pairs(mdlist, observers_by_boxid)
+        self.conn_test_pairs[locid] = (time.time(), pairs)
+        return pairs
+
+    def invalidate_conn_test_pairs(self, locid=None):
+        """ Drops cached test device pairs of a location (all locations if None) """
+        if locid is None:
+            self.conn_test_pairs.clear()
+        else:
+            self.conn_test_pairs.pop(locid, None)
+
+    async def find_conn_test_devices_at_loc(self, locid):
+        """ Selects the target AP and the 3-radio AP acting as client for a live test
+
+        :return: (target_boxid, client_boxid), None if no suitable pair, -1 on error
+        """
+        pairs = await self.get_conn_test_pairs(locid)
+        if pairs is None:
+            return -1
+        if len(pairs) == 0:
+            return None
+        return (pairs[0]['target_boxid'], pairs[0]['client_boxid'])
+
+    async def start_client_conn_test_at_loc(self, locid):
+        """ Starts a live network test and returns without waiting for it """
+        devices = await self.find_conn_test_devices_at_loc(locid)
+        if devices == -1:
+            return {'rv':1, 'error_string': "Internal error"}
+        if devices is None:
+            return {'rv':1, 'error_string': "Suitable test devices not found at the location"}
+
+        target_boxid, client_boxid = devices
+        tstatus = await self.start_client_conn_test(locid, target_boxid, client_boxid, CONN_TEST_PROFILE_ID)
+        if tstatus == None or 'sessionId' not in tstatus:
+            self.invalidate_conn_test_pairs(locid)
+            return {'rv':1, 'error_string': "Unable to start connectivity test. Please try again"}
+        return {'rv': 0, 'test': {'session_id': tstatus['sessionId'], 'locid': locid, 'started_at': time.time()}}
+
+    async def check_client_conn_test(self, test):
+        """ Polls a started live network test once, same result as MwmApi.check_client_conn_test """
+        tstatus = await self.get_client_conn_test_status(test['locid'], test['session_id'])
+        if tstatus == None or len(tstatus) == 0 or 'sessionStatus' not in tstatus[0]:
+            return {'rv':1, 'error_string': "Unable to get the test status. Please try again"}
+        if tstatus[0]['sessionStatus'] == CONN_TEST_COMPLETED:
+            tresult = await self.get_client_conn_test_result(test['session_id'])
+            result_text = self.convert_conn_test_result_to_text(tresult)
+            if result_text == None:
+                return {'rv':1, 'error_string': "Unable to read the test result. Please try again"}
+            return {'rv':0, 'completed': True, 'result_text': result_text}
+        if time.time() - test['started_at'] > CONN_TEST_TIMEOUT:
+            return {'rv':1, 'error_string': "Timeout waiting for test result. Please try again"}
+        return {'rv': 0, 'completed': False}
+
+    async def wait_client_conn_test(self, test, max_wait):
+        """ Polls a started live network test with growing intervals for at most max_wait seconds """
+        deadline = time.time() + max_wait
+        interval = CONN_TEST_POLL_INITIAL
+        while True:
+            # Yields to the other intents served by the loop while waiting
+            await asyncio.sleep(max(0, min(interval, deadline - time.time())))
+            status = await self.check_client_conn_test(test)
+            if status['rv'] != 0 or status['completed'] or time.time() >= deadline:
+                return status
+            interval = min(interval * CONN_TEST_POLL_BACKOFF, CONN_TEST_POLL_MAX)
+
+    async def do_client_conn_test_at_loc(self, locid):
+        """ Runs a live network test and waits for its result (up to CONN_TEST_TIMEOUT seconds) """
+        started = await self.start_client_conn_test_at_loc(locid)
+        if started['rv'] != 0:
+            return started
+        status = await self.wait_client_conn_test(started['test'], CONN_TEST_TIMEOUT)
+        if status['rv'] != 0:
+            return status
+        if not status['completed']:
+            return {'rv':1, 'error_string': "Timeout waiting for test result. Please try again"}
+        return {'rv':0, 'result_text': status['result_text']}
+
+    def get_location_index_lock(self):
+        """ Lock of the location index fetch, one per event loop the client is used in """
+        loop = asyncio.get_event_loop()
+        if self.location_index_lock is None or self.location_index_lock[0] is not loop:
+            self.location_index_lock = (loop, asyncio.Lock())
+        return self.location_index_lock[1]
+
+    async def get_location_index(self, max_age=LOCATION_INDEX_TTL):
+        """ Location tree index, fetched again only when older than max_age seconds """
+        async with self.get_location_index_lock():
+            index = self.location_index
+            if index is None or time.time() - index.built_at > max_age:
+                loctree = await self.get_location_tree()
+                if loctree is None:
+                    return index
+                index = LocationIndex(loctree, time.time())
+                self.location_index = index
+            return index
+
+    def invalidate_location_index(self):
+        """ Drops the cached location index, the next lookup fetches the tree again """
+        self.location_index = None
+
+    async def get_location_id_by_name(self, location):
+        if location == None:
+            return -2
+        index = await self.get_location_index()
+        if index is None:
+            return -2
+        locid = index.find(location)
+        if locid is None:
+            return -2
+        return locid
+
+    async def get_device_count_at_location(self, locid):
+        mdresp = await self.get_managed_ap_devices(locid)
+        active_devices = 0
+        inactive_devices = 0
+        if mdresp != None and "managedDevices" in mdresp:
+            for md in mdresp['managedDevices']:
+                if md['active'] == True:
+                    active_devices = active_devices + 1
+                else:
+                    inactive_devices = inactive_devices + 1
+
+        return {'active':active_devices, 'inactive':inactive_devices}
+
+    async def get_client_conn_stats_at_location(self, locid):
+        time_secs = int(time.time()) - 300
+        return await self._get_json(PATH_CLIENT_CONN_STATS, get_client_conn_stats_query(locid, time_secs, time_secs),
+                                    "Unrecognised status for client conn stats fetch")
+
+    async def get_client_counts_at_loc(self, locid):
+        cl_conn = await self.get_client_conn_stats_at_location(locid)
+        cl_succ = 0
+        cl_fail = 0
+        if cl_conn != None:
+            if 'successCount' in cl_conn:
+                cl_succ = cl_conn['successCount']
+            if 'failureCount' in cl_conn:
+                cl_fail = cl_conn['failureCount']
+
+        return {'successCount': cl_succ, 'failureCount': cl_fail}
@@ -0,0 +1,283 @@
+# End to end benchmark of mwmAlexa.lambda_handler against mwmFakeServer
+#
+# Replays Alexa events for every intent and reports per intent latency
+# (p50/p99), API calls and peak memory, then per endpoint bytes on the wire
+# and JSON decode time:
+#
+#   python mwmBenchmark.py --iterations 20 --latency-ms 80 --aps-per-location 200
+#   python mwmBenchmark.py --host 127.0.0.1:8080     # server already running
+#   python mwmBenchmark.py --no-compression --json-decoder json     # baseline transfers
+#
+# The stand-in server runs in its own process, so its threads and fleet do not
+# count in the latency and memory of the handler. "--cold" drops the cached
+# API objects and responses before every event (new Lambda container), by
+# default they are kept like in a warm container.
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None      # Python 2, peak RSS of the process is reported instead
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from mwmApi import HTTP
+from mwmFakeServer import DEFAULT_LOCATIONS, DEFAULT_APS_PER_LOCATION, DEFAULT_CLIENTS_PER_AP, DEFAULT_TEST_DURATION
+
+APPLICATION_ID = "amzn1.ask.skill.benchmark"
+DEFAULT_ITERATIONS = 10
+DEFAULT_LOCATION = "Corporate"
+
+
+def build_event(request, attributes=None, new=False):
+    """ Alexa event around a request of the given type """
+    request = dict(request)
+    request.setdefault("requestId", "amzn1.echo-api.request.benchmark")
+    return {
+        "session": {
+            "new": new,
+            "sessionId": "amzn1.echo-api.session.benchmark",
+            "application": {"applicationId": APPLICATION_ID},
+            "attributes": attributes or {},
+        },
+        "request": request,
+    }
+
+
+def intent_request(name, location=None, dialog_state="COMPLETED"):
+    slots = {}
+    if location is not None:
+        slots["location"] = {"name": "location", "value": location}
+    return {"type": "IntentRequest", "dialogState": dialog_state, "intent": {"name": name, "slots": slots}}
+
+
+def get_scenarios(location):
+    """ (name, request) replayed in this order, each event carries the session
+    attributes returned by the previous one (cookies, running test)
+    """
+    return [
+        ("LaunchRequest", {"type": "LaunchRequest"}),
+        ("NetworkStatus (delegate)", intent_request("NetworkStatus", None, "STARTED")),
+        ("NetworkStatus", intent_request("NetworkStatus", location)),
+        ("RegionStatus", intent_request("RegionStatus", "Region 1")),
+        ("RegionStatus (network)", intent_request("RegionStatus")),
+        ("LiveNetworkTest", intent_request("LiveNetworkTest", location)),
+        ("NetworkTestResult", intent_request("NetworkTestResult")),
+        ("LastSuccessfulTest", intent_request("LastSuccessfulTest")),
+        ("ClientFailureTrend", intent_request("ClientFailureTrend", location)),
+        ("AssociationFailures", intent_request("AssociationFailures")),
+        ("APsDown", intent_request("APsDown")),
+        ("GoodBye", intent_request("GoodBye")),
+        ("SessionEndedRequest", {"type": "SessionEndedRequest", "reason": "USER_INITIATED"}),
+    ]
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of a list of numbers """
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+def get_peak_rss_kb():
+    """ Peak resident memory of the process in KB, None if unknown """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak = peak // 1024
+    return peak
+
+
+def start_server_process(args):
+    """ Runs mwmFakeServer.py on a free port
+
+    :return: (Popen, "host:port")
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(here, "mwmFakeServer.py"), "--port", "0",
+               "--locations", str(args.locations), "--aps-per-location", str(args.aps_per_location),
+               "--clients-per-ap", str(args.clients_per_ap), "--latency-ms", str(args.latency_ms),
+               "--jitter-ms", str(args.jitter_ms), "--test-duration", str(args.test_duration)]
+    if args.no_compression:
+        command.append("--no-compression")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    line = process.stdout.readline().decode("utf-8").strip()
+    if not line.startswith("Listening on "):
+        process.kill()
+        raise RuntimeError("Fake server did not start: " + line)
+    print(process.stdout.readline().decode("utf-8").strip())
+    return process, line[len("Listening on "):]
+
+
+# Per endpoint statistics (mwmMetrics) summed over the run
+ENDPOINT_TOTALS = ("calls", "bytes_received", "decodes", "bytes_decoded", "decode_total_ms")
+
+
+def print_endpoint_totals(endpoint_totals):
+    """ Per endpoint bytes on the wire and decoded, and JSON decode time, per call """
+    print("%-52s %7s %10s %12s %10s" % ("endpoint", "calls", "wire KB", "decoded KB", "decode ms"))
+    for name in sorted(endpoint_totals, key=str):
+        totals = endpoint_totals[name]
+        calls = max(totals["calls"], 1)
+        decodes = max(totals["decodes"], 1)
+        print("%-52s %7d %10.1f %12.1f %10.2f" % (
+            name, totals["calls"], totals["bytes_received"] / 1024.0 / calls,
+            totals["bytes_decoded"] / 1024.0 / decodes, totals["decode_total_ms"] / decodes))
+
+
+class Benchmark:
+    """ Replays events through mwmAlexa.lambda_handler and gathers per scenario statistics """
+
+    def __init__(self, mwm_alexa, cold=False):
+        """
+        :param mwm_alexa: imported mwmAlexa module, configured for the fake server
+        :param cold: drop cached API objects and responses before every event
+        """
+        self.mwm_alexa = mwm_alexa
+        self.cold = cold
+        self.api_calls = 0
+        self.attributes = {}
+        self.endpoint_totals = {}   # endpoint => summed ENDPOINT_TOTALS over the whole run
+
+    def metrics_sink(self, endpoints, dimensions):
+        # Called by flush_metrics at the end of every invocation
+        for name in endpoints:
+            self.api_calls += endpoints[name]["calls"]
+            totals = self.endpoint_totals.setdefault(name, dict((key, 0) for key in ENDPOINT_TOTALS))
+            for key in ENDPOINT_TOTALS:
+                totals[key] += endpoints[name][key]
+
+    def reset_caches(self):
+        from mwmApi import response_cache, conn_stats_store
+        from mwmSessionStore import MemorySessionStore
+        with self.mwm_alexa.mwm_api_cache_lock:
+            self.mwm_alexa.mwm_api_cache.clear()
+        response_cache.invalidate()
+        conn_stats_store.clear()
+        if isinstance(self.mwm_alexa.session_store, MemorySessionStore):
+            self.mwm_alexa.session_store = MemorySessionStore()
+
+    def invoke(self, request, trace_memory=False):
+        """ Handles one event with the log output discarded
+
+        :return: (seconds, API calls, peak traced bytes or None)
+        """
+        if self.cold:
+            self.reset_caches()
+        event = build_event(request, self.attributes, request["type"] == "LaunchRequest")
+        self.api_calls = 0
+        peak = None
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            if trace_memory:
+                tracemalloc.start()
+            start = time.time()
+            response = self.mwm_alexa.lambda_handler(event, None)
+            elapsed = time.time() - start
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if response is not None:
+            self.attributes = response.get("sessionAttributes") or {}
+        return elapsed, self.api_calls, peak
+
+    def run_scenario(self, request, iterations):
+        """ Runs a scenario iterations times (plus once traced for memory on Python 3)
+
+        :return: dict of p50_ms, p99_ms, max_ms, api_calls (average) and peak_kb
+        """
+        attributes = self.attributes
+        latencies = []
+        calls = []
+        for i in range(iterations):
+            # Every iteration starts from the session state left by the previous scenario
+            self.attributes = attributes
+            elapsed, api_calls, peak = self.invoke(request)
+            latencies.append(elapsed * 1000.0)
+            calls.append(api_calls)
+        peak_kb = None
+        if tracemalloc is not None:
+            self.attributes = attributes
+            peak_kb = self.invoke(request, True)[2] / 1024.0
+        return {
+            "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies),
+            "api_calls": float(sum(calls)) / len(calls),
+            "peak_kb": peak_kb,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mwmAlexa.lambda_handler against a local fake Mojo cloud")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="events per scenario")
+    parser.add_argument("--host", help="host:port of a running mwmFakeServer.py (default: start one)")
+    parser.add_argument("--location", default=DEFAULT_LOCATION, help="location slot of the intents")
+    parser.add_argument("--cold", action="store_true", help="drop cached API objects and responses before every event")
+    parser.add_argument("--locations", type=int, default=DEFAULT_LOCATIONS)
+    parser.add_argument("--aps-per-location", type=int, default=DEFAULT_APS_PER_LOCATION)
+    parser.add_argument("--clients-per-ap", type=int, default=DEFAULT_CLIENTS_PER_AP)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--test-duration", type=float, default=DEFAULT_TEST_DURATION,
+                        help="seconds a live network test runs (NetworkTestResult polls it while running)")
+    parser.add_argument("--no-compression", action="store_true", help="started server never gzips its responses")
+    parser.add_argument("--json-decoder", help="JSON decoder of the API responses (mwmJson.JSON_DECODERS), default the fastest installed")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    process = None
+    host = args.host
+    if host is None:
+        process, host = start_server_process(args)
+    try:
+        # mwmAlexa reads its host at import
+        os.environ["MWM_HOST"] = host
+        os.environ["MWM_SCHEME"] = HTTP
+        import mwmAlexa
+        from mwmMetrics import set_metrics_sink
+        from mwmJson import set_json_decoder
+
+        print("JSON decoder: " + set_json_decoder(args.json_decoder))
+        benchmark = Benchmark(mwmAlexa, args.cold)
+        set_metrics_sink(benchmark.metrics_sink)
+        results = []
+        print("%-26s %9s %9s %9s %9s %10s" % ("scenario", "p50 ms", "p99 ms", "max ms", "API calls", "peak KB"))
+        for name, request in get_scenarios(args.location):
+            result = benchmark.run_scenario(request, args.iterations)
+            result["scenario"] = name
+            results.append(result)
+            peak = "n/a" if result["peak_kb"] is None else "%.0f" % result["peak_kb"]
+            print("%-26s %9.1f %9.1f %9.1f %9.1f %10s" % (
+                name, result["p50_ms"], result["p99_ms"], result["max_ms"], result["api_calls"], peak))
+        print("")
+        print_endpoint_totals(benchmark.endpoint_totals)
+        peak_rss = get_peak_rss_kb()
+        if peak_rss is not None:
+            print("peak RSS of the benchmark process: %d KB" % peak_rss)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"arguments": vars(args), "results": results, "endpoints": benchmark.endpoint_totals,
+                           "peak_rss_kb": peak_rss}, f, indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# LRU cache of read-only API responses with per entry TTL and revalidation,
+# and coalescing of identical requests in flight at the same time
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+
+    def __init__(self, response, ttl, size):
+        self.response = response
+        self.ttl = ttl
+        self.size = size
+        self.stored_at = time.time()
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+
+    def is_fresh(self):
+        return time.time() - self.stored_at <= self.ttl
+
+    def get_validators(self):
+        """ Conditional request headers to revalidate the entry with, empty if the server sent none """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """ Thread safe LRU of responses bounded by entry count and body bytes
+
+    Expired entries are kept while they fit, so they can be revalidated with a
+    conditional request (304 Not Modified) instead of downloaded again.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ Entry for key (fresh or not), marked as most recently used
+
+        :return: CacheEntry or None
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            if entry.is_fresh():
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def put(self, key, response, ttl):
+        """ Stores a fully read response, evicting least recently used entries over the limits """
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        entry = CacheEntry(response, ttl, size)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self.entries[key] = entry
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def refresh(self, entry):
+        """ Restarts the TTL of an entry the server confirmed unchanged (304) """
+        with self.lock:
+            entry.stored_at = time.time()
+            self.revalidated += 1
+
+    def invalidate(self, match=None):
+        """ Drops entries whose key matches, all entries if match is None
+
+        :param match: callable(key) returning True for the entries to drop
+        """
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if match is None or match(key):
+                    self.size -= self.entries.pop(key).size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "evictions": self.evictions,
+            }
+
+
+class FlightTimeout(Exception):
+    """ A caller gave up waiting for the call in flight it joined """
+
+
+class _Flight:
+    """ One call in progress, its result is handed to every caller waiting for it """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Runs one call per key at a time, concurrent callers of the same key share its result
+
+    The result is shared only while the call is in flight, nothing is kept
+    once it completes (ResponseCache does that).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}       # key => _Flight in progress
+        self.calls = 0          # calls made
+        self.coalesced = 0      # callers served by another caller's call
+
+    def do(self, key, func, timeout=None):
+        """ Calls func(), or waits for the call already in flight for key
+
+        :param func: callable() making the call
+        :param timeout: seconds a caller waits for a call in flight, None for no limit
+        :return: (func() result, True if it came from another caller's call)
+        :raises: the exception of the call, FlightTimeout if the wait timed out
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise FlightTimeout("Timeout waiting for a call in flight")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+
+        try:
+            flight.value = func()
+        except BaseException as e:
+            # Whatever ends the call (KeyboardInterrupt, SystemExit too) ends it for the waiters
+            flight.error = e
+            raise
+        finally:
+            try:
+                with self.lock:
+                    del self.flights[key]
+            finally:
+                flight.done.set()
+        return flight.value, False
+
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self.flights)}
@@ -0,0 +1,152 @@
+# Cold start measurement of the Lambda handler
+#
+# Runs every sample in a fresh interpreter (like a new Lambda container) and
+# reports the median time to import mwmAlexa and to answer the first event.
+# Only events that need no network are used, so the numbers are reproducible
+# offline:
+#
+#   python mwmColdStart.py --runs 10 --max-import-ms 150
+#
+# Exits with status 1 when a budget is exceeded or a heavy module (requests)
+# is imported by an event that does not need it.
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules that must not be loaded by the events below
+HEAVY_MODULES = ("requests", "urllib3", "cookielib", "http.cookiejar", "sqlite3", "difflib")
+
+RESULT_PREFIX = "COLDSTART "
+
+# Canned events answered without API calls
+EVENTS = {
+    "SessionEndedRequest": {
+        "session": {
+            "new": False,
+            "sessionId": "amzn1.echo-api.session.coldstart",
+            "application": {"applicationId": "amzn1.ask.skill.coldstart"},
+            "attributes": {}
+        },
+        "request": {
+            "type": "SessionEndedRequest",
+            "requestId": "amzn1.echo-api.request.coldstart",
+            "reason": "USER_INITIATED"
+        }
+    },
+    "Dialog.Delegate": {
+        "session": {
+            "new": True,
+            "sessionId": "amzn1.echo-api.session.coldstart",
+            "application": {"applicationId": "amzn1.ask.skill.coldstart"},
+            "attributes": {}
+        },
+        "request": {
+            "type": "IntentRequest",
+            "requestId": "amzn1.echo-api.request.coldstart",
+            "dialogState": "STARTED",
+            "intent": {"name": "NetworkStatus", "slots": {"location": {"name": "location"}}}
+        }
+    },
+}
+
+# Code run by the fresh interpreter: imports the handler, answers one event
+# with its log output discarded, and prints the timings as one JSON line
+_CHILD_CODE = """
+import json, os, sys, time
+event = json.loads(sys.argv[1])
+heavy_modules = json.loads(sys.argv[2])
+started = time.time()
+import mwmAlexa
+imported = time.time()
+stdout = sys.stdout
+sys.stdout = open(os.devnull, "w")
+try:
+    mwmAlexa.lambda_handler(event, None)
+finally:
+    sys.stdout.close()
+    sys.stdout = stdout
+handled = time.time()
+print(%r + json.dumps({
+    "import_ms": (imported - started) * 1000.0,
+    "handler_ms": (handled - imported) * 1000.0,
+    "heavy_modules": [m for m in heavy_modules if m in sys.modules],
+}))
+""" % RESULT_PREFIX
+
+
+def run_sample(event, python=sys.executable):
+    """ Imports mwmAlexa and handles the event in a new interpreter
+
+    :return: dict with import_ms, handler_ms and the heavy_modules loaded
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    output = subprocess.check_output(
+        [python, "-c", _CHILD_CODE, json.dumps(event), json.dumps(HEAVY_MODULES)],
+        cwd=here, env=env)
+    for line in output.decode("utf-8").splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("No result from the measurement run: " + str(output))
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(runs, python=sys.executable):
+    """ Median cold start timings per canned event
+
+    :param runs: fresh interpreters started per event
+    :return: dict event name => {"import_ms", "handler_ms", "heavy_modules"}
+    """
+    results = {}
+    for name in sorted(EVENTS):
+        samples = [run_sample(EVENTS[name], python) for i in range(runs)]
+        heavy_modules = set()
+        for sample in samples:
+            heavy_modules.update(sample["heavy_modules"])
+        results[name] = {
+            "import_ms": median([s["import_ms"] for s in samples]),
+            "handler_ms": median([s["handler_ms"] for s in samples]),
+            "heavy_modules": sorted(heavy_modules),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of mwmAlexa.lambda_handler")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per event (default 5)")
+    parser.add_argument("--python", default=sys.executable, help="interpreter to measure (default: this one)")
+    parser.add_argument("--max-import-ms", type=float, help="fail if the median import time is larger")
+    parser.add_argument("--max-handler-ms", type=float, help="fail if the median first invocation time is larger")
+    args = parser.parse_args()
+
+    failed = False
+    results = measure(args.runs, args.python)
+    for name in sorted(results):
+        result = results[name]
+        print("%-20s import %7.1f ms  first invocation %7.1f ms  heavy modules: %s" % (
+            name, result["import_ms"], result["handler_ms"], ", ".join(result["heavy_modules"]) or "none"))
+        if args.max_import_ms is not None and result["import_ms"] > args.max_import_ms:
+            print("  import time over the budget of %.1f ms" % args.max_import_ms)
+            failed = True
+        if args.max_handler_ms is not None and result["handler_ms"] > args.max_handler_ms:
+            print("  first invocation time over the budget of %.1f ms" % args.max_handler_ms)
+            failed = True
+        if len(result["heavy_modules"]) > 0:
+            print("  heavy modules imported without an API call")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# Client connectivity stats of a location as a time series, fetched incrementally
+#
+# devices/clients/connectivitystats returns the connection success and failure
+# counts of a time interval. A ConnStatsSeries keeps the intervals fetched for
+# one location as sorted, non overlapping segments in arrays and answers the
+# counts of any window from them. Only what a window needs and the series
+# lacks is fetched: the part past the newest segment costs one request for the
+# delta, and a window edge falling inside a segment splits it with one request
+# for its shorter side (the other side is the difference). Asked once per
+# bucket, "the last hour versus the same hour yesterday" costs one request for
+# the newest bucket once the series has filled.
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import threading
+import time
+
+CONN_STATS_BUCKET = 300             # seconds, window edges are aligned to it
+CONN_STATS_DELAY = 300              # seconds until the stats of an interval are complete
+CONN_STATS_RETENTION = 26 * 3600    # seconds of segments kept per location
+CONN_STATS_MAX_SERIES = 256         # locations kept, least recently used dropped first
+
+
+def get_conn_stats_time(now=None):
+    """ End of the newest complete bucket (epoch seconds), where windows up to now end """
+    if now is None:
+        now = time.time()
+    return int(now - CONN_STATS_DELAY) // CONN_STATS_BUCKET * CONN_STATS_BUCKET
+
+
+def get_window_stats(start, end, success, failure):
+    """ Counts and rates of a window, as returned by ConnStatsStore users
+
+    :return: {'from', 'to', 'successCount', 'failureCount', 'failureRate' (0..1, None
+             without connections), 'failuresPerHour'}
+    """
+    total = success + failure
+    return {
+        'from': start,
+        'to': end,
+        'successCount': success,
+        'failureCount': failure,
+        'failureRate': float(failure) / total if total > 0 else None,
+        'failuresPerHour': failure * 3600.0 / (end - start) if end > start else None,
+    }
+
+
+class ConnStatsSeries:
+    """ Fetched intervals of one location: start, end, success and failure count arrays """
+
+    def __init__(self):
+        self.starts = array('l')
+        self.ends = array('l')
+        self.success = array('l')
+        self.failure = array('l')
+        self.lock = threading.Lock()
+        self.fetches = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _insert(self, start, end, success, failure):
+        position = bisect_left(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.success.insert(position, max(0, success))
+        self.failure.insert(position, max(0, failure))
+
+    def _fetch(self, fetch, start, end):
+        self.fetches += 1
+        return fetch(start, end)
+
+    def _split(self, fetch, t):
+        # Splits the segment strictly containing t in two, False if the fetch failed
+        position = bisect_right(self.starts, t) - 1
+        if position < 0 or not self.starts[position] < t < self.ends[position]:
+            return True
+        start, end = self.starts[position], self.ends[position]
+        if t - start <= end - t:
+            counts = self._fetch(fetch, start, t)
+            if counts is None:
+                return False
+            left, right = counts, (self.success[position] - counts[0], self.failure[position] - counts[1])
+        else:
+            counts = self._fetch(fetch, t, end)
+            if counts is None:
+                return False
+            left, right = (self.success[position] - counts[0], self.failure[position] - counts[1]), counts
+        for values in (self.starts, self.ends, self.success, self.failure):
+            del values[position]
+        self._insert(start, t, left[0], left[1])
+        self._insert(t, end, right[0], right[1])
+        return True
+
+    def _get_gaps(self, start, end):
+        # Parts of [start, end) no segment covers
+        gaps = []
+        position = bisect_right(self.ends, start)
+        while start < end:
+            if position >= len(self.starts) or self.starts[position] >= end:
+                gaps.append((start, end))
+                break
+            if self.starts[position] > start:
+                gaps.append((start, self.starts[position]))
+            start = self.ends[position]
+            position += 1
+        return gaps
+
+    def get_counts(self, fetch, start, end):
+        """ Success and failure counts over [start, end), fetching the parts not held yet
+
+        :param fetch: callable(start, end) returning (success, failure) of an interval, None on failure
+        :return: (success, failure), None if a fetch failed
+        """
+        with self.lock:
+            for edge in (start, end):
+                if not self._split(fetch, edge):
+                    return None
+            for gap_start, gap_end in self._get_gaps(start, end):
+                counts = self._fetch(fetch, gap_start, gap_end)
+                if counts is None:
+                    return None
+                self._insert(gap_start, gap_end, counts[0], counts[1])
+            first = bisect_left(self.starts, start)
+            last = bisect_left(self.starts, end)
+            return sum(self.success[first:last]), sum(self.failure[first:last])
+
+    def trim(self, oldest):
+        """ Drops the segments ending at or before oldest (epoch seconds) """
+        with self.lock:
+            count = bisect_right(self.ends, oldest)
+            if count > 0:
+                for values in (self.starts, self.ends, self.success, self.failure):
+                    del values[:count]
+
+
+class ConnStatsStore:
+    """ ConnStatsSeries per (host, tenant, location), least recently used dropped first """
+
+    def __init__(self, max_series=CONN_STATS_MAX_SERIES, retention=CONN_STATS_RETENTION):
+        self.max_series = max_series
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.series = OrderedDict()
+        self.windows = 0
+
+    def get_series(self, key):
+        with self.lock:
+            series = self.series.pop(key, None)
+            if series is None:
+                series = ConnStatsSeries()
+            self.series[key] = series
+            while len(self.series) > self.max_series:
+                self.series.popitem(last=False)
+            return series
+
+    def get_windows(self, key, fetch, windows, now=None):
+        """ Stats of several windows of a location
+
+        :param key: (host, tenant, location id)
+        :param fetch: callable(start, end) returning (success, failure), None on failure
+        :param windows: (start, end) pairs of epoch seconds, aligned to CONN_STATS_BUCKET
+        :return: list of get_window_stats() dicts, None if a fetch failed
+        """
+        series = self.get_series(key)
+        oldest = get_conn_stats_time(now) - self.retention
+        if len(windows) > 0:
+            oldest = min(oldest, min(start for start, end in windows))
+        series.trim(oldest)
+        results = []
+        for start, end in windows:
+            counts = series.get_counts(fetch, start, end)
+            if counts is None:
+                return None
+            results.append(get_window_stats(start, end, counts[0], counts[1]))
+        with self.lock:
+            self.windows += len(windows)
+        return results
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def stats(self):
+        with self.lock:
+            series = list(self.series.values())
+            windows = self.windows
+        return {
+            "series": len(series),
+            "segments": sum(len(s) for s in series),
+            "fetches": sum(s.fetches for s in series),
+            "windows": windows,
+        }
@@ -0,0 +1,205 @@
+# Live network (client connectivity) tests across many locations at once
+#
+# Tests are started concurrently within global and per location limits, all
+# running sessions are polled from one loop (each session on its own backoff
+# schedule, the status calls of a round issued together on the MwmApi worker
+# pool) and results are yielded as soon as each test ends. Tests still running
+# when the deadline leaves no time for another poll are yielded as pending.
+import time
+from collections import deque
+
+from mwmApi import (
+    CONN_TEST_PROFILE_ID, CONN_TEST_TIMEOUT, CONN_TEST_POLL_INITIAL, CONN_TEST_POLL_MAX, CONN_TEST_POLL_BACKOFF
+)
+from mwmDeadline import MIN_REQUEST_BUDGET
+
+# Tests running at the same time, over all locations
+SWEEP_MAX_IN_FLIGHT = 8
+# Tests running at the same time at one location (they need distinct APs)
+SWEEP_MAX_PER_LOCATION = 1
+# No new test is started with less time than this left in the deadline (seconds)
+SWEEP_START_MIN_BUDGET = CONN_TEST_TIMEOUT
+
+
+def select_disjoint_pairs(pairs, count):
+    """ Best test pairs not sharing a device, so they can run at the same time
+
+    :param pairs: ranked pairs of MwmApi.get_conn_test_pairs()
+    :param count: max pairs to select
+    """
+    selected = []
+    used = set()
+    for pair in pairs:
+        if len(selected) >= count:
+            break
+        if pair['target_boxid'] in used or pair['client_boxid'] in used:
+            continue
+        selected.append(pair)
+        used.add(pair['target_boxid'])
+        used.add(pair['client_boxid'])
+    return selected
+
+
+class ConnTestScheduler:
+    """ Runs live network tests at many locations and streams their results
+
+    for result in ConnTestScheduler(mwm_api).run(locids):
+        print(result)
+    """
+
+    def __init__(self, mwm_api, max_in_flight=SWEEP_MAX_IN_FLIGHT, max_per_location=SWEEP_MAX_PER_LOCATION,
+                 tests_per_location=1, deadline=None):
+        """
+        :param mwm_api: authenticated MwmApi
+        :param max_in_flight: max tests running at once over all locations
+        :param max_per_location: max tests running at once at one location
+        :param tests_per_location: tests run at every location, with distinct device pairs
+        :param deadline: mwmDeadline.Deadline, no test is started when it leaves
+                         less than SWEEP_START_MIN_BUDGET seconds
+        """
+        self.mwm_api = mwm_api
+        self.max_in_flight = max_in_flight
+        self.max_per_location = max_per_location
+        self.tests_per_location = tests_per_location
+        self.deadline = deadline
+
+    def run(self, locids):
+        """ Tests the locations, yielding one result per test as it ends
+
+        :param locids: location ids to test
+        :return: generator of {'locid', 'rv', 'target_boxid', 'client_boxid', 'session_id',
+                 'duration', 'result_text' (rv 0) or 'error_string' (rv 1)}, 'pending' is
+                 True (rv 1) for a test still running when the deadline is reached
+        """
+        jobs = deque()
+        for job in self._plan(locids):
+            if 'rv' in job:
+                yield job
+            else:
+                jobs.append(job)
+
+        active = []
+        running_at = {}     # locid => tests running there
+        while len(jobs) > 0 or len(active) > 0:
+            if len(jobs) > 0 and self.deadline is not None and not self.deadline.allows(SWEEP_START_MIN_BUDGET):
+                while len(jobs) > 0:
+                    yield self._error(jobs.popleft(), "Not started, the time budget is exhausted")
+
+            for result in self._start(jobs, active, running_at):
+                yield result
+            if len(active) == 0:
+                continue
+
+            # Wait for the first session due, then poll all due sessions together
+            next_poll = min(session['next_poll'] for session in active)
+            if self.deadline is not None and \
+                    not self.deadline.allows(max(0, next_poll - time.time()) + MIN_REQUEST_BUDGET):
+                # No poll could end within the deadline, the tests finish on their own
+                for session in active:
+                    yield self._pending(session)
+                while len(jobs) > 0:
+                    yield self._error(jobs.popleft(), "Not started, the time budget is exhausted")
+                return
+            time.sleep(max(0, next_poll - time.time()))
+            now = time.time()
+            due = [session for session in active if session['next_poll'] <= now]
+            futures = [self.mwm_api.submit(self.mwm_api.check_client_conn_test, session['test']) for session in due]
+            for session, future in zip(due, futures):
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = {'rv': 1, 'error_string': "Status poll failed: " + str(e)}
+                if status['rv'] == 0 and not status['completed']:
+                    session['interval'] = min(session['interval'] * CONN_TEST_POLL_BACKOFF, CONN_TEST_POLL_MAX)
+                    session['next_poll'] = time.time() + session['interval']
+                    continue
+                active.remove(session)
+                running_at[session['job']['locid']] -= 1
+                result = self._session_result(session)
+                result['rv'] = status['rv']
+                if status['rv'] == 0:
+                    result['result_text'] = status['result_text']
+                else:
+                    result['error_string'] = status['error_string']
+                yield result
+
+    def _plan(self, locids):
+        # Test device pairs of all locations, the probes of all locations issued together
+        unique = []
+        for locid in locids:
+            if locid not in unique:
+                unique.append(locid)
+        jobs = []
+        if self.deadline is not None and not self.deadline.allows(SWEEP_START_MIN_BUDGET):
+            return [self._error({'locid': locid, 'target_boxid': None, 'client_boxid': None},
+                                "Not started, the time budget is exhausted") for locid in unique]
+        try:
+            pairs_by_locid = self.mwm_api.get_conn_test_pairs_of_locations(unique)
+        except Exception as e:
+            return [self._error({'locid': locid, 'target_boxid': None, 'client_boxid': None},
+                                "Test device lookup failed: " + str(e)) for locid in unique]
+        for locid in unique:
+            job = {'locid': locid, 'target_boxid': None, 'client_boxid': None}
+            pairs = pairs_by_locid.get(locid)
+            if pairs is None:
+                jobs.append(self._error(job, "Internal error"))
+                continue
+            selected = select_disjoint_pairs(pairs, self.tests_per_location)
+            if len(selected) == 0:
+                jobs.append(self._error(job, "Suitable test devices not found at the location"))
+            for pair in selected:
+                jobs.append({'locid': locid, 'target_boxid': pair['target_boxid'], 'client_boxid': pair['client_boxid']})
+        return jobs
+
+    def _start(self, jobs, active, running_at):
+        # Starts the waiting tests allowed by the limits, concurrently
+        starting = []
+        waiting = deque()
+        while len(jobs) > 0:
+            job = jobs.popleft()
+            if len(active) + len(starting) < self.max_in_flight and \
+                    running_at.get(job['locid'], 0) < self.max_per_location:
+                starting.append(job)
+                running_at[job['locid']] = running_at.get(job['locid'], 0) + 1
+            else:
+                waiting.append(job)
+        jobs.extend(waiting)
+
+        futures = [self.mwm_api.submit(self.mwm_api.start_client_conn_test, job['locid'], job['target_boxid'],
+                                       job['client_boxid'], CONN_TEST_PROFILE_ID) for job in starting]
+        results = []
+        for job, future in zip(starting, futures):
+            try:
+                tstatus = future.result()
+            except Exception as e:
+                tstatus = None
+                print("Test start failed at location " + str(job['locid']) + ": " + str(e))
+            if tstatus is None or 'sessionId' not in tstatus:
+                running_at[job['locid']] -= 1
+                # Devices may have gone away, select them again on the next sweep
+                self.mwm_api.invalidate_conn_test_pairs(job['locid'])
+                results.append(self._error(job, "Unable to start connectivity test"))
+                continue
+            test = {'session_id': tstatus['sessionId'], 'locid': job['locid'], 'started_at': time.time()}
+            active.append({'job': job, 'test': test, 'interval': CONN_TEST_POLL_INITIAL,
+                           'next_poll': time.time() + CONN_TEST_POLL_INITIAL})
+        return results
+
+    def _session_result(self, session):
+        result = dict(session['job'])
+        result['session_id'] = session['test']['session_id']
+        result['duration'] = time.time() - session['test']['started_at']
+        return result
+
+    def _pending(self, session):
+        result = self._session_result(session)
+        result['rv'] = 1
+        result['pending'] = True
+        result['error_string'] = "Still running when the time budget was exhausted"
+        return result
+
+    def _error(self, job, error_string):
+        result = dict(job)
+        result['rv'] = 1
+        result['error_string'] = error_string
+        return result
@@ -0,0 +1,64 @@
+# Time budget of one invocation, used to derive per request timeouts
+import time
+
+# Max seconds to wait for a TCP/TLS connect, whatever the remaining budget
+MAX_CONNECT_TIMEOUT = 3.0
+# Requests are not started with less than this many seconds left
+MIN_REQUEST_BUDGET = 0.2
+
+
+class DeadlineExceeded(Exception):
+    """ Raised instead of starting a request that cannot finish in the remaining budget """
+    pass
+
+
+class Deadline:
+    """ Absolute point in time (time.time()) by which the answer must be ready """
+
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds):
+        return cls(time.time() + seconds)
+
+    @classmethod
+    def from_lambda_context(cls, context, reserve, max_budget=None):
+        """ Deadline of a Lambda invocation
+
+        :param context: Lambda context (get_remaining_time_in_millis()), None outside Lambda
+        :param reserve: seconds kept for building and returning the response
+        :param max_budget: cap in seconds (the Alexa answer timeout is shorter than the Lambda one)
+        :return: Deadline, None without context and max_budget
+        """
+        budget = max_budget
+        if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+            remaining = context.get_remaining_time_in_millis() / 1000.0 - reserve
+            if budget is None or remaining < budget:
+                budget = remaining
+        if budget is None:
+            return None
+        return cls.after(budget)
+
+    def remaining(self):
+        """ Seconds left, negative once expired """
+        return self.expires_at - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds):
+        """ True if at least the given seconds are left """
+        return self.remaining() >= seconds
+
+    def get_timeouts(self, max_timeout):
+        """ (connect, read) timeouts for a request started now
+
+        :param max_timeout: timeout to use when the budget is larger
+        :raises DeadlineExceeded: if less than MIN_REQUEST_BUDGET seconds are left
+        """
+        remaining = self.remaining()
+        if remaining < MIN_REQUEST_BUDGET:
+            raise DeadlineExceeded("%.2f seconds left of the time budget" % remaining)
+        read = min(remaining, max_timeout)
+        return (min(MAX_CONNECT_TIMEOUT, read), read)
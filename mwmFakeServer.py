@@ -0,0 +1,625 @@
+# Local stand-in for the Mojo cloud webservice API
+#
+# Serves the endpoints used by MwmApi over plain http for a synthetic fleet of
+# configurable size, with injected latency, so mwmAlexa.lambda_handler and
+# MwmApi can be exercised and benchmarked without a cloud instance or keys:
+#
+#   python mwmFakeServer.py --port 8080 --locations 50 --aps-per-location 40 --latency-ms 80
+#   MWM_HOST=127.0.0.1:8080 MWM_SCHEME=http python ...
+#
+# Any API key is accepted. Not a reference of the real API, only of the parts
+# of the responses MwmApi reads.
+from __future__ import print_function
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+from mwmApi import CONN_TEST_COMPLETED
+
+API_PREFIX = "/new/webservice/v4"
+SESSION_COOKIE = "JSESSIONID"
+CONN_TEST_RUNNING = "CL_CONNEC_IN_PROGRESS"
+
+# Fleet defaults (python mwmFakeServer.py --help)
+DEFAULT_LOCATIONS = 20
+DEFAULT_APS_PER_LOCATION = 25
+DEFAULT_CLIENTS_PER_AP = 8
+DEFAULT_TEST_DURATION = 10.0    # seconds a live network test runs, longer than the intent waits
+# Completed live network tests present at start (session ids 1..N), the skill reads session 95
+PAST_CONN_TESTS = 100
+# Client connections per hour, over an interval each client counts as this many connection events
+CONNECTIONS_PER_HOUR = 4
+# Association records: one per active AP per interval (seconds)
+ASSOCIATION_INTERVAL = 900
+ASSOCIATION_SSIDS = ["Corp", "Guest", "IoT"]
+ASSOCIATION_FAILURE_REASONS = ["Authentication timeout", "Wrong passphrase", "Association rejected", "DHCP failure"]
+
+# Names given to the first sites, the others are "Site <n>"
+SITE_NAMES = ["Corporate", "Headquarters", "Warehouse", "Joe's Cafe", "Building 5", "Main Street Store",
+              "Data Center", "Lab"]
+SITES_PER_REGION = 10
+
+# Bodies smaller than this are sent uncompressed, like most web servers do
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+
+class FakeFleet:
+    """ Synthetic locations, APs and clients, generated from a seed """
+
+    def __init__(self, locations=DEFAULT_LOCATIONS, aps_per_location=DEFAULT_APS_PER_LOCATION,
+                 clients_per_ap=DEFAULT_CLIENTS_PER_AP, seed=1):
+        """
+        :param locations: number of sites holding APs, grouped under regions below the root
+        :param aps_per_location: managed APs per site
+        :param clients_per_ap: clients associated per AP
+        :param seed: random seed, the same seed gives the same fleet
+        """
+        rand = random.Random(seed)
+        created_at = int(time.time() * 1000)
+        self.locations = {0: {"id": 0, "name": "Global", "parent": None}}
+        self.children = {0: []}
+        self.managed_devices = []
+        self.devices_by_boxid = {}
+        self.devices_by_location = {}
+        self.clients = []
+
+        next_id = 1
+        region_id = None
+        for i in range(locations):
+            if i % SITES_PER_REGION == 0:
+                region_id = next_id
+                next_id += 1
+                self._add_location(region_id, "Region " + str(i // SITES_PER_REGION + 1), 0)
+            site_id = next_id
+            next_id += 1
+            name = SITE_NAMES[i] if i < len(SITE_NAMES) else "Site " + str(i + 1)
+            self._add_location(site_id, name, region_id)
+
+            devices = self.devices_by_location.setdefault(site_id, [])
+            for j in range(aps_per_location):
+                boxid = 1000 + len(self.managed_devices)
+                device = {
+                    "boxId": boxid,
+                    "name": "AP-%d-%d" % (site_id, j + 1),
+                    "model": _pick(rand, ["C130", "C120", "C75"]),
+                    "deviceMode": "AP",
+                    "active": rand.random() >= 0.1,
+                    "thirdRadioSupported": rand.random() < 0.3,
+                    "locationId": site_id,
+                    "macAddress": _mac_address(0x001100, boxid),
+                    "ipAddress": "10.%d.%d.%d" % (site_id // 256, site_id % 256, j + 1),
+                    "modifiedTime": created_at,
+                }
+                self.managed_devices.append(device)
+                self.devices_by_boxid[boxid] = device
+                devices.append(device)
+                for k in range(clients_per_ap if device["active"] else 0):
+                    client_number = len(self.clients)
+                    self.clients.append({
+                        "macAddress": _mac_address(0x00AA00, client_number),
+                        "boxId": boxid,
+                        "locationId": site_id,
+                        "ssid": _pick(rand, ["Corp", "Guest", "IoT"]),
+                        "rssi": -35 - int(rand.random() * 50),
+                        "connected": rand.random() >= 0.05,
+                    })
+
+    def set_device_active(self, boxid, active):
+        """ Brings a managed device up or down, as seen by the following requests """
+        device = self.devices_by_boxid[boxid]
+        device["active"] = active
+        device["modifiedTime"] = int(time.time() * 1000)
+
+    def remove_device(self, boxid):
+        """ Removes a managed device from the fleet """
+        device = self.devices_by_boxid.pop(boxid)
+        self.managed_devices.remove(device)
+        self.devices_by_location[device["locationId"]].remove(device)
+
+    def _add_location(self, locid, name, parent_id):
+        self.locations[locid] = {"id": locid, "name": name, "parent": parent_id}
+        self.children[locid] = []
+        self.children[parent_id].append(locid)
+
+    def get_subtree(self, locid):
+        """ Ids of a location and all locations below it, empty if unknown """
+        if locid not in self.locations:
+            return set()
+        subtree = [locid]
+        for current in subtree:
+            subtree.extend(self.children[current])
+        return set(subtree)
+
+    def get_location_tree(self):
+        """ locations/tree response """
+        locations = {}
+        for locid in self.locations:
+            loc = self.locations[locid]
+            entry = {"id": {"type": "locallocationid", "id": locid}, "name": loc["name"]}
+            if loc["parent"] is not None:
+                entry["parentId"] = {"type": "locallocationid", "id": loc["parent"]}
+            locations[str(locid)] = entry
+        return {"locations": locations}
+
+    def get_observing_devices(self, boxid):
+        """ Third radio APs at the same location as boxid """
+        device = self.devices_by_boxid.get(boxid)
+        if device is None:
+            return []
+        return [md for md in self.devices_by_location[device["locationId"]]
+                if md["boxId"] != boxid and md["active"] and md["thirdRadioSupported"]]
+
+    def get_association_data(self, start_time, end_time):
+        """ Association records of [start_time, end_time): one per active AP every
+        ASSOCIATION_INTERVAL seconds, the same records for the same times """
+        records = []
+        first_slot = (start_time + ASSOCIATION_INTERVAL - 1) // ASSOCIATION_INTERVAL
+        for slot in range(first_slot, (end_time + ASSOCIATION_INTERVAL - 1) // ASSOCIATION_INTERVAL):
+            for md in self.managed_devices:
+                if not md["active"]:
+                    continue
+                h = (md["boxId"] * 2654435761 + slot * 40503) & 0xFFFFFFFF
+                # Every seventh AP fails five times as often
+                failed = h % 100 < (15 if md["boxId"] % 7 == 0 else 3)
+                records.append({
+                    "boxId": md["boxId"],
+                    "apName": md["name"],
+                    "ssid": ASSOCIATION_SSIDS[(h >> 8) % len(ASSOCIATION_SSIDS)],
+                    "timestamp": slot * ASSOCIATION_INTERVAL,
+                    "status": "FAILURE" if failed else "SUCCESS",
+                    "failureReason": ASSOCIATION_FAILURE_REASONS[(h >> 12) % len(ASSOCIATION_FAILURE_REASONS)] if failed else None,
+                    "associationTime": 5 + (h >> 16) % 400,
+                })
+        return records
+
+    def get_conn_stats(self, locid, from_time=None, to_time=None):
+        """ Connected and failed client counts at a location and below
+
+        Over an interval (from_time < to_time) the counts are connection
+        events, so that the counts of adjoining intervals add up exactly.
+        """
+        subtree = self.get_subtree(locid)
+        success = 0
+        failure = 0
+        for client in self.clients:
+            if client["locationId"] in subtree:
+                if client["connected"]:
+                    success += 1
+                else:
+                    failure += 1
+        if from_time is not None and to_time is not None and from_time < to_time:
+            success = _connection_events(success, to_time) - _connection_events(success, from_time)
+            failure = _connection_events(failure, to_time) - _connection_events(failure, from_time)
+        return {"successCount": success, "failureCount": failure}
+
+
+def _connection_events(clients, t):
+    # Connection events of clients up to time t: CONNECTIONS_PER_HOUR each,
+    # varying over the week so a day differs from the day before
+    period = 7 * 86400
+    phase = 0.5 * period / (2 * math.pi) * math.sin(2 * math.pi * (t % period) / period)
+    return int(clients * CONNECTIONS_PER_HOUR * (t + phase) / 3600)
+
+
+def _pick(rand, choices):
+    # Only random() gives the same sequence on Python 2 and 3 for a seed
+    return choices[int(rand.random() * len(choices))]
+
+
+def _mac_address(prefix, number):
+    value = (prefix << 24) | (number & 0xFFFFFF)
+    return ":".join("%02x" % ((value >> shift) & 0xFF) for shift in range(40, -8, -8))
+
+
+def get_conn_test_result(session_id):
+    """ Result of a completed live network test, in the layout MwmApi.convert_conn_test_result_to_text reads """
+    def value(v):
+        return {"errorCode": None, "value": v}
+    return {
+        "sessionId": session_id,
+        "attempts": [{
+            "attemptId": 1,
+            "attemptResult": {
+                "basic": {
+                    "association": [{"assocRespRecv": {"errorCode": None}}],
+                    "dhcp": [{
+                        "dhcpIp": value("10.0.0.23"),
+                        "dhcpDefMask": value("255.255.255.0"),
+                        "dhcpDefGw": value("10.0.0.1"),
+                        "dhcpLatency": value("12.4"),
+                        "defGwLatency": value("2.1"),
+                        "dnsServerIp": value("10.0.0.2"),
+                        "dnsServerLatency": value("9.7"),
+                        "wanHostname": value("www.mojonetworks.com"),
+                        "wanLatency": value("31.0"),
+                    }],
+                    "ping": [{"pingServerIp": value("8.8.8.8"), "pingServerLatency": value("18.2")}],
+                }
+            }
+        }]
+    }
+
+
+def _get_filter_value(record, prop):
+    # Filter properties are lowercase names of record keys ("devicemode" => "deviceMode")
+    for key in record:
+        if key.lower() == prop:
+            return record[key]
+    return None
+
+
+COMPARISONS = {
+    ">": lambda actual, value: actual > value,
+    ">=": lambda actual, value: actual >= value,
+    "<": lambda actual, value: actual < value,
+    "<=": lambda actual, value: actual <= value,
+}
+
+
+def match_filter(fleet, record, flt):
+    """ True if the record matches a filter query parameter value
+
+    :param flt: decoded filter ({"property", "value", "operator": "=", ">", ">=", "<", "<="}
+                or {"value": [filters], "operator": "OR"/"AND"})
+    """
+    if "property" not in flt:
+        results = [match_filter(fleet, record, sub) for sub in flt.get("value", [])]
+        if flt.get("operator", "AND").upper() == "OR":
+            return any(results)
+        return all(results)
+    prop = flt["property"].lower()
+    values = flt.get("value", [])
+    if prop == "locationid":
+        return any(record.get("locationId") in fleet.get_subtree(int(v)) for v in values)
+    actual = _get_filter_value(record, prop)
+    operator = flt.get("operator", "=")
+    if operator in COMPARISONS:
+        return actual is not None and len(values) > 0 and COMPARISONS[operator](actual, values[0])
+    if prop == "devicemode" and actual == "AP":
+        # AP records also match the AP_SENSOR_COMBO mode filter
+        return "AP" in values or "AP_SENSOR_COMBO" in values
+    return actual in values
+
+
+class FakeMwmServer(ThreadingMixIn, HTTPServer):
+    """ Threaded http server holding the fleet, login sessions and live network tests """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, fleet, latency_ms=0, jitter_ms=0, test_duration=DEFAULT_TEST_DURATION,
+                 verbose=False, compress=True, max_concurrent=None):
+        """
+        :param address: (host, port) to listen on, port 0 picks a free port
+        :param fleet: FakeFleet served
+        :param latency_ms: delay added to every response
+        :param jitter_ms: random extra delay, uniform between 0 and jitter_ms
+        :param test_duration: seconds until a started live network test completes
+        :param verbose: log every request
+        :param compress: gzip the bodies of clients accepting it
+        :param max_concurrent: requests served at once, the others get 429 (None for no limit)
+        """
+        HTTPServer.__init__(self, address, FakeMwmRequestHandler)
+        self.fleet = fleet
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.test_duration = test_duration
+        self.verbose = verbose
+        self.compress = compress
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.sessions = {}          # session cookie => time.time() of expiry
+        self.conn_tests = {}        # session id => time.time() of completion
+        for session_id in range(1, PAST_CONN_TESTS + 1):
+            self.conn_tests[session_id] = 0
+        self.next_session_number = 1
+        self.request_counts = {}    # "METHOD path" => count
+
+    def get_hostname(self):
+        """ "host:port" to pass as MwmApi hostname (with scheme=HTTP) """
+        return "%s:%d" % self.server_address[:2]
+
+    def enter(self):
+        """ Counts a request in, False if it is over max_concurrent (not counted) """
+        with self.lock:
+            if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+                self.request_counts["throttled"] = self.request_counts.get("throttled", 0) + 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def count_request(self, name):
+        with self.lock:
+            self.request_counts[name] = self.request_counts.get(name, 0) + 1
+
+    def get_request_counts(self):
+        with self.lock:
+            return dict(self.request_counts)
+
+
+class FakeMwmRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"   # keep-alive, like the cloud
+
+    # (method, path pattern below API_PREFIX, handler method), first match wins
+    ROUTES = [
+        ("POST", r"/login/key/([^/]+)/([0-9]+)", "do_login"),
+        ("POST", r"/logout", "do_logout"),
+        ("GET", r"/locations/tree", "get_location_tree"),
+        ("GET", r"/devices/manageddevices/([0-9]+)/observingmanageddevices", "get_observing_devices"),
+        ("GET", r"/devices/manageddevices", "get_managed_devices"),
+        ("GET", r"/devices/clients/connectivitystats", "get_conn_stats"),
+        ("GET", r"/devices/clients", "get_clients"),
+        ("GET", r"/devices/aps", "get_virtual_aps"),
+        ("GET", r"/templates/SSID_PROFILE", "get_ssid_profiles"),
+        ("GET", r"/analytics/associationdata/([0-9]+)/([0-9]+)", "get_association_data"),
+        ("POST", r"/troubleshoot/clientconnectivity/sessions", "start_conn_test"),
+        ("GET", r"/troubleshoot/clientconnectivity/sessions/([0-9]+)", "get_conn_test_result"),
+        ("GET", r"/troubleshoot/clientconnectivity/sessions", "get_conn_test_status"),
+    ]
+    COMPILED_ROUTES = [(method, re.compile("^" + pattern + "$"), name) for method, pattern, name in ROUTES]
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def dispatch(self, method):
+        parsed = urlparse.urlparse(self.path)
+        self.query = urlparse.parse_qs(parsed.query)
+        self.body = b""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > 0:
+            self.body = self.rfile.read(length)
+
+        if not self.server.enter():
+            return self.send_json(429, {"errors": [{"message": "Too many requests"}]})
+        try:
+            self.route(method, parsed.path)
+        finally:
+            self.server.leave()
+
+    def route(self, method, path):
+        delay = self.server.latency_ms + random.uniform(0, self.server.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        if not path.startswith(API_PREFIX):
+            return self.send_json(404, {"errors": [{"message": "Not found"}]})
+        path = path[len(API_PREFIX):]
+        for route_method, pattern, name in self.COMPILED_ROUTES:
+            match = pattern.match(path)
+            if match is None or route_method != method:
+                continue
+            self.server.count_request(method + " " + pattern.pattern[1:-1])
+            if name != "do_login" and not self.is_logged_in():
+                return self.send_json(401, {"errors": [{"message": "Session expired"}]})
+            return getattr(self, name)(*match.groups())
+        self.server.count_request(method + " unknown")
+        self.send_json(404, {"errors": [{"message": "Not found"}]})
+
+    def get_session_cookie(self):
+        for header in self.headers.get("Cookie", "").split(";"):
+            name, _, value = header.strip().partition("=")
+            if name == SESSION_COOKIE:
+                return value
+        return None
+
+    def is_logged_in(self):
+        cookie = self.get_session_cookie()
+        with self.server.lock:
+            expires_at = self.server.sessions.get(cookie)
+        return expires_at is not None and time.time() < expires_at
+
+    def get_int_param(self, name, default=None):
+        values = self.query.get(name)
+        if not values:
+            return default
+        return int(values[0].strip('"'))
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if status == 200 and self.command == "GET" and self.headers.get("If-None-Match") == etag:
+            status = 304
+            body = b""
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", "application/json")
+        if self.command == "GET":
+            self.send_header("ETag", etag)
+        if self.server.compress and len(body) >= COMPRESS_MIN_BYTES and accepts_gzip(self.headers.get("Accept-Encoding")):
+            # wbits 31: gzip container
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Vary", "Accept-Encoding")
+        for name, value in (headers or []):
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_page(self, items_key, records):
+        """ Sends a list response, one page of it if pagingfrom/pagingsize are given """
+        total = len(records)
+        offset = self.get_int_param("pagingfrom", 0)
+        size = self.get_int_param("pagingsize")
+        if size is not None:
+            records = records[offset:offset + size]
+        self.send_json(200, {items_key: records, "totalCount": total})
+
+    def filter_records(self, records):
+        filters = [json.loads(value) for value in self.query.get("filter", [])]
+        fleet = self.server.fleet
+        return [record for record in records if all(match_filter(fleet, record, flt) for flt in filters)]
+
+    def do_login(self, client_identifier, session_timeout):
+        try:
+            credentials = json.loads(self.body.decode("utf-8"))
+        except ValueError:
+            credentials = {}
+        if not credentials.get("keyId") or not credentials.get("keyValue"):
+            return self.send_json(401, {"errors": [{"message": "Invalid key"}]})
+        with self.server.lock:
+            cookie = "fake%08d" % self.server.next_session_number
+            self.server.next_session_number += 1
+            self.server.sessions[cookie] = time.time() + int(session_timeout)
+        self.send_json(200, {"clientIdentifier": client_identifier, "sessionTimeout": int(session_timeout)},
+                       [("Set-Cookie", "%s=%s; Path=/" % (SESSION_COOKIE, cookie))])
+
+    def do_logout(self):
+        with self.server.lock:
+            self.server.sessions.pop(self.get_session_cookie(), None)
+        self.send_json(200, {})
+
+    def get_location_tree(self):
+        self.send_json(200, self.server.fleet.get_location_tree())
+
+    def get_managed_devices(self):
+        records = self.server.fleet.managed_devices
+        locid = self.get_int_param("locationid")
+        if locid is not None:
+            subtree = self.server.fleet.get_subtree(locid)
+            records = [md for md in records if md["locationId"] in subtree]
+        self.send_page("managedDevices", self.filter_records(records))
+
+    def get_observing_devices(self, boxid):
+        self.send_json(200, self.server.fleet.get_observing_devices(int(boxid)))
+
+    def get_clients(self):
+        self.send_page("clients", self.filter_records(self.server.fleet.clients))
+
+    def get_association_data(self, start_time, end_time):
+        records = self.server.fleet.get_association_data(int(start_time), int(end_time))
+        self.send_json(200, {"associationData": records})
+
+    def get_conn_stats(self):
+        self.send_json(200, self.server.fleet.get_conn_stats(
+            self.get_int_param("locationid", 0), self.get_int_param("fromtime"), self.get_int_param("totime")))
+
+    def get_virtual_aps(self):
+        aps = [{"boxId": 1, "ssid": "Corp", "group": "AUTHORIZED"}, {"boxId": 2, "ssid": "Guest", "group": "AUTHORIZED"}]
+        self.send_page("aps", self.filter_records(aps))
+
+    def get_ssid_profiles(self):
+        self.send_json(200, {"templates": [{"id": 1, "name": "Corp"}, {"id": 2, "name": "Guest"}]})
+
+    def start_conn_test(self):
+        try:
+            params = json.loads(self.body.decode("utf-8"))
+        except ValueError:
+            params = {}
+        devices = self.server.fleet.devices_by_boxid
+        if params.get("targetApBoxId") not in devices or params.get("targetClientBoxId") not in devices:
+            return self.send_json(400, {"errors": [{"message": "Unknown device"}]})
+        with self.server.lock:
+            session_id = max(self.server.conn_tests) + 1
+            self.server.conn_tests[session_id] = time.time() + self.server.test_duration
+        self.send_json(200, {"sessionId": session_id})
+
+    def get_conn_test_status(self):
+        session_id = self.get_int_param("sessionid")
+        with self.server.lock:
+            completes_at = self.server.conn_tests.get(session_id)
+        if completes_at is None:
+            return self.send_json(200, [])
+        status = CONN_TEST_COMPLETED if time.time() >= completes_at else CONN_TEST_RUNNING
+        self.send_json(200, [{"sessionId": session_id, "sessionStatus": status}])
+
+    def get_conn_test_result(self, session_id):
+        session_id = int(session_id)
+        with self.server.lock:
+            completes_at = self.server.conn_tests.get(session_id)
+        if completes_at is None or time.time() < completes_at:
+            return self.send_json(404, {"errors": [{"message": "No result"}]})
+        self.send_json(200, get_conn_test_result(session_id))
+
+
+def accepts_gzip(accept_encoding):
+    """ True if an Accept-Encoding header value allows gzip (not with q=0) """
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def start_fake_server(fleet=None, host="127.0.0.1", port=0, **kwargs):
+    """ Starts a FakeMwmServer on a daemon thread
+
+    :param fleet: FakeFleet to serve (default sized one if None)
+    :param kwargs: latency_ms, jitter_ms, test_duration, verbose, compress, max_concurrent of FakeMwmServer
+    :return: FakeMwmServer, stop with server.shutdown() and server.server_close()
+    """
+    if fleet is None:
+        fleet = FakeFleet()
+    server = FakeMwmServer((host, port), fleet, **kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Mojo cloud webservice API (plain http)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 picks a free port")
+    parser.add_argument("--locations", type=int, default=DEFAULT_LOCATIONS)
+    parser.add_argument("--aps-per-location", type=int, default=DEFAULT_APS_PER_LOCATION)
+    parser.add_argument("--clients-per-ap", type=int, default=DEFAULT_CLIENTS_PER_AP)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--test-duration", type=float, default=DEFAULT_TEST_DURATION,
+                        help="seconds a live network test runs")
+    parser.add_argument("--no-compression", action="store_true", help="never gzip the responses")
+    parser.add_argument("--max-concurrent", type=int, help="requests served at once, the others get 429")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    fleet = FakeFleet(args.locations, args.aps_per_location, args.clients_per_ap, args.seed)
+    server = FakeMwmServer((args.host, args.port), fleet, args.latency_ms, args.jitter_ms, args.test_duration,
+                           args.verbose, not args.no_compression, args.max_concurrent)
+    # The benchmark reads the address from this line
+    print("Listening on " + server.get_hostname())
+    print("%d locations, %d managed devices, %d clients" % (
+        len(fleet.locations), len(fleet.managed_devices), len(fleet.clients)))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+# Local inventory of managed APs and virtual APs per tenant, synced incrementally
+#
+# A sync streams the inventory and compares every record with the stored one
+# by a hash of its content, so only records that changed are written and
+# reported as deltas: added, removed, gone down, come up, or changed. When the
+# records carry a modification time (MODIFIED_TIME_FIELD), the next sync asks
+# the server only for the records modified since the newest one seen, and a
+# full sync every INVENTORY_FULL_SYNC_INTERVAL seconds catches removals.
+# Device counts and "which APs went down" are then answered from the store.
+import json
+import threading
+import time
+
+from mwmRollup import get_record_location_id
+from mwmSqlite import load_sqlite3
+
+KIND_MANAGED_DEVICES = "managed_devices"
+KIND_VIRTUAL_APS = "virtual_aps"
+INVENTORY_KINDS = (KIND_MANAGED_DEVICES, KIND_VIRTUAL_APS)
+# Record fields making up the id of a record, per kind
+INVENTORY_ID_FIELDS = {
+    KIND_MANAGED_DEVICES: ("boxId",),
+    KIND_VIRTUAL_APS: ("boxId", "ssid"),
+}
+# Server side modification time of a record (epoch milli-seconds), and its filter property
+MODIFIED_TIME_FIELD = "modifiedTime"
+MODIFIED_TIME_PROPERTY = "modifiedtime"
+# Fields left out of the record hash, they change without the device changing
+HASH_IGNORED_FIELDS = ("upTime", "lastSeen")
+
+# Seconds between full syncs when incremental ones are possible (removals are only seen by full syncs)
+INVENTORY_FULL_SYNC_INTERVAL = 3600
+# Seconds deltas are kept
+INVENTORY_CHANGES_RETENTION = 7 * 86400
+
+CHANGE_ADDED = "added"
+CHANGE_REMOVED = "removed"
+CHANGE_DOWN = "down"
+CHANGE_UP = "up"
+CHANGE_CHANGED = "changed"
+
+
+class InventorySyncError(Exception):
+    """ The inventory could not be read completely, nothing was applied """
+    pass
+
+
+def get_record_id(kind, record):
+    """ Id of an inventory record, as stored """
+    return "/".join(str(record.get(field)) for field in INVENTORY_ID_FIELDS[kind])
+
+
+def get_record_hash(record):
+    """ Hash of the record content, HASH_IGNORED_FIELDS left out """
+    import hashlib
+    content = dict((key, record[key]) for key in record if key not in HASH_IGNORED_FIELDS)
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _get_active(record):
+    if 'active' not in record:
+        return None
+    return 1 if record['active'] == True else 0
+
+
+def _scope(key):
+    return "/".join(str(part) for part in key)
+
+
+class InventoryStore:
+    """ Inventory records (id, location, name, active, hash) and their deltas per tenant in SQLite """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()    # one sync at a time
+        self.stats_lock = threading.Lock()
+        self.syncs = 0
+        self.full_syncs = 0
+        self.failures = 0
+        self.changes = 0
+        self.last_failure = None
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS inventory (scope TEXT, kind TEXT, id TEXT, locid, name TEXT,"
+                " active INTEGER, hash TEXT, PRIMARY KEY (scope, kind, id))")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS inventory_by_location ON inventory (scope, kind, locid)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS inventory_changes (scope TEXT, kind TEXT, id TEXT, locid, name TEXT,"
+                " change TEXT, changed_at REAL)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS inventory_changes_by_time ON inventory_changes (scope, kind, changed_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS inventory_syncs (scope TEXT, kind TEXT, synced_at REAL,"
+                " full_synced_at REAL, modified_since, PRIMARY KEY (scope, kind))")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return load_sqlite3().connect(self.path, timeout=5)
+
+    def _query(self, sql, params):
+        connection = self._connect()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def _iter_records(self, records):
+        # Counts a sync failing while the records are read
+        try:
+            for record in records:
+                yield record
+        except Exception as e:
+            with self.stats_lock:
+                self.failures += 1
+                self.last_failure = str(e)
+            raise
+
+    def get_sync_state(self, key, kind):
+        """ {'synced_at', 'full_synced_at', 'modified_since'} of the last sync, None before the first
+
+        modified_since is the newest modification time seen, None when the
+        records do not carry one (every sync is then a full one).
+        """
+        rows = self._query("SELECT synced_at, full_synced_at, modified_since FROM inventory_syncs"
+                           " WHERE scope = ? AND kind = ?", [_scope(key), kind])
+        if len(rows) == 0:
+            return None
+        return {'synced_at': rows[0][0], 'full_synced_at': rows[0][1], 'modified_since': rows[0][2]}
+
+    def sync(self, key, kind, records, full, synced_at=None):
+        """ Applies streamed inventory records to the store
+
+        Nothing is written before all records are read, an exception raised
+        by records (InventorySyncError, DeadlineExceeded) leaves the store as it was.
+
+        :param key: tenant key (MwmApi.get_session_key())
+        :param kind: one of INVENTORY_KINDS
+        :param records: iterable of all records (full) or of the records modified since the last sync
+        :param full: records missing from a full sync are removed
+        :return: list of deltas {'change' (CHANGE_*), 'id', 'locid', 'name'}
+        """
+        if synced_at is None:
+            synced_at = time.time()
+        scope = _scope(key)
+        with self.lock:
+            stored = {}
+            for record_id, active, record_hash, locid, name in self._query(
+                    "SELECT id, active, hash, locid, name FROM inventory WHERE scope = ? AND kind = ?", [scope, kind]):
+                stored[record_id] = (active, record_hash, locid, name)
+            state = self.get_sync_state(key, kind)
+
+            deltas = []
+            upserts = []
+            seen = set()
+            modified_since = None
+            if not full and state is not None:
+                modified_since = state['modified_since']
+            has_modified_time = True
+            for record in self._iter_records(records):
+                record_id = get_record_id(kind, record)
+                seen.add(record_id)
+                modified = record.get(MODIFIED_TIME_FIELD)
+                if modified is None:
+                    has_modified_time = False
+                elif modified_since is None or modified > modified_since:
+                    modified_since = modified
+                record_hash = get_record_hash(record)
+                previous = stored.get(record_id)
+                if previous is not None and previous[1] == record_hash:
+                    continue
+                active = _get_active(record)
+                locid = get_record_location_id(record)
+                name = record.get('name') or record.get('ssid')
+                upserts.append((scope, kind, record_id, locid, name, active, record_hash))
+                if previous is None:
+                    change = CHANGE_ADDED
+                elif previous[0] == 1 and active == 0:
+                    change = CHANGE_DOWN
+                elif previous[0] == 0 and active == 1:
+                    change = CHANGE_UP
+                else:
+                    change = CHANGE_CHANGED
+                deltas.append({'change': change, 'id': record_id, 'locid': locid, 'name': name})
+            removed = []
+            if full:
+                removed = [record_id for record_id in stored if record_id not in seen]
+                for record_id in removed:
+                    deltas.append({'change': CHANGE_REMOVED, 'id': record_id, 'locid': stored[record_id][2],
+                                   'name': stored[record_id][3]})
+            if not has_modified_time:
+                modified_since = None
+            full_synced_at = synced_at if full or state is None else state['full_synced_at']
+
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO inventory VALUES (?, ?, ?, ?, ?, ?, ?)", upserts)
+                    connection.executemany("DELETE FROM inventory WHERE scope = ? AND kind = ? AND id = ?",
+                                           [(scope, kind, record_id) for record_id in removed])
+                    connection.executemany(
+                        "INSERT INTO inventory_changes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(scope, kind, delta['id'], delta['locid'], delta['name'], delta['change'], synced_at)
+                         for delta in deltas])
+                    connection.execute("DELETE FROM inventory_changes WHERE scope = ? AND kind = ? AND changed_at < ?",
+                                       (scope, kind, synced_at - INVENTORY_CHANGES_RETENTION))
+                    connection.execute("INSERT OR REPLACE INTO inventory_syncs VALUES (?, ?, ?, ?, ?)",
+                                       (scope, kind, synced_at, full_synced_at, modified_since))
+            finally:
+                connection.close()
+            with self.stats_lock:
+                self.syncs += 1
+                if full:
+                    self.full_syncs += 1
+                self.changes += len(deltas)
+            return deltas
+
+    def count_devices_by_location(self, key, locids=None):
+        """ Active and inactive managed AP counts per location, like mwmRollup.count_devices_by_location
+
+        :param locids: set of location ids to count, None for all
+        :return: dict location id => [active, inactive]
+        """
+        counts = {}
+        for locid, active, count in self._query(
+                "SELECT locid, active, COUNT(*) FROM inventory WHERE scope = ? AND kind = ? GROUP BY locid, active",
+                [_scope(key), KIND_MANAGED_DEVICES]):
+            if locids is not None and locid not in locids:
+                continue
+            entry = counts.get(locid)
+            if entry is None:
+                entry = counts[locid] = [0, 0]
+            entry[0 if active == 1 else 1] += count
+        return counts
+
+    def get_inactive(self, key, kind=KIND_MANAGED_DEVICES):
+        """ (id, locid, name) of the inactive records """
+        return self._query("SELECT id, locid, name FROM inventory WHERE scope = ? AND kind = ? AND active = 0"
+                           " ORDER BY name", [_scope(key), kind])
+
+    def get_changes(self, key, since, changes=None, kind=KIND_MANAGED_DEVICES):
+        """ Deltas recorded since a time, newest first
+
+        :param since: time.time() of the oldest delta returned
+        :param changes: CHANGE_* values to return, None for all
+        :return: list of {'change', 'id', 'locid', 'name', 'changed_at'}
+        """
+        sql = "SELECT change, id, locid, name, changed_at FROM inventory_changes" \
+            " WHERE scope = ? AND kind = ? AND changed_at >= ?"
+        params = [_scope(key), kind, since]
+        if changes is not None:
+            sql += " AND change IN (" + ", ".join(["?"] * len(changes)) + ")"
+            params.extend(changes)
+        rows = self._query(sql + " ORDER BY changed_at DESC", params)
+        return [dict(zip(('change', 'id', 'locid', 'name', 'changed_at'), row)) for row in rows]
+
+    def is_fresh(self, key, kinds, max_age):
+        """ True if every kind was synced less than max_age seconds ago """
+        for kind in kinds:
+            state = self.get_sync_state(key, kind)
+            if state is None or time.time() - state['synced_at'] > max_age:
+                return False
+        return True
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "syncs": self.syncs,
+                "full_syncs": self.full_syncs,
+                "failures": self.failures,
+                "changes": self.changes,
+                "last_failure": self.last_failure,
+            }
+
+
+def open_inventory(path):
+    """ InventoryStore at path, None (no local inventory) if sqlite3 is not available """
+    if load_sqlite3() is None:
+        print("sqlite3 not available, the device inventory is not kept locally")
+        return None
+    return InventoryStore(path)
@@ -0,0 +1,68 @@
+# JSON decoding of API responses
+#
+# The fastest installed decoder is used (orjson, then ujson) and the standard
+# library json module otherwise. The choice is made on first use and can be
+# forced with the MWM_JSON_DECODER environment variable (MWM_JSON_DECODER=json
+# for the standard library) or set_json_decoder().
+import json
+import os
+import threading
+
+# Decoders tried in this order
+JSON_DECODERS = ("orjson", "ujson", "json")
+
+_decoder = None         # (name, loads) in use, chosen on first use
+_decoder_lock = threading.Lock()
+
+
+def _load_decoder(name):
+    """ loads function of a decoder, None if it is not installed
+
+    :param name: one of JSON_DECODERS
+    """
+    if name == "json":
+        return json.loads
+    if name not in JSON_DECODERS:
+        raise ValueError("Unknown JSON decoder: " + str(name))
+    try:
+        module = __import__(name)
+    except ImportError:
+        return None
+    return module.loads
+
+
+def set_json_decoder(name=None):
+    """ Selects the decoder by name, the fastest installed one if name is None
+
+    :param name: one of JSON_DECODERS
+    :return: name of the decoder in use
+    """
+    global _decoder
+    names = JSON_DECODERS if name is None else (name,)
+    for candidate in names:
+        loads = _load_decoder(candidate)
+        if loads is not None:
+            with _decoder_lock:
+                _decoder = (candidate, loads)
+            return candidate
+    raise ValueError("JSON decoder " + str(name) + " is not installed")
+
+
+def get_json_decoder():
+    """ (name, loads) of the decoder in use """
+    if _decoder is None:
+        name = os.environ.get("MWM_JSON_DECODER") or None
+        try:
+            set_json_decoder(name)
+        except ValueError as e:
+            print(str(e) + ", choosing the fastest installed one")
+            set_json_decoder()
+    return _decoder
+
+
+def loads(data):
+    """ Decodes a JSON document
+
+    :param data: bytes (UTF-8) or text
+    """
+    return get_json_decoder()[1](data)
@@ -0,0 +1,321 @@
+# In-memory index over the MWM location tree (locations/tree)
+import re
+from array import array
+from bisect import bisect_left
+
+# Minimum similarity (0..1) for a near-miss name match
+NAME_MATCH_CUTOFF = 0.75
+# Minimum similarity (0..1) for a misrecognised word to match a location name word
+TOKEN_MATCH_CUTOFF = 0.75
+
+# Speech recognition spells out small numbers ("building five")
+NUMBER_WORDS = {
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9", "ten": "10",
+    "eleven": "11", "twelve": "12", "thirteen": "13", "fourteen": "14", "fifteen": "15",
+    "sixteen": "16", "seventeen": "17", "eighteen": "18", "nineteen": "19", "twenty": "20",
+    "first": "1", "second": "2", "third": "3", "fourth": "4", "fifth": "5",
+}
+
+# Words joining a location name to the name of a location above it ("corporate in campus a")
+SCOPE_WORDS = ("in", "at", "under")
+
+_APOSTROPHE = re.compile(r"['`]")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def tokenize_location_name(name):
+    """ Splits a location name into normalized words
+
+    "Joe's Cafe - Building Five" => ["joes", "cafe", "building", "5"]
+    """
+    if name is None:
+        return []
+    name = _APOSTROPHE.sub("", name.lower()).replace("&", " and ")
+    return [NUMBER_WORDS.get(token, token) for token in _NON_ALNUM.split(name) if token]
+
+
+def normalize_location_name(name):
+    """ Case, punctuation and number word insensitive form of a location name """
+    return " ".join(tokenize_location_name(name))
+
+
+def location_ref_id(ref):
+    """ Id of a location reference, either a plain id or {"type": ..., "id": id} """
+    if isinstance(ref, dict):
+        return ref.get('id')
+    return ref
+
+
+class LocationIndex:
+    """ Name and hierarchy lookups over a location tree response
+
+    Built once from the locations/tree payload, lookups do not touch the network.
+
+    Locations are numbered in depth first (pre-order) order and the hierarchy
+    is kept in arrays indexed by that position: the subtree of the location at
+    position p is positions p to end[p] - 1, so "is X under Y" is two integer
+    comparisons and a subtree is a slice.
+    """
+
+    def __init__(self, loctree, built_at=None):
+        """
+        :param loctree: locations/tree response ({"locations": {key: location}})
+        :param built_at: time.time() of the fetch, used for TTL checks by the owner
+        """
+        self.built_at = built_at
+        self.ids = []                   # position => location id, parents before children
+        self.pos = {}                   # location id => position
+        self.names = []                 # position => display name
+        self.parent_pos = array('l')    # position => parent position (-1 for a root)
+        self.end = array('l')           # position => end (exclusive) of its subtree positions
+        self.paths = []                 # position => tuple of positions from its root to itself
+        self.ids_by_name = {}           # normalized name => [ids]
+        self.ids_by_compact = {}        # normalized name without spaces => [ids]
+        self.ids_by_token = {}          # word => set of ids having it in their name
+        self.prefix_keys = []           # sorted names and name endings starting at a word
+        self.prefix_pos = array('l')    # position of the location of each prefix key
+
+        loclist = {}
+        if loctree is not None and 'locations' in loctree:
+            loclist = loctree['locations']
+
+        names = {}
+        parents = {}
+        children = {}
+        for key in loclist:
+            loc = loclist[key]
+            locid = location_ref_id(loc['id'])
+            names[locid] = loc['name']
+            parents[locid] = location_ref_id(loc.get('parentId', loc.get('parent')))
+            children.setdefault(locid, [])
+        for locid in parents:
+            if parents[locid] is not None and parents[locid] in names and parents[locid] != locid:
+                children[parents[locid]].append(locid)
+            else:
+                parents[locid] = None
+
+        # Roots first, then locations only reachable through a parent cycle
+        # (broken at the smallest id)
+        for locid in sorted(locid for locid in parents if parents[locid] is None) + sorted(parents):
+            if locid not in self.pos:
+                self._add_subtree(locid, names, children)
+        # Subtree ends, children have larger positions than their parent
+        for p in range(len(self.ids) - 1, -1, -1):
+            parent = self.parent_pos[p]
+            if parent >= 0 and self.end[p] > self.end[parent]:
+                self.end[parent] = self.end[p]
+
+        prefix_entries = []
+        for p in range(len(self.ids)):
+            locid = self.ids[p]
+            tokens = tokenize_location_name(self.names[p])
+            normalized = " ".join(tokens)
+            self.ids_by_name.setdefault(normalized, []).append(locid)
+            self.ids_by_compact.setdefault(normalized.replace(" ", ""), []).append(locid)
+            for i in range(len(tokens)):
+                self.ids_by_token.setdefault(tokens[i], set()).add(locid)
+                prefix_entries.append((" ".join(tokens[i:]), p))
+        prefix_entries.sort()
+        self.prefix_keys = [key for key, p in prefix_entries]
+        self.prefix_pos = array('l', [p for key, p in prefix_entries])
+
+    def _add_subtree(self, root_id, names, children):
+        # Iterative depth first walk, numbering the locations in pre-order
+        stack = [(root_id, -1)]
+        while len(stack) > 0:
+            locid, parent = stack.pop()
+            if locid in self.pos:
+                continue
+            p = len(self.ids)
+            self.ids.append(locid)
+            self.pos[locid] = p
+            self.names.append(names[locid])
+            self.parent_pos.append(parent)
+            self.end.append(p + 1)
+            self.paths.append((self.paths[parent] if parent >= 0 else ()) + (p,))
+            for child_id in reversed(children[locid]):
+                stack.append((child_id, p))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, locid):
+        return locid in self.pos
+
+    def get_name(self, locid):
+        p = self.pos.get(locid)
+        if p is None:
+            return None
+        return self.names[p]
+
+    def get_parent(self, locid):
+        """ Id of the parent location, None for a root or an unknown location """
+        p = self.pos.get(locid)
+        if p is None or self.parent_pos[p] < 0:
+            return None
+        return self.ids[self.parent_pos[p]]
+
+    def get_roots(self):
+        """ Ids of the locations without a parent (the top of the tree) """
+        return sorted(self.ids[p] for p in range(len(self.ids)) if self.parent_pos[p] < 0)
+
+    def get_children(self, locid):
+        p = self.pos.get(locid)
+        if p is None:
+            return []
+        # Children are the positions of the subtree one level below, skipping their own subtrees
+        children = []
+        child = p + 1
+        while child < self.end[p]:
+            children.append(self.ids[child])
+            child = self.end[child]
+        return children
+
+    def get_leaves(self):
+        """ Ids of the locations without sub-locations """
+        return [self.ids[p] for p in range(len(self.ids)) if self.end[p] == p + 1]
+
+    def get_descendants(self, locid):
+        """ Ids of the subtree rooted at locid (including locid), parents before children """
+        p = self.pos.get(locid)
+        if p is None:
+            return []
+        return self.ids[p:self.end[p]]
+
+    def get_depth(self, locid):
+        """ Number of ancestors of a location (0 for a root), None if unknown """
+        p = self.pos.get(locid)
+        if p is None:
+            return None
+        return len(self.paths[p]) - 1
+
+    def get_path(self, locid):
+        """ Ids from the root down to locid (included), empty if unknown """
+        p = self.pos.get(locid)
+        if p is None:
+            return []
+        return [self.ids[ancestor] for ancestor in self.paths[p]]
+
+    def is_under(self, locid, ancestor_id):
+        """ True if locid is ancestor_id or one of its descendants """
+        p = self.pos.get(locid)
+        ancestor = self.pos.get(ancestor_id)
+        if p is None or ancestor is None:
+            return False
+        return ancestor <= p < self.end[ancestor]
+
+    def find_ids(self, name, scope=None):
+        """ All location ids whose name matches exactly after normalization
+
+        :param scope: location id, only its subtree is searched (whole tree if None)
+        """
+        normalized = normalize_location_name(name)
+        ids = self.ids_by_name.get(normalized)
+        if not ids:
+            ids = self.ids_by_compact.get(normalized.replace(" ", ""), [])
+        return [locid for locid in ids if scope is None or self.is_under(locid, scope)]
+
+    def find_prefix(self, prefix, scope=None, limit=None):
+        """ Ids of the locations having a name word sequence starting with prefix
+
+        "joes caf" and "cafe" both find "Joe's Cafe". Binary search over the
+        sorted name keys, results in tree order.
+
+        :param scope: location id, only its subtree is searched (whole tree if None)
+        :param limit: max ids returned
+        """
+        normalized = normalize_location_name(prefix)
+        if not normalized:
+            return []
+        first = bisect_left(self.prefix_keys, normalized)
+        last = bisect_left(self.prefix_keys, normalized + "~", first)
+        positions = set()
+        for i in range(first, last):
+            p = self.prefix_pos[i]
+            if scope is None or self.is_under(self.ids[p], scope):
+                positions.add(p)
+        ids = [self.ids[p] for p in sorted(positions)]
+        if limit is not None:
+            ids = ids[:limit]
+        return ids
+
+    def get_distinguishing_names(self, ids):
+        """ Spoken names telling same named locations apart by their ancestors
+
+        [corporate under "Campus A", corporate under "Campus B"] =>
+        {id1: "Corporate in Campus A", id2: "Corporate in Campus B"}
+
+        :return: dict id => name, the plain name where no ancestor differs
+        """
+        paths = [self.paths[self.pos[locid]] for locid in ids if locid in self.pos]
+        common = 0
+        if len(paths) > 0:
+            while all(len(path) > common + 1 and path[common] == paths[0][common] for path in paths):
+                common += 1
+        names = {}
+        for locid in ids:
+            p = self.pos.get(locid)
+            if p is None:
+                continue
+            path = self.paths[p]
+            # The ancestor right below the deepest one shared by all
+            if common < len(path) - 1:
+                names[locid] = self.names[p] + " in " + self.names[path[common]]
+            else:
+                names[locid] = self.names[p]
+        return names
+
+    def _find_scoped(self, tokens):
+        # "corporate in campus a": the location named by the words before the
+        # last "in", "at" or "under", searched below the one named after it
+        for i in range(len(tokens) - 2, 0, -1):
+            if tokens[i] in SCOPE_WORDS:
+                scope = self.find(" ".join(tokens[i + 1:]))
+                if scope is not None:
+                    return self.find(" ".join(tokens[:i]), scope)
+        return None
+
+    def find(self, name, scope=None):
+        """ Id of the location best matching a spoken name
+
+        Tries an exact normalized match first, then "name in parent name"
+        phrases, then near-misses of the words found through the word index.
+        The first in tree order wins among same named locations
+        (get_distinguishing_names() helps asking which one was meant).
+
+        :param name: location name as recognised by speech ("building five")
+        :param scope: location id, only its subtree is searched (whole tree if None)
+        :return: location id or None
+        """
+        ids = self.find_ids(name, scope)
+        if ids:
+            return ids[0]
+
+        tokens = tokenize_location_name(name)
+        if not tokens:
+            return None
+        locid = self._find_scoped(tokens)
+        if locid is not None and (scope is None or self.is_under(locid, scope)):
+            return locid
+
+        # Fuzzy matching only, difflib is not loaded at cold start
+        import difflib
+        candidates = set()
+        for token in tokens:
+            for match in difflib.get_close_matches(token, self.ids_by_token.keys(), 3, TOKEN_MATCH_CUTOFF):
+                candidates.update(self.ids_by_token[match])
+
+        normalized = " ".join(tokens)
+        best_pos = None
+        best_ratio = 0
+        for p in sorted(self.pos[locid] for locid in candidates):
+            if scope is not None and not self.is_under(self.ids[p], scope):
+                continue
+            ratio = difflib.SequenceMatcher(None, normalized, normalize_location_name(self.names[p])).ratio()
+            if ratio >= NAME_MATCH_CUTOFF and ratio > best_ratio:
+                best_pos = p
+                best_ratio = ratio
+        if best_pos is None:
+            return None
+        return self.ids[best_pos]
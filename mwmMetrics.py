@@ -0,0 +1,246 @@
+# Per endpoint call counters and latency histograms of the MWM API client
+import json
+import re
+import threading
+import time
+
+# Upper bounds (milli-seconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# CloudWatch namespace of the embedded metric format lines
+METRICS_NAMESPACE = "MojoAlexa/MwmApi"
+
+_ID_SEGMENT = re.compile(r"^[0-9]+$")
+
+
+def endpoint_template(relative_path):
+    """ Endpoint name for a request path, ids replaced by a placeholder
+
+    "devices/manageddevices/1234/observingmanageddevices" => "devices/manageddevices/{id}/observingmanageddevices"
+    "/login/key/api-client/3000" => "login"
+    """
+    path = relative_path.split("?", 1)[0].strip("/")
+    if path.startswith("login/"):
+        return "login"
+    segments = path.split("/")
+    for i in range(len(segments)):
+        if _ID_SEGMENT.match(segments[i]):
+            segments[i] = "{id}"
+    return "/".join(segments)
+
+
+class EndpointStats:
+    """ Counters of one endpoint """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0                 # calls failed without a response
+        self.retries = 0
+        self.coalesced = 0              # calls served by an identical call in flight
+        self.status_codes = {}          # status code => count
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.decodes = 0                # JSON bodies decoded
+        self.bytes_decoded = 0          # size of the decoded bodies (after decompression)
+        self.decode_total_ms = 0.0
+        self.latency_total_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def latency_percentile(self, percentile):
+        """ Upper bound of the histogram bucket holding the given percentile (0..100) """
+        if self.calls == 0:
+            return 0
+        rank = percentile / 100.0 * self.calls
+        seen = 0
+        for i in range(len(self.latency_buckets)):
+            seen += self.latency_buckets[i]
+            if seen >= rank:
+                if i < len(LATENCY_BUCKETS_MS):
+                    return min(LATENCY_BUCKETS_MS[i], self.latency_max_ms)
+                return self.latency_max_ms
+        return self.latency_max_ms
+
+    def to_dict(self):
+        avg_ms = 0.0
+        if self.calls > 0:
+            avg_ms = self.latency_total_ms / self.calls
+        decode_avg_ms = 0.0
+        if self.decodes > 0:
+            decode_avg_ms = self.decode_total_ms / self.decodes
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "coalesced": self.coalesced,
+            "status_codes": dict((str(code), count) for code, count in self.status_codes.items()),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "decodes": self.decodes,
+            "bytes_decoded": self.bytes_decoded,
+            "decode_avg_ms": round(decode_avg_ms, 2),
+            "decode_total_ms": round(self.decode_total_ms, 2),
+            "latency_avg_ms": round(avg_ms, 1),
+            "latency_p50_ms": round(self.latency_percentile(50), 1),
+            "latency_p99_ms": round(self.latency_percentile(99), 1),
+            "latency_max_ms": round(self.latency_max_ms, 1),
+            "latency_buckets_ms": dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["inf"], self.latency_buckets)),
+        }
+
+
+class ApiMetrics:
+    """ Process wide per endpoint statistics, thread safe """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started_at = time.time()
+
+    def record(self, endpoint, latency_secs, status_code=None, bytes_sent=0, bytes_received=0, retry=False):
+        """ Records one API call
+
+        :param endpoint: endpoint template (endpoint_template())
+        :param latency_secs: time to response headers
+        :param status_code: HTTP status, None if the call failed without a response
+        :param bytes_sent: request body size
+        :param bytes_received: response body size on the wire
+        :param retry: the call repeats an earlier one (for example after login on 401)
+        """
+        latency_ms = latency_secs * 1000.0
+        bucket = len(LATENCY_BUCKETS_MS)
+        for i in range(len(LATENCY_BUCKETS_MS)):
+            if latency_ms <= LATENCY_BUCKETS_MS[i]:
+                bucket = i
+                break
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.calls += 1
+            if status_code is None:
+                stats.errors += 1
+            else:
+                stats.status_codes[status_code] = stats.status_codes.get(status_code, 0) + 1
+            if retry:
+                stats.retries += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency_total_ms += latency_ms
+            if latency_ms > stats.latency_max_ms:
+                stats.latency_max_ms = latency_ms
+            stats.latency_buckets[bucket] += 1
+
+    def record_coalesced(self, endpoint):
+        """ Records a call answered by an identical call already in flight (no request sent) """
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.coalesced += 1
+
+    def record_decode(self, endpoint, decode_secs, bytes_decoded):
+        """ Records the JSON decoding of one response body
+
+        :param endpoint: endpoint template (endpoint_template())
+        :param decode_secs: time spent decoding
+        :param bytes_decoded: size of the decoded body
+        """
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.decodes += 1
+            stats.bytes_decoded += bytes_decoded
+            stats.decode_total_ms += decode_secs * 1000.0
+
+    def snapshot(self, reset=False):
+        """ Statistics per endpoint as dicts, optionally starting a new period """
+        with self.lock:
+            endpoints = dict((name, stats.to_dict()) for name, stats in self.endpoints.items())
+            if reset:
+                self.endpoints = {}
+                self.started_at = time.time()
+        return endpoints
+
+
+def format_metric_lines(endpoints, namespace=METRICS_NAMESPACE, dimensions=None):
+    """ One CloudWatch embedded metric format JSON line per endpoint
+
+    Lambda forwards these log lines to CloudWatch metrics without extra API calls.
+
+    :param endpoints: ApiMetrics.snapshot() result
+    :param dimensions: extra dimensions ({"Intent": "NetworkStatus"})
+    :return: list of strings
+    """
+    lines = []
+    timestamp = int(time.time() * 1000)
+    for endpoint in sorted(endpoints):
+        stats = endpoints[endpoint]
+        record = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": [["Endpoint"] + sorted((dimensions or {}).keys())],
+                    "Metrics": [
+                        {"Name": "Calls", "Unit": "Count"},
+                        {"Name": "Errors", "Unit": "Count"},
+                        {"Name": "Retries", "Unit": "Count"},
+                        {"Name": "Coalesced", "Unit": "Count"},
+                        {"Name": "BytesReceived", "Unit": "Bytes"},
+                        {"Name": "BytesDecoded", "Unit": "Bytes"},
+                        {"Name": "DecodeTime", "Unit": "Milliseconds"},
+                        {"Name": "LatencyAvg", "Unit": "Milliseconds"},
+                        {"Name": "LatencyMax", "Unit": "Milliseconds"},
+                    ]
+                }]
+            },
+            "Endpoint": endpoint,
+            "Calls": stats["calls"],
+            "Errors": stats["errors"],
+            "Retries": stats["retries"],
+            "Coalesced": stats["coalesced"],
+            "BytesReceived": stats["bytes_received"],
+            "BytesDecoded": stats["bytes_decoded"],
+            "DecodeTime": stats["decode_total_ms"],
+            "LatencyAvg": stats["latency_avg_ms"],
+            "LatencyMax": stats["latency_max_ms"],
+            "StatusCodes": stats["status_codes"],
+            "BytesSent": stats["bytes_sent"],
+            "LatencyP50": stats["latency_p50_ms"],
+            "LatencyP99": stats["latency_p99_ms"],
+        }
+        record.update(dimensions or {})
+        lines.append(json.dumps(record, sort_keys=True))
+    return lines
+
+
+def print_metric_lines(endpoints, dimensions=None):
+    """ Default sink, prints embedded metric format lines to the (CloudWatch) log """
+    for line in format_metric_lines(endpoints, dimensions=dimensions):
+        print(line)
+
+
+api_metrics = ApiMetrics()
+_metrics_sink = print_metric_lines
+
+
+def set_metrics_sink(sink):
+    """ Replaces the exporter called by flush_metrics
+
+    :param sink: callable(endpoints, dimensions) receiving ApiMetrics.snapshot() dicts, None to disable export
+    """
+    global _metrics_sink
+    _metrics_sink = sink
+
+
+def flush_metrics(dimensions=None):
+    """ Exports the statistics gathered since the last flush (once per invocation) and resets them
+
+    :param dimensions: extra dimensions of the exported metrics
+    :return: the exported statistics per endpoint
+    """
+    endpoints = api_metrics.snapshot(reset=True)
+    if _metrics_sink is not None and len(endpoints) > 0:
+        _metrics_sink(endpoints, dimensions)
+    return endpoints
@@ -0,0 +1,252 @@
+# Client side rate limiting of the MWM API calls, per host and tenant
+#
+# Every request takes a token from a token bucket (sustained rate and burst)
+# and a slot of an adaptive concurrency limit. The limit grows by one slot per
+# limit's worth of successful calls and is cut by a factor when the server
+# throttles (429/503), fails (5xx) or slows down well past its usual latency
+# (AIMD). Retries of idempotent calls wait a jittered, growing delay and are
+# paid from a retry budget earned by first attempts, so retries cannot
+# multiply the load while the server is struggling.
+import random
+import threading
+import time
+
+# Sustained requests per second and burst per (host, tenant)
+RATE_LIMIT_RATE = 20.0
+RATE_LIMIT_BURST = 20
+# Concurrent requests per (host, tenant): starting, lowest and highest limit
+CONCURRENCY_INITIAL = 4
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 10            # mwmApi.HTTP_POOL_MAXSIZE, one keep-alive connection per call
+# Multiplicative decrease on throttling. Only calls sent after the last
+# decrease can decrease again, so a burst of failures counts once.
+CONCURRENCY_DECREASE = 0.7
+# A call slower than LATENCY_TOLERANCE times the usual latency (and at least
+# LATENCY_MIN_CONGESTION seconds) counts as a sign of congestion
+LATENCY_TOLERANCE = 3.0
+LATENCY_MIN_CONGESTION = 1.0
+LATENCY_SMOOTHING = 0.1         # weight of a new sample in the usual latency average
+
+# Status codes of a server asking to slow down, and of retryable failures
+THROTTLE_STATUS_CODES = (429, 503)
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+# Methods safe to send again
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+# Retries of a call, and delays (seconds) before them: random up to
+# min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2^attempt) ("full jitter")
+RETRY_MAX_ATTEMPTS = 2
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 2.0
+# Longest Retry-After (seconds) waited for, a call asked to wait longer is not retried
+RETRY_AFTER_MAX_DELAY = 10.0
+# Retry budget: tokens earned per first attempt, and the most that can be saved
+RETRY_BUDGET_RATIO = 0.1
+RETRY_BUDGET_MAX = 10.0
+
+
+class TokenBucket:
+    """ Allows rate acquisitions per second on average, burst at once """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """ Takes a token, waiting for one if needed
+
+        :param timeout: max seconds to wait, None for no limit
+        :return: True if a token was taken, False on timeout
+        """
+        give_up_at = None
+        if timeout is not None:
+            give_up_at = time.time() + timeout
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if give_up_at is not None:
+                if now + wait > give_up_at:
+                    return False
+            time.sleep(wait)
+
+
+class AimdLimit:
+    """ Concurrency limit adapted to the server: additive increase, multiplicative decrease """
+
+    def __init__(self, initial=CONCURRENCY_INITIAL, minimum=CONCURRENCY_MIN, maximum=CONCURRENCY_MAX):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.usual_latency = None
+        self.decreased_at = 0
+        self.decreases = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """ Takes a slot, waiting while the limit is reached
+
+        :param timeout: max seconds to wait, None for no limit
+        :return: True if a slot was taken, False on timeout
+        """
+        give_up_at = None
+        if timeout is not None:
+            give_up_at = time.time() + timeout
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                if give_up_at is None:
+                    self.condition.wait()
+                else:
+                    remaining = give_up_at - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def cancel(self):
+        """ Returns a slot taken for a call that was not sent """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def release(self, latency, status_code):
+        """ Returns a slot and adapts the limit to the outcome of the call
+
+        :param latency: seconds to the response (or the failure)
+        :param status_code: HTTP status, None if the call failed without a response
+        """
+        with self.condition:
+            busy = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            congested = status_code is None or status_code in THROTTLE_STATUS_CODES or status_code >= 500
+            if not congested and self.usual_latency is not None:
+                congested = latency > max(LATENCY_MIN_CONGESTION, LATENCY_TOLERANCE * self.usual_latency)
+            if congested:
+                now = time.time()
+                if now - latency >= self.decreased_at:
+                    self.limit = max(self.minimum, self.limit * CONCURRENCY_DECREASE)
+                    self.decreased_at = now
+                    self.decreases += 1
+            else:
+                if self.usual_latency is None:
+                    self.usual_latency = latency
+                else:
+                    self.usual_latency += LATENCY_SMOOTHING * (latency - self.usual_latency)
+                if busy:
+                    # Only a limit in use is raised, an idle one would grow unchecked
+                    self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify()
+
+
+class RateLimiter:
+    """ Token bucket, concurrency limit and retry budget of one (host, tenant) """
+
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AimdLimit()
+        self.lock = threading.Lock()
+        self.retry_tokens = RETRY_BUDGET_MAX
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.retries_denied = 0
+
+    def acquire(self, timeout=None):
+        """ Waits for a token and a concurrency slot
+
+        :param timeout: max seconds to wait for both, None for no limit
+        :return: True when the request may be sent (call release() after it), False on timeout
+        """
+        start = time.time()
+        if not self.bucket.acquire(timeout):
+            return False
+        if timeout is not None:
+            timeout = max(0, timeout - (time.time() - start))
+        return self.concurrency.acquire(timeout)
+
+    def cancel(self):
+        """ Ends a call started with acquire() that was not sent """
+        self.concurrency.cancel()
+
+    def release(self, latency, status_code, retry=False):
+        """ Ends a call started with acquire()
+
+        :param retry: the call was a retry (first attempts earn retry budget)
+        """
+        self.concurrency.release(latency, status_code)
+        with self.lock:
+            self.calls += 1
+            if status_code in THROTTLE_STATUS_CODES:
+                self.throttled += 1
+            if not retry:
+                self.retry_tokens = min(RETRY_BUDGET_MAX, self.retry_tokens + RETRY_BUDGET_RATIO)
+
+    def take_retry(self):
+        """ Pays a retry from the budget, False if the budget is spent """
+        with self.lock:
+            if self.retry_tokens < 1:
+                self.retries_denied += 1
+                return False
+            self.retry_tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "retries_denied": self.retries_denied,
+                "concurrency_limit": round(self.concurrency.limit, 2),
+                "concurrency_decreases": self.concurrency.decreases,
+            }
+
+
+def get_retry_delay(attempt, retry_after=None):
+    """ Seconds to wait before a retry
+
+    :param attempt: retries already made for the call (0 for the first retry)
+    :param retry_after: Retry-After header of the response (seconds), if any
+    :return: seconds, None (no retry) if Retry-After is longer than RETRY_AFTER_MAX_DELAY
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        try:
+            retry_after = float(retry_after)
+        except ValueError:
+            return delay    # HTTP date form, the jittered delay is used
+        if retry_after > RETRY_AFTER_MAX_DELAY:
+            return None
+        delay = max(delay, retry_after)
+    return delay
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(hostname, tenant):
+    """ Process wide RateLimiter of a (host, tenant), created on first use """
+    key = (hostname, tenant)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = _rate_limiters[key] = RateLimiter()
+        return limiter
+
+
+def get_rate_limiter_stats():
+    """ RateLimiter.stats() per "host/tenant" """
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return dict((str(key[0]) + "/" + str(key[1]), limiters[key].stats()) for key in limiters)
@@ -0,0 +1,100 @@
+# Network status of a location subtree, summed up the location hierarchy
+#
+# The device and client lists of the whole subtree are fetched once and
+# grouped by location while streaming, instead of one call per location.
+from mwmLocations import location_ref_id
+
+
+def get_record_location_id(record):
+    """ Location id of a device or client record, None if it has none """
+    for key in ('locationId', 'locationid', 'location'):
+        if key in record:
+            return location_ref_id(record[key])
+    return None
+
+
+def count_devices_by_location(devices):
+    """ Active and inactive AP counts per location, in one pass over the records
+
+    :param devices: iterable of managed device records (iter_managed_ap_devices)
+    :return: dict location id => [active, inactive]
+    """
+    counts = {}
+    for md in devices:
+        locid = get_record_location_id(md)
+        count = counts.get(locid)
+        if count is None:
+            count = counts[locid] = [0, 0]
+        if md.get('active') == True:
+            count[0] += 1
+        else:
+            count[1] += 1
+    return counts
+
+
+def count_clients_by_location(clients):
+    """ Client counts per location, in one pass over the records
+
+    :param clients: iterable of client records (iter_clients)
+    :return: dict location id => count
+    """
+    counts = {}
+    for client in clients:
+        locid = get_record_location_id(client)
+        counts[locid] = counts.get(locid, 0) + 1
+    return counts
+
+
+def rollup_status(index, root_id, device_counts, client_counts):
+    """ Per location counts of a subtree, each location including its descendants
+
+    Records of unknown locations (or without one) are counted at the root.
+
+    :param index: mwmLocations.LocationIndex
+    :param root_id: location id of the subtree root
+    :param device_counts: count_devices_by_location() result
+    :param client_counts: count_clients_by_location() result
+    :return: dict location id => {'name', 'parent', 'active', 'inactive', 'clients',
+             'own_active', 'own_inactive', 'own_clients'}, parents before children,
+             empty if root_id is not in the index
+    """
+    subtree = index.get_descendants(root_id)
+    rollup = {}
+    for locid in subtree:
+        rollup[locid] = {
+            'name': index.get_name(locid),
+            'parent': index.get_parent(locid) if locid != root_id else None,
+            'own_active': 0, 'own_inactive': 0, 'own_clients': 0,
+        }
+    if len(rollup) == 0:
+        return rollup
+
+    for locid in device_counts:
+        entry = rollup.get(locid, rollup[root_id])
+        entry['own_active'] += device_counts[locid][0]
+        entry['own_inactive'] += device_counts[locid][1]
+    for locid in client_counts:
+        rollup.get(locid, rollup[root_id])['own_clients'] += client_counts[locid]
+
+    # Children come after their parent in subtree, so summing in reverse order
+    # adds every location to its parent once its own subtree is complete
+    for locid in subtree:
+        entry = rollup[locid]
+        entry['active'] = entry['own_active']
+        entry['inactive'] = entry['own_inactive']
+        entry['clients'] = entry['own_clients']
+    for locid in reversed(subtree):
+        entry = rollup[locid]
+        if entry['parent'] is not None:
+            parent = rollup[entry['parent']]
+            parent['active'] += entry['active']
+            parent['inactive'] += entry['inactive']
+            parent['clients'] += entry['clients']
+    return rollup
+
+
+def get_locations_with_inactive_aps(rollup):
+    """ (location id, own inactive AP count) of the locations having inactive APs, most first """
+    locations = [(locid, rollup[locid]['own_inactive']) for locid in rollup if rollup[locid]['own_inactive'] > 0]
+    locations.sort(key=lambda item: (-item[1], rollup[item[0]]['name'] or ""))
+    return locations
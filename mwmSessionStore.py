@@ -0,0 +1,147 @@
+# Login sessions shared by all invocations and voice sessions of a process
+#
+# A login session (its cookies and expiry) is stored per (host, tenant, keyId)
+# and reused until it expires or the server rejects it, so logins scale with
+# the number of tenants instead of the number of utterances. Concurrent
+# callers needing a new session wait for a single login (single flight).
+import json
+import os
+import threading
+import time
+
+
+class SessionStore:
+    """ Base of the stores, keeps the single flight login logic
+
+    Subclasses implement _load(key) and _save(key, record) (record None deletes).
+    A record is {"cookies": cookie dict, "expires_at": time.time() of expiry}.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.login_locks = {}       # key => lock held while logging in
+        self.logins = 0
+        self.hits = 0
+
+    def _get_login_lock(self, key):
+        with self.lock:
+            lock = self.login_locks.get(key)
+            if lock is None:
+                lock = self.login_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, key):
+        """ Valid (not expired) session record of key, None if there is none """
+        record = self._load(key)
+        if record is None or time.time() >= record["expires_at"]:
+            return None
+        return record
+
+    def put(self, key, cookies, expires_at):
+        self._save(key, {"cookies": cookies, "expires_at": expires_at})
+
+    def invalidate(self, key, cookies=None):
+        """ Drops the session of key
+
+        :param cookies: only drop it if it still has these cookies, so a caller
+                        holding a rejected session does not drop a newer one
+        """
+        with self._get_login_lock(key):
+            record = self._load(key)
+            if record is not None and (cookies is None or record["cookies"] == cookies):
+                self._save(key, None)
+
+    def get_or_login(self, key, login):
+        """ Valid session record of key, logging in once if there is none
+
+        Callers arriving while a login is in progress wait for it and share its session.
+
+        :param login: callable() logging in, returns (cookie dict, expires_at)
+        :return: session record
+        """
+        record = self.get(key)
+        if record is None:
+            with self._get_login_lock(key):
+                record = self.get(key)
+                if record is None:
+                    cookies, expires_at = login()
+                    record = {"cookies": cookies, "expires_at": expires_at}
+                    self._save(key, record)
+                    with self.lock:
+                        self.logins += 1
+                    return record
+        with self.lock:
+            self.hits += 1
+        return record
+
+    def stats(self):
+        with self.lock:
+            return {"logins": self.logins, "hits": self.hits}
+
+
+class MemorySessionStore(SessionStore):
+    """ Sessions of this process (a warm Lambda container) """
+
+    def __init__(self):
+        SessionStore.__init__(self)
+        self.records = {}
+
+    def _load(self, key):
+        with self.lock:
+            return self.records.get(key)
+
+    def _save(self, key, record):
+        with self.lock:
+            if record is None:
+                self.records.pop(key, None)
+            else:
+                self.records[key] = record
+
+
+class FileSessionStore(SessionStore):
+    """ Sessions in a JSON file, shared by the processes able to read it (EFS)
+
+    The file holds session cookies, it is created readable by the owner only
+    and replaced atomically. Single flight holds within one process only.
+    """
+
+    def __init__(self, path):
+        SessionStore.__init__(self)
+        self.path = path
+        self.file_lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _load(self, key):
+        with self.file_lock:
+            return self._read().get(_file_key(key))
+
+    def _save(self, key, record):
+        with self.file_lock:
+            content = self._read()
+            if record is None:
+                content.pop(_file_key(key), None)
+            else:
+                content[_file_key(key)] = record
+            temp_path = self.path + ".tmp"
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(content, f)
+            os.rename(temp_path, self.path)
+
+
+def _file_key(key):
+    # JSON object keys are strings
+    return "/".join(str(part) for part in key)
+
+
+def open_session_store(path=None):
+    """ File store at path, in-memory store if path is None or empty """
+    if path:
+        return FileSessionStore(path)
+    return MemorySessionStore()
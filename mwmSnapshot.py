@@ -0,0 +1,235 @@
+# Precomputed network status per location, refreshed on a schedule
+#
+# A scheduled invocation computes the AP and client counts of every location
+# and saves them with the time they were taken. Status questions are then
+# answered from the local store without API calls while the snapshot is fresh.
+#
+# The store is a local file (SQLite, or JSON where sqlite3 is missing). On
+# Lambda it is only shared by the invocations of one container unless the
+# path is on a shared file system (EFS).
+import json
+import os
+import threading
+import time
+
+from mwmLocations import LocationIndex
+from mwmDeadline import MIN_REQUEST_BUDGET
+from mwmSqlite import load_sqlite3
+
+# Row of a location in a snapshot
+SNAPSHOT_COLUMNS = ("locid", "parent", "name", "active", "inactive", "success", "failure")
+# Locations whose connectivity stats are queued on the MwmApi worker pool at once
+SNAPSHOT_BATCH = 16
+
+
+class Snapshot:
+    """ Counts of all locations taken at one point in time """
+
+    def __init__(self, taken_at, rows):
+        """
+        :param taken_at: time.time() when the counts were computed
+        :param rows: tuples in SNAPSHOT_COLUMNS order, counts are None when unknown
+        """
+        self.taken_at = taken_at
+        self.rows = {}
+        for row in rows:
+            self.rows[row[0]] = tuple(row)
+        self.index = None
+        self.index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def age(self):
+        """ Seconds since the counts were computed """
+        return time.time() - self.taken_at
+
+    def get_index(self):
+        """ LocationIndex of the snapshot locations, built on first use """
+        with self.index_lock:
+            if self.index is None:
+                locations = {}
+                for locid in self.rows:
+                    row = self.rows[locid]
+                    locations[str(locid)] = {"id": locid, "parentId": row[1], "name": row[2]}
+                self.index = LocationIndex({"locations": locations}, self.taken_at)
+            return self.index
+
+    def find(self, name):
+        """ Location id best matching a spoken name, None if not found """
+        return self.get_index().find(name)
+
+    def get_ap_count(self, locid):
+        """ {'active', 'inactive'} APs at a location and below, None if unknown """
+        row = self.rows.get(locid)
+        if row is None or row[3] is None or row[4] is None:
+            return None
+        return {'active': row[3], 'inactive': row[4]}
+
+    def get_client_count(self, locid):
+        """ {'successCount', 'failureCount'} clients at a location and below, None if unknown """
+        row = self.rows.get(locid)
+        if row is None or row[5] is None or row[6] is None:
+            return None
+        return {'successCount': row[5], 'failureCount': row[6]}
+
+
+def take_snapshot(mwm_api):
+    """ Computes the counts of every location of the tree
+
+    AP counts come from one rollup per tree root, client connectivity stats
+    are fetched per location on the MwmApi worker pool, SNAPSHOT_BATCH
+    locations at a time. No batch is queued once the deadline of mwm_api
+    leaves less than MIN_REQUEST_BUDGET, so no call outlives the invocation;
+    the locations left have no client counts (None).
+
+    :param mwm_api: authenticated MwmApi
+    :return: Snapshot, None if the location tree could not be fetched
+    """
+    taken_at = time.time()
+    index = mwm_api.get_location_index()
+    if index is None:
+        return None
+
+    rollups = {}
+    for root_id in index.get_roots():
+        rollup = mwm_api.get_status_rollup(root_id)
+        if rollup is not None:
+            rollups.update(rollup['locations'])
+
+    locids = list(rollups)
+    client_counts = {}
+    deadline = mwm_api.get_deadline()
+    for first in range(0, len(locids), SNAPSHOT_BATCH):
+        if deadline is not None and not deadline.allows(MIN_REQUEST_BUDGET):
+            print("Time budget exhausted, " + str(len(locids) - first) + " locations without client counts")
+            break
+        batch = locids[first:first + SNAPSHOT_BATCH]
+        futures = [mwm_api.submit(mwm_api.get_client_counts_at_loc, locid) for locid in batch]
+        for locid, future in zip(batch, futures):
+            try:
+                client_counts[locid] = future.result()
+            except Exception as e:
+                print("Connectivity stats fetch failed for location " + str(locid) + ": " + str(e))
+    rows = []
+    for locid in locids:
+        entry = rollups[locid]
+        success = failure = None
+        client_count = client_counts.get(locid)
+        if client_count is not None:
+            success = client_count['successCount']
+            failure = client_count['failureCount']
+        rows.append((locid, entry['parent'], entry['name'], entry['active'], entry['inactive'], success, failure))
+    return Snapshot(taken_at, rows)
+
+
+class SqliteSnapshotStore:
+    """ Latest snapshot per scope (host and API key) in a SQLite database """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cached = {}        # scope => last loaded Snapshot
+        connection = self._connect()
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS snapshots (scope TEXT PRIMARY KEY, taken_at REAL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS location_status (scope TEXT, locid, parent, name TEXT,"
+                " active INTEGER, inactive INTEGER, success INTEGER, failure INTEGER, PRIMARY KEY (scope, locid))")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return load_sqlite3().connect(self.path, timeout=5)
+
+    def save(self, scope, snapshot):
+        """ Replaces the snapshot of a scope """
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM location_status WHERE scope = ?", (scope,))
+                connection.executemany(
+                    "INSERT INTO location_status VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(scope,) + row for row in snapshot.rows.values()])
+                connection.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)", (scope, snapshot.taken_at))
+        finally:
+            connection.close()
+        with self.lock:
+            self.cached[scope] = snapshot
+
+    def load(self, scope):
+        """ Latest snapshot of a scope, None if there is none
+
+        Rows are read again only when a newer snapshot was saved.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT taken_at FROM snapshots WHERE scope = ?", (scope,)).fetchone()
+            if row is None:
+                return None
+            with self.lock:
+                cached = self.cached.get(scope)
+            if cached is not None and cached.taken_at == row[0]:
+                return cached
+            rows = connection.execute(
+                "SELECT " + ", ".join(SNAPSHOT_COLUMNS) + " FROM location_status WHERE scope = ?", (scope,)).fetchall()
+        finally:
+            connection.close()
+        snapshot = Snapshot(row[0], rows)
+        with self.lock:
+            self.cached[scope] = snapshot
+        return snapshot
+
+
+class FileSnapshotStore:
+    """ Latest snapshot per scope in a JSON file, for runtimes without sqlite3 """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cached = {}        # scope => last loaded Snapshot
+        self.loaded_mtime = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save(self, scope, snapshot):
+        """ Replaces the snapshot of a scope, the file is swapped atomically """
+        with self.lock:
+            content = self._read()
+            content[scope] = {"taken_at": snapshot.taken_at, "rows": [list(row) for row in snapshot.rows.values()]}
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(content, f, separators=(",", ":"))
+            os.rename(temp_path, self.path)
+            self.cached[scope] = snapshot
+
+    def load(self, scope):
+        """ Latest snapshot of a scope, None if there is none
+
+        The file is parsed again only when it changed.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        with self.lock:
+            if mtime != self.loaded_mtime:
+                content = self._read()
+                self.cached = {}
+                for name in content:
+                    self.cached[name] = Snapshot(content[name]["taken_at"], content[name]["rows"])
+                self.loaded_mtime = mtime
+            return self.cached.get(scope)
+
+
+def open_snapshot_store(path):
+    """ SQLite store at path, JSON file store (path + ".json") if sqlite3 is not available """
+    if load_sqlite3() is not None:
+        return SqliteSnapshotStore(path)
+    return FileSnapshotStore(path + ".json")
@@ -0,0 +1,18 @@
+# SQLite access shared by the local stores (mwmSnapshot, mwmTestHistory, mwmInventory)
+#
+# sqlite3 is imported when a store is opened, not at cold start, and some
+# runtimes are built without it.
+
+sqlite3 = None      # set by load_sqlite3()
+
+
+def load_sqlite3():
+    """ Imports sqlite3 on first use, returns the module (None if not available) """
+    global sqlite3
+    if sqlite3 is None:
+        try:
+            import sqlite3 as sqlite3_module
+        except ImportError:
+            return None
+        sqlite3 = sqlite3_module
+    return sqlite3
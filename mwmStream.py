@@ -0,0 +1,180 @@
+# Incremental parsing of large JSON list responses
+#
+# Yields the records of one JSON array as they arrive, so memory is bounded
+# by the largest record instead of the whole response. Records are split out
+# of the text by a small scanner and parsed with the standard json module.
+import codecs
+import json
+import re
+import time
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Characters that change the structure outside of strings
+_STRUCTURE = re.compile(r'["\[\]{},:]')
+# Characters that end or escape inside a string
+_STRING_END = re.compile(r'["\\]')
+
+
+def iter_json_array_items(chunks, items_key=None, stats=None):
+    """ Yields the items of a JSON array from a stream of text/bytes chunks
+
+    The array is either the top level value or the value of items_key in the
+    top level object ({"managedDevices": [...]}).
+
+    :param chunks: iterable of str/bytes chunks of the JSON document
+    :param items_key: key of the array in the top level object (None: top level array only)
+    :param stats: dict, the chunk bytes decoded and the seconds spent decoding
+                  them are added to its "bytes" and "secs" (waiting for chunks
+                  and handling the items are not counted)
+    :return: generator of parsed items
+    """
+    scanner = _ArrayScanner(items_key)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        start = time.time()
+        size = len(chunk)
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        items = scanner.feed(chunk)
+        if stats is not None:
+            stats["bytes"] += size
+            stats["secs"] += time.time() - start
+        for item in items:
+            yield item
+    for item in scanner.feed(decoder.decode(b"", True), True):
+        yield item
+
+
+def iter_response_items(response, items_key=None, stats=None):
+    """ Yields the items of the JSON array in a streamed requests response
+
+    :param response: response of a request made with stream=True
+    :param items_key: key of the array in the top level object (None: top level array only)
+    :param stats: dict accumulating decoded "bytes" and "secs" (iter_json_array_items)
+    """
+    for item in iter_json_array_items(response.iter_content(STREAM_CHUNK_SIZE), items_key, stats):
+        yield item
+
+
+class _ArrayScanner:
+    """ Splits the items of the target array out of a JSON text fed in pieces
+
+    The text before the array is scanned for structure only, each item is
+    parsed by the C accelerated json decoder once it is complete. Only the
+    text of the item (or key) being scanned is kept between pieces.
+    """
+
+    def __init__(self, items_key):
+        self.items_key = None
+        if items_key is not None:
+            self.items_key = json.dumps(items_key)
+        self.decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0                # scan position in self.text
+        self.depth = 0              # nesting depth at the scan position
+        self.in_array = False       # scan position is inside the target array
+        self.done = False           # target array fully scanned
+        self.in_string = False
+        self.string_start = None    # start of the string being scanned
+        self.last_string = None     # last string at depth 1 (object key candidate)
+        self.after_key = False      # ':' seen right after the items_key string
+
+    def feed(self, text, final=False):
+        items = []
+        if self.done:
+            return items
+        self.text = self.text + text
+        if not self.in_array:
+            self._find_array()
+        if self.in_array:
+            self._parse_items(items, final)
+
+        # Drop the scanned text that is not needed any more
+        keep_from = self.pos
+        if self.string_start is not None:
+            keep_from = self.string_start
+            self.string_start = 0
+        self.text = self.text[keep_from:]
+        self.pos -= keep_from
+        return items
+
+    def _find_array(self):
+        while self.pos < len(self.text):
+            if self.in_string:
+                match = _STRING_END.search(self.text, self.pos)
+                if match is None:
+                    self.pos = len(self.text)
+                    return
+                if match.group() == "\\":
+                    if match.end() >= len(self.text):
+                        # Escaped character is in the next piece, scan the escape again then
+                        self.pos = match.start()
+                        return
+                    self.pos = match.end() + 1
+                    continue
+                self.in_string = False
+                self.pos = match.end()
+                if self.depth == 1:
+                    self.last_string = self.text[self.string_start:self.pos]
+                self.string_start = None
+                continue
+
+            match = _STRUCTURE.search(self.text, self.pos)
+            if match is None:
+                self.pos = len(self.text)
+                return
+            char = match.group()
+            self.pos = match.end()
+            if char == '"':
+                self.in_string = True
+                self.string_start = match.start()
+            elif char == ':':
+                self.after_key = self.depth == 1 and self.last_string == self.items_key
+            elif char in "[{":
+                self.depth += 1
+                if char == "[" and (self.depth == 1 or (self.depth == 2 and self.after_key)):
+                    self.in_array = True
+                    return
+                self.after_key = False
+            elif char in "]}":
+                self.depth -= 1
+            elif char == ",":
+                self.after_key = False
+
+    def _parse_items(self, items, final):
+        text = self.text
+        while True:
+            pos = _skip_space(text, self.pos)
+            if pos >= len(text):
+                return
+            if text[pos] == "]":
+                self.done = True
+                return
+            if text[pos] == ",":
+                pos = _skip_space(text, pos + 1)
+                if pos >= len(text):
+                    return
+            try:
+                item, end = self.decoder.raw_decode(text, pos)
+            except ValueError:
+                if final:
+                    raise
+                # Item is not complete yet
+                return
+            # The item is complete once the next ',' or ']' is seen,
+            # a number may still continue in the next piece
+            next_pos = _skip_space(text, end)
+            if next_pos >= len(text) or text[next_pos] not in ",]":
+                if final:
+                    raise ValueError("Invalid JSON array item at: " + text[pos:next_pos + 20])
+                return
+            items.append(item)
+            self.pos = end
+
+
+_SPACE = re.compile(r'[ \t\n\r]*')
+
+
+def _skip_space(text, pos):
+    return _SPACE.match(text, pos).end()
@@ -0,0 +1,185 @@
+# Local history of completed live network (client connectivity) tests
+#
+# Every test result is recorded once as it completes, with its rendered text
+# and latency metrics, in a SQLite table indexed by location and time.
+# "Last successful test at X" and latency trends are then answered from the
+# index without fetching results from the cloud.
+import threading
+import time
+
+from mwmLocations import LocationIndex
+from mwmSqlite import load_sqlite3
+
+# Latency metrics (milli-seconds) kept per test, column => result field
+LATENCY_METRICS = (
+    ("dhcp_ms", "dhcpLatency"),
+    ("gateway_ms", "defGwLatency"),
+    ("dns_ms", "dnsServerLatency"),
+    ("wan_ms", "wanLatency"),
+)
+PING_METRIC = "ping_ms"     # lowest ping latency of the test
+METRIC_COLUMNS = tuple(column for column, field in LATENCY_METRICS) + (PING_METRIC,)
+
+HISTORY_COLUMNS = ("session_id", "locid", "location_name", "completed_at", "success", "result_text") + METRIC_COLUMNS
+
+
+def _get_latency(values, field):
+    value = values.get(field)
+    if not isinstance(value, dict) or value.get('errorCode') is not None or value.get('value') is None:
+        return None
+    try:
+        return float(value['value'])
+    except (TypeError, ValueError):
+        return None
+
+
+def get_conn_test_metrics(tresult):
+    """ Latency metrics of a live network test result
+
+    Taken from the first attempt reporting DHCP results, a metric the test
+    did not reach is None.
+
+    :param tresult: test result (MwmApi.get_client_conn_test_result)
+    :return: dict metric column => milli-seconds or None
+    """
+    metrics = dict((column, None) for column in METRIC_COLUMNS)
+    if not isinstance(tresult, dict):
+        return metrics
+    for attempt in tresult.get('attempts') or []:
+        result = attempt.get('attemptResult') or {}
+        basic = result.get('basic') or {}
+        dhcp = None
+        if len(basic.get('dhcp') or []) > 0:
+            dhcp = basic['dhcp'][0]
+        elif len((result.get('dhcp') or {}).get('dhcp') or []) > 0:
+            dhcp = result['dhcp']['dhcp'][0]
+        if dhcp is None:
+            continue
+        for column, field in LATENCY_METRICS:
+            metrics[column] = _get_latency(dhcp, field)
+        ping = basic.get('ping') or (result.get('ping') or {}).get('ping') or []
+        latencies = [_get_latency(p, 'pingServerLatency') for p in ping]
+        latencies = [latency for latency in latencies if latency is not None]
+        if len(latencies) > 0:
+            metrics[PING_METRIC] = min(latencies)
+        break
+    return metrics
+
+
+def _scope(key):
+    return "/".join(str(part) for part in key)
+
+
+class TestHistory:
+    """ Completed tests per tenant in SQLite, indexed by (tenant, location, completion time) """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.indexes = {}       # scope => (row count, LocationIndex of the tested locations)
+        connection = self._connect()
+        try:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conn_tests (scope TEXT, session_id, locid, location_name TEXT,"
+                " completed_at REAL, success INTEGER, result_text TEXT, " +
+                ", ".join(column + " REAL" for column in METRIC_COLUMNS) + ", PRIMARY KEY (scope, session_id))")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS conn_tests_by_location ON conn_tests (scope, locid, completed_at)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS conn_tests_by_time ON conn_tests (scope, completed_at)")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return load_sqlite3().connect(self.path, timeout=5)
+
+    def record(self, key, session_id, locid, location_name, success, result_text, tresult, completed_at=None):
+        """ Adds a completed test, a test recorded before is left as is
+
+        :param key: tenant key (MwmApi.get_session_key())
+        :param success: the test passed (association to ping)
+        :param tresult: raw test result the latency metrics are taken from
+        """
+        if completed_at is None:
+            completed_at = time.time()
+        metrics = get_conn_test_metrics(tresult)
+        row = (_scope(key), session_id, locid, location_name, completed_at, 1 if success else 0, result_text) + \
+            tuple(metrics[column] for column in METRIC_COLUMNS)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO conn_tests VALUES (" + ", ".join(["?"] * len(row)) + ")", row)
+        finally:
+            connection.close()
+
+    def _query(self, sql, params):
+        connection = self._connect()
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def get_last(self, key, locid=None, successful_only=True):
+        """ Latest recorded test of a tenant, at one location if locid is given
+
+        :return: dict of HISTORY_COLUMNS, None if there is none
+        """
+        sql = "SELECT " + ", ".join(HISTORY_COLUMNS) + " FROM conn_tests WHERE scope = ?"
+        params = [_scope(key)]
+        if locid is not None:
+            sql += " AND locid = ?"
+            params.append(locid)
+        if successful_only:
+            sql += " AND success = 1"
+        rows = self._query(sql + " ORDER BY completed_at DESC LIMIT 1", params)
+        if len(rows) == 0:
+            return None
+        return dict(zip(HISTORY_COLUMNS, rows[0]))
+
+    def get_latency_stats(self, key, metric, since, locid=None):
+        """ Count, average, min and max of a latency metric over the tests completed since a time
+
+        :param metric: one of METRIC_COLUMNS ("dns_ms")
+        :param since: time.time() of the window start
+        :return: {'count', 'avg', 'min', 'max'}, count 0 (others None) without data
+        """
+        if metric not in METRIC_COLUMNS:
+            raise ValueError("Unknown latency metric: " + str(metric))
+        sql = "SELECT COUNT(%s), AVG(%s), MIN(%s), MAX(%s) FROM conn_tests WHERE scope = ? AND completed_at >= ?" % (
+            metric, metric, metric, metric)
+        params = [_scope(key), since]
+        if locid is not None:
+            sql += " AND locid = ?"
+            params.append(locid)
+        count, avg, low, high = self._query(sql, params)[0]
+        return {'count': count, 'avg': avg, 'min': low, 'max': high}
+
+    def find_location(self, key, name):
+        """ Id of the tested location best matching a spoken name, None if not found
+
+        Names are those recorded with the tests, so no location tree fetch is needed.
+        """
+        scope = _scope(key)
+        count = self._query("SELECT COUNT(*) FROM conn_tests WHERE scope = ?", [scope])[0][0]
+        with self.lock:
+            cached = self.indexes.get(scope)
+        if cached is None or cached[0] != count:
+            locations = {}
+            for locid, location_name in self._query(
+                    "SELECT DISTINCT locid, location_name FROM conn_tests WHERE scope = ? AND location_name IS NOT NULL",
+                    [scope]):
+                locations[str(locid)] = {"id": locid, "name": location_name}
+            cached = (count, LocationIndex({"locations": locations}, time.time()))
+            with self.lock:
+                self.indexes[scope] = cached
+        return cached[1].find(name)
+
+
+def open_test_history(path):
+    """ TestHistory at path, None (no history kept) if sqlite3 is not available """
+    if load_sqlite3() is None:
+        print("sqlite3 not available, live network test history is not kept")
+        return None
+    return TestHistory(path)
@@ -0,0 +1,27 @@
+import unittest
+
+import mwmAlexa
+
+
+class DialogDelegateTest(unittest.TestCase):
+    """ Intents with slots hand an incomplete dialog back to Alexa without API calls """
+
+    INTENTS = ("NetworkStatus", "RegionStatus", "LiveNetworkTest", "LastSuccessfulTest", "LatencyTrend",
+               "ClientFailureTrend", "AssociationFailures", "APsDown")
+
+    def get_intent_response(self, intent_name, dialog_state):
+        intent_request = {"requestId": "request-1", "dialogState": dialog_state,
+                          "intent": {"name": intent_name, "slots": {"location": {"name": "location"}}}}
+        return mwmAlexa.on_intent(intent_request, {"sessionId": "session-1", "attributes": {}})
+
+    def test_delegate(self):
+        for intent_name in self.INTENTS:
+            for dialog_state in ("STARTED", "IN_PROGRESS"):
+                response = self.get_intent_response(intent_name, dialog_state)['response']
+                self.assertEqual(response.get('directives'), [{"type": "Dialog.Delegate"}], intent_name)
+                self.assertFalse('outputSpeech' in response, intent_name)
+        self.assertEqual(mwmAlexa.mwm_api_cache, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
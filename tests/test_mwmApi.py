@@ -0,0 +1,79 @@
+import threading
+import unittest
+
+from mwmApi import MwmApi
+from mwmDeadline import Deadline
+
+
+class DeadlineTest(unittest.TestCase):
+    """ Deadlines of invocations served at the same time by one shared MwmApi """
+
+    def setUp(self):
+        self.mwm_api = MwmApi("127.0.0.1:1", None, scheme="http")
+
+    def test_deadline_per_thread(self):
+        deadline = Deadline.after(5)
+        self.mwm_api.set_deadline(deadline)
+        seen = []
+        other = Deadline.after(1)
+
+        def other_invocation():
+            seen.append(self.mwm_api.get_deadline())
+            self.mwm_api.set_deadline(other)
+            seen.append(self.mwm_api.get_deadline())
+
+        thread = threading.Thread(target=other_invocation)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None, other])
+        self.assertTrue(self.mwm_api.get_deadline() is deadline)
+
+    def test_submitted_calls_keep_the_deadline_of_the_caller(self):
+        deadline = Deadline.after(5)
+        self.mwm_api.set_deadline(deadline)
+        self.assertTrue(self.mwm_api.submit(self.mwm_api.get_deadline).result(5) is deadline)
+        self.mwm_api.set_deadline(None)
+        # The worker thread does not keep the deadline of an earlier call
+        self.assertEqual(self.mwm_api.gather((self.mwm_api.get_deadline,)), [None])
+
+
+class StoreOpenerTest(unittest.TestCase):
+
+    def test_stores_are_opened_on_first_use(self):
+        mwm_api = MwmApi("127.0.0.1:1", None, scheme="http")
+        opened = []
+        store = object()
+
+        def open_store():
+            opened.append(1)
+            return store
+
+        mwm_api.set_inventory(open_store)
+        mwm_api.set_test_history(open_store)
+        self.assertEqual(opened, [])
+        self.assertTrue(mwm_api.get_inventory() is store)
+        self.assertTrue(mwm_api.get_inventory() is store)
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(mwm_api.get_test_history() is store)
+        self.assertEqual(len(opened), 2)
+
+    def test_no_store(self):
+        mwm_api = MwmApi("127.0.0.1:1", None, scheme="http")
+        mwm_api.set_inventory(lambda: None)
+        self.assertEqual(mwm_api.get_inventory(), None)
+        self.assertFalse(mwm_api.is_inventory_fresh())
+        self.assertEqual(mwm_api.get_test_history(), None)
+
+
+class SendErrorTest(unittest.TestCase):
+
+    def test_connection_error(self):
+        # Nothing listens on port 1: the GET is retried, then the error of the last attempt is raised
+        from mwmApi import _load_requests
+        mwm_api = MwmApi("127.0.0.1:1", None, scheme="http")
+        mwm_api.set_deadline(Deadline.after(10))
+        self.assertRaises(_load_requests().exceptions.ConnectionError, mwm_api.request, "locations/tree")
+
+
+if __name__ == "__main__":
+    unittest.main()
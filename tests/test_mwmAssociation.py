@@ -0,0 +1,121 @@
+import math
+import random
+import unittest
+
+from mwmAssociation import (ASSOCIATION_TIME_BUCKETS, ASSOCIATION_TIME_FIRST, ASSOCIATION_TIME_GROWTH,
+                            AssociationAggregate, AssociationStats, get_time_bucket, get_time_chunks)
+
+
+def record(boxid, ssid, success=True, reason=None, ms=None, name=None):
+    rec = {"boxId": boxid, "ssid": ssid, "status": "SUCCESS" if success else "FAILURE"}
+    if reason is not None:
+        rec["failureReason"] = reason
+    if ms is not None:
+        rec["associationTime"] = ms
+    if name is not None:
+        rec["apName"] = name
+    return rec
+
+
+def get_exact_percentile(values, percentile):
+    values = sorted(values)
+    return values[max(1, int(math.ceil(len(values) * percentile / 100.0))) - 1]
+
+
+class AssociationStatsTest(unittest.TestCase):
+
+    def test_time_buckets(self):
+        self.assertEqual(get_time_bucket(0), 0)
+        self.assertEqual(get_time_bucket(ASSOCIATION_TIME_FIRST), 0)
+        self.assertEqual(get_time_bucket(ASSOCIATION_TIME_FIRST * ASSOCIATION_TIME_GROWTH), 1)
+        self.assertEqual(get_time_bucket(ASSOCIATION_TIME_FIRST * ASSOCIATION_TIME_GROWTH * 1.01), 2)
+        self.assertEqual(get_time_bucket(10 ** 9), ASSOCIATION_TIME_BUCKETS - 1)
+
+    def test_percentile_accuracy(self):
+        # Within half a bucket of the exact percentile: sqrt(GROWTH) - 1, about 5 percent
+        tolerance = math.sqrt(ASSOCIATION_TIME_GROWTH) - 1 + 1e-9
+        rand = random.Random(7)
+        values = [math.exp(rand.uniform(math.log(2), math.log(100000))) for i in range(5000)]
+        stats = AssociationStats()
+        for ms in values:
+            stats.add(True, None, ms)
+        for percentile in (1, 50, 90, 99, 100):
+            exact = get_exact_percentile(values, percentile)
+            estimate = stats.get_percentile(percentile)
+            self.assertTrue(abs(estimate - exact) / exact <= tolerance, (percentile, exact, estimate))
+
+    def test_sparse_histogram(self):
+        stats = AssociationStats()
+        for ms in (5.2, 5.3, 5000):
+            stats.add(True, None, ms)
+        stats.add(True, None, None)
+        self.assertEqual(len(stats.times), 2)
+        self.assertEqual((stats.total, stats.timed), (4, 3))
+        self.assertEqual(AssociationStats().get_percentile(50), None)
+
+
+class AssociationAggregateTest(unittest.TestCase):
+
+    def make_records(self, count, seed):
+        rand = random.Random(seed)
+        records = []
+        for i in range(count):
+            success = rand.random() < 0.7
+            records.append(record(rand.choice([1, 2, 3, 4]), rand.choice(["Corp", "Guest"]), success,
+                                  None if success else rand.choice(["timeout", "auth", None]),
+                                  rand.uniform(1, 500), "AP-%d" % i if i < 2 else None))
+        return records
+
+    def test_merged_chunks_equal_one_pass(self):
+        records = self.make_records(2000, 3)
+        whole = AssociationAggregate().add_all(records)
+        merged = AssociationAggregate()
+        for first in range(0, len(records), 300):
+            merged.merge(AssociationAggregate().add_all(records[first:first + 300]))
+        self.assertEqual(merged.records, whole.records)
+        self.assertEqual(merged.get_summary(4), whole.get_summary(4))
+        self.assertEqual(merged.aps[1].times, whole.aps[1].times)
+
+    def test_merge_into_empty_and_from_empty(self):
+        aggregate = AssociationAggregate().add_all(self.make_records(100, 5))
+        summary = aggregate.get_summary()
+        aggregate.merge(AssociationAggregate())
+        self.assertEqual(aggregate.get_summary(), summary)
+        empty = AssociationAggregate()
+        empty.merge(aggregate)
+        self.assertEqual(empty.get_summary(), summary)
+
+    def test_top(self):
+        records = [record(1, "Corp", False, "timeout") for i in range(3)] + \
+            [record(2, "Guest", False, "auth", name="Lobby") for i in range(5)] + \
+            [record(3, "IoT", False) for i in range(1)] + \
+            [record(4, "Corp", True) for i in range(10)]
+        summary = AssociationAggregate().add_all(records).get_summary(2)
+        self.assertEqual((summary['total'], summary['failures']), (19, 9))
+        self.assertEqual(summary['reasons'], [("auth", 5), ("timeout", 3)])
+        self.assertEqual([(ap['boxId'], ap['name'], ap['failures']) for ap in summary['aps']],
+                         [(2, "Lobby", 5), (1, "Access Point 1", 3)])
+        self.assertEqual([(ssid['ssid'], ssid['failures']) for ssid in summary['ssids']],
+                         [("Guest", 5), ("Corp", 3)])
+        # Groups without failures are never listed
+        summary = AssociationAggregate().add_all(records).get_summary(10)
+        self.assertEqual([ap['boxId'] for ap in summary['aps']], [2, 1, 3])
+        self.assertEqual(summary['reasons'][-1], ("unknown", 1))
+
+    def test_bad_association_time(self):
+        aggregate = AssociationAggregate()
+        aggregate.add({"status": "SUCCESS", "associationTime": "n/a"})
+        self.assertEqual((aggregate.all.total, aggregate.all.timed), (1, 0))
+        self.assertEqual(aggregate.get_summary()['p50'], None)
+
+
+class TimeChunksTest(unittest.TestCase):
+
+    def test_chunks(self):
+        self.assertEqual(get_time_chunks(0, 7200, 3600), [(0, 3600), (3600, 7200)])
+        self.assertEqual(get_time_chunks(0, 5000, 3600), [(0, 3600), (3600, 5000)])
+        self.assertEqual(get_time_chunks(10, 10, 3600), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
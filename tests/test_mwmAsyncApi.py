@@ -0,0 +1,60 @@
+import time
+import unittest
+
+try:
+    import aiohttp
+except ImportError:
+    # Python 2 or no aiohttp, mwmAsyncApi is not usable
+    aiohttp = None
+
+
+@unittest.skipIf(aiohttp is None, "aiohttp not available")
+class AsyncMwmApiConnTestTest(unittest.TestCase):
+    """ Live network tests of AsyncMwmApi against the fake server
+
+    The coroutines are run one at a time on a loop (no async syntax, the
+    module is also collected by Python 2).
+    """
+
+    def setUp(self):
+        import asyncio
+        from mwmAsyncApi import AsyncMwmApi
+        from mwmFakeServer import FakeFleet, start_fake_server
+        self.server = start_fake_server(FakeFleet(3, 4, 1), test_duration=0.2)
+        self.loop = asyncio.new_event_loop()
+        self.mwm_api = AsyncMwmApi(self.server.get_hostname(), None, scheme="http")
+        self.run_coroutine(
+            self.mwm_api.login("api-client", "3000", {"keyId": "KEY-TEST", "keyValue": "secret", "cname": "TEST"}))
+
+    def tearDown(self):
+        self.run_coroutine(self.mwm_api.logout())
+        self.run_coroutine(self.mwm_api.close())
+        self.loop.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def start_conn_test(self):
+        for locid in sorted(self.server.fleet.devices_by_location):
+            started = self.run_coroutine(self.mwm_api.start_client_conn_test_at_loc(locid))
+            if started['rv'] == 0:
+                return started['test']
+        self.fail("No location with test devices")
+
+    def test_check_until_completed(self):
+        test = self.start_conn_test()
+        time.sleep(0.3)
+        status = self.run_coroutine(self.mwm_api.check_client_conn_test(test))
+        self.assertEqual(status['rv'], 0)
+        self.assertTrue(status['completed'])
+        self.assertTrue(len(status['result_text']) > 0)
+
+    def test_check_while_running(self):
+        test = self.start_conn_test()
+        self.assertEqual(self.run_coroutine(self.mwm_api.check_client_conn_test(test)), {'rv': 0, 'completed': False})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,239 @@
+import threading
+import time
+import unittest
+
+from mwmCache import FlightTimeout, ResponseCache, SingleFlight
+
+
+class FakeResponse:
+    """ The parts of a requests response the cache uses """
+
+    def __init__(self, content, headers=None):
+        self.content = content
+        self.headers = headers or {}
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = ResponseCache(10, 1000)
+        self.assertEqual(cache.get("a"), None)
+        response = FakeResponse(b"1234")
+        cache.put("a", response, 60)
+        entry = cache.get("a")
+        self.assertTrue(entry.response is response)
+        self.assertTrue(entry.is_fresh())
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["hits"], stats["misses"]), (1, 4, 1, 1))
+
+    def test_ttl(self):
+        cache = ResponseCache(10, 1000)
+        cache.put("a", FakeResponse(b"1234"), 60)
+        entry = cache.get("a")
+        entry.stored_at = time.time() - 61
+        # Expired entries are kept for revalidation, counted as misses
+        self.assertTrue(cache.get("a") is entry)
+        self.assertFalse(entry.is_fresh())
+        self.assertEqual(cache.stats()["misses"], 1)
+
+        cache.refresh(entry)
+        self.assertTrue(entry.is_fresh())
+        self.assertEqual(cache.stats()["revalidated"], 1)
+
+    def test_validators(self):
+        cache = ResponseCache(10, 1000)
+        cache.put("etag", FakeResponse(b"1", {"ETag": '"v1"'}), 60)
+        cache.put("date", FakeResponse(b"1", {"Last-Modified": "Sat, 17 Oct 2026 10:00:00 GMT"}), 60)
+        cache.put("none", FakeResponse(b"1"), 60)
+        self.assertEqual(cache.get("etag").get_validators(), {"If-None-Match": '"v1"'})
+        self.assertEqual(cache.get("date").get_validators(),
+                         {"If-Modified-Since": "Sat, 17 Oct 2026 10:00:00 GMT"})
+        self.assertEqual(cache.get("none").get_validators(), {})
+
+    def test_lru_entry_limit(self):
+        cache = ResponseCache(2, 1000)
+        cache.put("a", FakeResponse(b"1"), 60)
+        cache.put("b", FakeResponse(b"1"), 60)
+        cache.get("a")
+        cache.put("c", FakeResponse(b"1"), 60)
+        self.assertEqual(cache.get("b"), None)
+        self.assertNotEqual(cache.get("a"), None)
+        self.assertNotEqual(cache.get("c"), None)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_byte_limit(self):
+        cache = ResponseCache(10, 10)
+        cache.put("big", FakeResponse(b"x" * 11), 60)
+        self.assertEqual(cache.get("big"), None)
+        cache.put("a", FakeResponse(b"x" * 6), 60)
+        cache.put("b", FakeResponse(b"x" * 6), 60)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.stats()["bytes"], 6)
+        # Replacing an entry does not count its old size
+        cache.put("b", FakeResponse(b"x" * 3), 60)
+        self.assertEqual(cache.stats()["bytes"], 3)
+
+    def test_invalidate(self):
+        cache = ResponseCache(10, 1000)
+        for key in (("t1", "a"), ("t1", "b"), ("t2", "a")):
+            cache.put(key, FakeResponse(b"12"), 60)
+        cache.invalidate(lambda key: key[0] == "t1")
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.stats()["bytes"], 2)
+        cache.invalidate()
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def start_leader(self, flights, key, func):
+        # Runs flights.do(key, func) on a thread, returns once func() is running
+        started = threading.Event()
+        results = []
+
+        def call():
+            started.set()
+            return func()
+
+        def lead():
+            try:
+                results.append(flights.do(key, call))
+            except BaseException as e:
+                results.append(e)
+
+        thread = threading.Thread(target=lead)
+        thread.start()
+        started.wait()
+        return thread, results
+
+    def test_single_call(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do("a", lambda: 1), (1, False))
+        self.assertEqual(flights.do("a", lambda: 2), (2, False))
+        self.assertEqual(flights.stats(), {"calls": 2, "coalesced": 0, "in_flight": 0})
+
+    def test_waiters_share_the_result(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            release.wait()
+            return "value"
+
+        leader, leader_results = self.start_leader(flights, "a", call)
+        waiter_results = []
+        waiters = [threading.Thread(target=lambda: waiter_results.append(flights.do("a", call)))
+                   for i in range(3)]
+        for waiter in waiters:
+            waiter.start()
+        while flights.stats()["coalesced"] < 3:
+            time.sleep(0.001)
+        # Another key is not held up by the call in flight
+        self.assertEqual(flights.do("b", lambda: "other"), ("other", False))
+        release.set()
+        leader.join()
+        for waiter in waiters:
+            waiter.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(leader_results, [("value", False)])
+        self.assertEqual(waiter_results, [("value", True)] * 3)
+        self.assertEqual(flights.stats(), {"calls": 2, "coalesced": 3, "in_flight": 0})
+
+    def check_error_is_shared(self, error):
+        flights = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait()
+            raise error
+
+        leader, leader_results = self.start_leader(flights, "a", fail)
+        waiter_results = []
+
+        def wait():
+            try:
+                flights.do("a", lambda: "not called")
+            except BaseException as e:
+                waiter_results.append(e)
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        while flights.stats()["coalesced"] < 1:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        waiter.join()
+        self.assertEqual(leader_results, [error])
+        self.assertEqual(waiter_results, [error])
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    def test_exception_is_shared(self):
+        self.check_error_is_shared(ValueError("failed"))
+
+    def test_base_exception_is_shared(self):
+        self.check_error_is_shared(SystemExit(3))
+
+    def test_wait_timeout(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        leader, leader_results = self.start_leader(flights, "a", lambda: release.wait() and "value")
+        self.assertRaises(FlightTimeout, flights.do, "a", lambda: "not called", 0.01)
+        release.set()
+        leader.join()
+        self.assertEqual(leader_results, [("value", False)])
+
+
+class MwmApiResponseCacheTest(unittest.TestCase):
+    """ Cached GETs of MwmApi against the fake server, which sends ETags """
+
+    @classmethod
+    def setUpClass(cls):
+        from mwmFakeServer import FakeFleet, start_fake_server
+        cls.server = start_fake_server(FakeFleet(3, 2, 1))
+
+    @classmethod
+    def tearDownClass(cls):
+        # Drops the keep-alive connections first, their handler threads end with them
+        from mwmApi import get_http_session
+        get_http_session().close()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        from mwmApi import MwmApi, response_cache
+        self.response_cache = response_cache
+        response_cache.invalidate()
+        self.mwm_api = MwmApi(self.server.get_hostname(), None, scheme="http")
+        self.mwm_api.login("api-client", "3000", {"keyId": "KEY-TEST", "keyValue": "secret", "cname": "TEST"})
+
+    def tearDown(self):
+        self.mwm_api.logout()
+        self.response_cache.invalidate()
+
+    def get_tree_requests(self):
+        counts = self.server.get_request_counts()
+        return sum(counts[name] for name in counts if name.startswith("GET ") and "locations/tree" in name)
+
+    def test_fresh_response_is_reused(self):
+        requests_before = self.get_tree_requests()
+        first = self.mwm_api.get_location_tree()
+        second = self.mwm_api.get_location_tree()
+        self.assertEqual(second, first)
+        self.assertEqual(self.get_tree_requests() - requests_before, 1)
+
+    def test_expired_response_is_revalidated(self):
+        first = self.mwm_api.get_location_tree()
+        for key in list(self.response_cache.entries.keys()):
+            self.response_cache.entries[key].stored_at -= 3600
+        revalidated_before = self.response_cache.stats()["revalidated"]
+        requests_before = self.get_tree_requests()
+        self.assertEqual(self.mwm_api.get_location_tree(), first)
+        self.assertEqual(self.get_tree_requests() - requests_before, 1)
+        self.assertEqual(self.response_cache.stats()["revalidated"] - revalidated_before, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
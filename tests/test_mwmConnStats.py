@@ -0,0 +1,150 @@
+import unittest
+
+from mwmConnStats import (CONN_STATS_BUCKET, CONN_STATS_DELAY, ConnStatsSeries, ConnStatsStore,
+                          get_conn_stats_time, get_window_stats)
+
+T0 = 1800000000     # aligned to CONN_STATS_BUCKET
+
+
+class FakeStats:
+    """ connectivitystats of a location: 2 successes a second, a failure every 7th second """
+
+    def __init__(self):
+        self.fetches = []
+        self.failing = False
+
+    def counts(self, start, end):
+        failure = len([t for t in range(start, end) if t % 7 == 0])
+        return 2 * (end - start), failure
+
+    def fetch(self, start, end):
+        self.fetches.append((start - T0, end - T0))
+        if self.failing:
+            return None
+        return self.counts(start, end)
+
+
+class ConnStatsSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = FakeStats()
+        self.series = ConnStatsSeries()
+
+    def get_counts(self, start, end):
+        # Window relative to T0, checked against the fake stats
+        counts = self.series.get_counts(self.stats.fetch, T0 + start, T0 + end)
+        self.assertEqual(counts, self.stats.counts(T0 + start, T0 + end))
+        return counts
+
+    def get_segments(self):
+        return [(self.series.starts[i] - T0, self.series.ends[i] - T0) for i in range(len(self.series))]
+
+    def test_window_held(self):
+        self.get_counts(0, 3600)
+        self.get_counts(0, 3600)
+        self.assertEqual(self.stats.fetches, [(0, 3600)])
+
+    def test_adjacent_window(self):
+        self.get_counts(0, 3600)
+        self.get_counts(3600, 3900)
+        self.assertEqual(self.stats.fetches, [(0, 3600), (3600, 3900)])
+        self.assertEqual(self.get_segments(), [(0, 3600), (3600, 3900)])
+
+    def test_overlapping_window(self):
+        self.get_counts(0, 3600)
+        # Slides by one bucket: the old segment is split at the new start, the delta is fetched
+        self.get_counts(300, 3900)
+        self.assertEqual(self.stats.fetches, [(0, 3600), (0, 300), (3600, 3900)])
+        self.assertEqual(self.get_segments(), [(0, 300), (300, 3600), (3600, 3900)])
+
+    def test_sliding_fine_grained_window(self):
+        for start in range(0, 3600, CONN_STATS_BUCKET):
+            self.get_counts(start, start + CONN_STATS_BUCKET)
+        fetches = len(self.stats.fetches)
+        # Once the series holds buckets, sliding the window costs one request
+        self.get_counts(300, 3900)
+        self.assertEqual(self.stats.fetches[fetches:], [(3600, 3900)])
+
+    def test_split_fetches_the_shorter_side(self):
+        self.get_counts(0, 3600)
+        self.get_counts(3000, 3600)
+        self.assertEqual(self.stats.fetches, [(0, 3600), (3000, 3600)])
+        # The other side is the difference
+        self.get_counts(0, 3000)
+        self.assertEqual(len(self.stats.fetches), 2)
+
+    def test_split_at_segment_edge(self):
+        self.get_counts(0, 600)
+        self.get_counts(600, 1200)
+        # Edges on segment boundaries split nothing
+        self.get_counts(0, 1200)
+        self.assertEqual(self.stats.fetches, [(0, 600), (600, 1200)])
+
+    def test_gap(self):
+        self.get_counts(0, 300)
+        self.get_counts(900, 1200)
+        self.get_counts(0, 1200)
+        self.assertEqual(self.stats.fetches, [(0, 300), (900, 1200), (300, 900)])
+        self.assertEqual(self.get_segments(), [(0, 300), (300, 900), (900, 1200)])
+
+    def test_window_inside_a_segment(self):
+        self.get_counts(0, 3600)
+        self.get_counts(600, 900)
+        self.assertEqual(self.stats.fetches, [(0, 3600), (0, 600), (600, 900)])
+        self.assertEqual(self.get_segments(), [(0, 600), (600, 900), (900, 3600)])
+
+    def test_failed_fetch(self):
+        self.get_counts(0, 600)
+        self.stats.failing = True
+        self.assertEqual(self.series.get_counts(self.stats.fetch, T0, T0 + 1200), None)
+        self.assertEqual(self.series.get_counts(self.stats.fetch, T0 + 300, T0 + 600), None)
+        self.assertEqual(self.get_segments(), [(0, 600)])
+        self.stats.failing = False
+        self.get_counts(0, 1200)
+
+    def test_trim(self):
+        self.get_counts(0, 300)
+        self.get_counts(300, 600)
+        self.series.trim(T0 + 300)
+        self.assertEqual(self.get_segments(), [(300, 600)])
+
+
+class ConnStatsStoreTest(unittest.TestCase):
+
+    def test_conn_stats_time(self):
+        now = T0 + 1234
+        end = get_conn_stats_time(now)
+        self.assertEqual(end % CONN_STATS_BUCKET, 0)
+        self.assertTrue(now - CONN_STATS_DELAY - CONN_STATS_BUCKET < end <= now - CONN_STATS_DELAY)
+
+    def test_window_stats(self):
+        self.assertEqual(get_window_stats(0, 3600, 90, 10)['failureRate'], 0.1)
+        self.assertEqual(get_window_stats(0, 1800, 90, 10)['failuresPerHour'], 20.0)
+        self.assertEqual(get_window_stats(0, 3600, 0, 0)['failureRate'], None)
+
+    def test_windows(self):
+        stats = FakeStats()
+        store = ConnStatsStore()
+        now = T0 + 86400 + 3600 + CONN_STATS_DELAY
+        end = get_conn_stats_time(now)
+        windows = [(end - 3600, end), (end - 86400 - 3600, end - 86400)]
+        results = store.get_windows(("host", "tenant", 1), stats.fetch, windows, now)
+        for result, (start, stop) in zip(results, windows):
+            self.assertEqual((result['successCount'], result['failureCount']), stats.counts(start, stop))
+        # Asked again one bucket later: each window splits its first bucket off and fetches the new one
+        later = [(start + CONN_STATS_BUCKET, stop + CONN_STATS_BUCKET) for start, stop in windows]
+        fetches = len(stats.fetches)
+        store.get_windows(("host", "tenant", 1), stats.fetch, later, now + CONN_STATS_BUCKET)
+        self.assertEqual(len(stats.fetches) - fetches, 4)
+        self.assertEqual(store.stats()["windows"], 4)
+
+    def test_lru(self):
+        stats = FakeStats()
+        store = ConnStatsStore(max_series=2)
+        for locid in (1, 2, 1, 3):
+            store.get_windows(("host", "tenant", locid), stats.fetch, [(T0, T0 + 300)], T0 + 3600)
+        self.assertEqual(sorted(key[2] for key in store.series), [1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mwmConnTestScheduler
+from mwmConnTestScheduler import ConnTestScheduler, select_disjoint_pairs
+from mwmDeadline import Deadline
+
+
+def pair(target_boxid, client_boxid):
+    return {'target_boxid': target_boxid, 'client_boxid': client_boxid}
+
+
+class SelectDisjointPairsTest(unittest.TestCase):
+
+    def test_select(self):
+        pairs = [pair(1, 2), pair(1, 3), pair(3, 2), pair(3, 4), pair(5, 6)]
+        self.assertEqual(select_disjoint_pairs(pairs, 3), [pair(1, 2), pair(3, 4), pair(5, 6)])
+        self.assertEqual(select_disjoint_pairs(pairs, 1), [pair(1, 2)])
+        self.assertEqual(select_disjoint_pairs([], 2), [])
+
+
+class ConnTestSchedulerTest(unittest.TestCase):
+    """ Sweeps of live network tests against the fake server """
+
+    def setUp(self):
+        from mwmApi import MwmApi
+        from mwmFakeServer import FakeFleet, start_fake_server
+        self.server = start_fake_server(FakeFleet(3, 4, 1), test_duration=0.5)
+        self.mwm_api = MwmApi(self.server.get_hostname(), None, scheme="http")
+        self.mwm_api.login("api-client", "3000", {"keyId": "KEY-TEST", "keyValue": "secret", "cname": "TEST"})
+        # Sites holding APs with a test device pair, and the one without
+        self.locids = [2, 3]
+        self.untestable = 4
+
+    def tearDown(self):
+        from mwmApi import get_http_session, response_cache
+        self.mwm_api.logout()
+        # Cached responses keep their connection open until dropped
+        response_cache.invalidate()
+        get_http_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_sweep(self, locids, **kwargs):
+        results = {}
+        for result in ConnTestScheduler(self.mwm_api, **kwargs).run(locids):
+            results.setdefault(result['locid'], []).append(result)
+        return results
+
+    def test_sweep(self):
+        results = self.run_sweep(self.locids + [self.untestable, self.locids[0]])
+        self.assertEqual(sorted(results), [2, 3, 4])
+        for locid in self.locids:
+            self.assertEqual(len(results[locid]), 1)
+            result = results[locid][0]
+            self.assertEqual(result['rv'], 0)
+            self.assertTrue(result['result_text'].startswith("Association successful."))
+            self.assertTrue(result['target_boxid'] is not None and result['session_id'] is not None)
+        self.assertEqual(results[self.untestable], [{'locid': self.untestable, 'target_boxid': None, 'client_boxid': None,
+                                                     'rv': 1,
+                                                     'error_string': "Suitable test devices not found at the location"}])
+
+    def test_one_in_flight(self):
+        # The second test waits for the first one to end
+        results = self.run_sweep(self.locids, max_in_flight=1)
+        self.assertEqual([results[locid][0]['rv'] for locid in self.locids], [0, 0])
+        self.assertNotEqual(results[2][0]['session_id'], results[3][0]['session_id'])
+
+    def test_start_failure(self):
+        pairs = self.mwm_api.get_conn_test_pairs_of_locations([2])[2]
+        # The cached target AP is gone when the test is started
+        self.server.fleet.remove_device(pairs[0]['target_boxid'])
+        results = self.run_sweep([2, 3])
+        self.assertEqual(results[2][0]['rv'], 1)
+        self.assertEqual(results[2][0]['error_string'], "Unable to start connectivity test")
+        self.assertEqual(results[3][0]['rv'], 0)
+        # The pairs are selected again on the next sweep
+        self.assertFalse(2 in self.mwm_api.conn_test_pairs)
+
+    def test_budget_exhausted(self):
+        counts = self.server.get_request_counts()
+        results = self.run_sweep(self.locids, deadline=Deadline.after(10))
+        for locid in self.locids:
+            self.assertEqual(results[locid][0]['error_string'], "Not started, the time budget is exhausted")
+        self.assertEqual(self.server.get_request_counts(), counts)
+
+    def test_pending(self):
+        start_min_budget = mwmConnTestScheduler.SWEEP_START_MIN_BUDGET
+        mwmConnTestScheduler.SWEEP_START_MIN_BUDGET = 0
+        try:
+            # Tests start, but the first poll cannot end within the deadline
+            results = self.run_sweep(self.locids, deadline=Deadline.after(0.5))
+        finally:
+            mwmConnTestScheduler.SWEEP_START_MIN_BUDGET = start_min_budget
+        for locid in self.locids:
+            result = results[locid][0]
+            self.assertEqual(result['rv'], 1)
+            self.assertTrue(result['pending'])
+            self.assertTrue(result['session_id'] is not None)
+
+    def test_history(self):
+        from mwmTestHistory import open_test_history
+        directory = tempfile.mkdtemp()
+        try:
+            test_history = open_test_history(os.path.join(directory, "history.db"))
+            if test_history is None:
+                self.skipTest("sqlite3 not available")
+            self.mwm_api.set_test_history(test_history)
+            results = self.run_sweep(self.locids)
+            key = self.mwm_api.get_session_key()
+            for locid in self.locids:
+                last = test_history.get_last(key, locid)
+                self.assertEqual(last['session_id'], results[locid][0]['session_id'])
+                self.assertEqual(last['result_text'], results[locid][0]['result_text'])
+            self.assertEqual(test_history.get_last(key, self.untestable), None)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mwmInventory import (CHANGE_ADDED, CHANGE_CHANGED, CHANGE_DOWN, CHANGE_REMOVED, CHANGE_UP, KIND_MANAGED_DEVICES,
+                          KIND_VIRTUAL_APS, InventoryStore, InventorySyncError)
+
+KEY = ("host", "KEY-TEST")
+
+
+def device(boxid, locid, active=True, name=None, modified=None):
+    record = {"boxId": boxid, "locationId": locid, "active": active, "name": name or "AP-%d" % boxid,
+              "upTime": time.time()}
+    if modified is not None:
+        record["modifiedTime"] = modified
+    return record
+
+
+def failing(records):
+    for record in records:
+        yield record
+    raise InventorySyncError("page 2 could not be read")
+
+
+def get_changes(deltas):
+    return sorted((delta['change'], delta['id']) for delta in deltas)
+
+
+class InventoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = InventoryStore(os.path.join(self.directory, "inventory.db"))
+        self.devices = [device(1, 10), device(2, 10), device(3, 20, active=False)]
+        self.store.sync(KEY, KIND_MANAGED_DEVICES, self.devices, True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_first_sync_adds(self):
+        added = self.store.get_changes(KEY, 0, [CHANGE_ADDED])
+        self.assertEqual(sorted(change['id'] for change in added), ["1", "2", "3"])
+        self.assertEqual(len(self.store.get_changes(KEY, 0)), 3)
+        self.assertEqual(self.store.count_devices_by_location(KEY), {10: [2, 0], 20: [0, 1]})
+        self.assertEqual(self.store.count_devices_by_location(KEY, set([20])), {20: [0, 1]})
+        self.assertEqual(self.store.get_inactive(KEY), [("3", 20, "AP-3")])
+
+    def test_unchanged_records_are_not_deltas(self):
+        # upTime is left out of the hash
+        deltas = self.store.sync(KEY, KIND_MANAGED_DEVICES, [device(1, 10), device(2, 10), device(3, 20, False)], True)
+        self.assertEqual(deltas, [])
+
+    def test_deltas(self):
+        deltas = self.store.sync(KEY, KIND_MANAGED_DEVICES,
+                                 [device(1, 10, active=False), device(2, 10, name="Lobby"), device(3, 20),
+                                  device(4, 20)], True)
+        self.assertEqual(get_changes(deltas), [(CHANGE_ADDED, "4"), (CHANGE_CHANGED, "2"), (CHANGE_DOWN, "1"),
+                                               (CHANGE_UP, "3")])
+        self.assertEqual(self.store.count_devices_by_location(KEY), {10: [1, 1], 20: [2, 0]})
+        down = self.store.get_changes(KEY, 0, [CHANGE_DOWN])
+        self.assertEqual([(change['id'], change['locid'], change['name']) for change in down], [("1", 10, "AP-1")])
+
+    def test_removals_only_on_full_sync(self):
+        deltas = self.store.sync(KEY, KIND_MANAGED_DEVICES, [device(1, 10)], False)
+        self.assertEqual(deltas, [])
+        self.assertEqual(self.store.count_devices_by_location(KEY), {10: [2, 0], 20: [0, 1]})
+        deltas = self.store.sync(KEY, KIND_MANAGED_DEVICES, [device(1, 10)], True)
+        self.assertEqual(get_changes(deltas), [(CHANGE_REMOVED, "2"), (CHANGE_REMOVED, "3")])
+        self.assertEqual(self.store.count_devices_by_location(KEY), {10: [1, 0]})
+
+    def test_failed_sync_changes_nothing(self):
+        state = self.store.get_sync_state(KEY, KIND_MANAGED_DEVICES)
+        self.assertRaises(InventorySyncError, self.store.sync, KEY, KIND_MANAGED_DEVICES,
+                          failing([device(1, 10, active=False), device(5, 10)]), True)
+        self.assertEqual(self.store.count_devices_by_location(KEY), {10: [2, 0], 20: [0, 1]})
+        self.assertEqual(self.store.get_sync_state(KEY, KIND_MANAGED_DEVICES), state)
+        self.assertEqual(len(self.store.get_changes(KEY, 0)), 3)
+        stats = self.store.stats()
+        self.assertEqual((stats["syncs"], stats["full_syncs"], stats["failures"], stats["changes"]), (1, 1, 1, 3))
+        self.assertEqual(stats["last_failure"], "page 2 could not be read")
+
+    def test_modified_since(self):
+        self.assertEqual(self.store.get_sync_state(KEY, KIND_MANAGED_DEVICES)['modified_since'], None)
+        self.store.sync(KEY, KIND_MANAGED_DEVICES, [device(1, 10, modified=100), device(2, 10, modified=200)], True)
+        self.assertEqual(self.store.get_sync_state(KEY, KIND_MANAGED_DEVICES)['modified_since'], 200)
+        self.store.sync(KEY, KIND_MANAGED_DEVICES, [device(2, 10, active=False, modified=300)], False)
+        state = self.store.get_sync_state(KEY, KIND_MANAGED_DEVICES)
+        self.assertEqual(state['modified_since'], 300)
+        self.assertTrue(state['full_synced_at'] < state['synced_at'])
+
+    def test_is_fresh(self):
+        self.assertTrue(self.store.is_fresh(KEY, (KIND_MANAGED_DEVICES,), 60))
+        self.assertFalse(self.store.is_fresh(KEY, (KIND_MANAGED_DEVICES, KIND_VIRTUAL_APS), 60))
+        self.assertFalse(self.store.is_fresh(("host", "KEY-OTHER"), (KIND_MANAGED_DEVICES,), 60))
+        self.store.sync(KEY, KIND_MANAGED_DEVICES, self.devices, True, synced_at=time.time() - 120)
+        self.assertFalse(self.store.is_fresh(KEY, (KIND_MANAGED_DEVICES,), 60))
+
+    def test_tenants_are_separate(self):
+        other = ("host", "KEY-OTHER")
+        self.store.sync(other, KIND_MANAGED_DEVICES, [device(1, 30)], True)
+        self.assertEqual(self.store.count_devices_by_location(other), {30: [1, 0]})
+        self.assertEqual(self.store.count_devices_by_location(KEY), {10: [2, 0], 20: [0, 1]})
+
+
+class MwmApiInventoryTest(unittest.TestCase):
+    """ MwmApi.sync_inventory against the fake server """
+
+    def setUp(self):
+        from mwmApi import MwmApi
+        from mwmFakeServer import FakeFleet, start_fake_server
+        self.server = start_fake_server(FakeFleet(3, 4, 1))
+        self.directory = tempfile.mkdtemp()
+        self.store = InventoryStore(os.path.join(self.directory, "inventory.db"))
+        self.mwm_api = MwmApi(self.server.get_hostname(), None, scheme="http")
+        self.mwm_api.login("api-client", "3000", {"keyId": "KEY-TEST", "keyValue": "secret", "cname": "TEST"})
+        self.mwm_api.set_inventory(self.store)
+
+    def tearDown(self):
+        from mwmApi import get_http_session, response_cache
+        self.mwm_api.logout()
+        # Cached responses keep their connection open until dropped
+        response_cache.invalidate()
+        get_http_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_sync(self):
+        fleet = self.server.fleet
+        self.assertFalse(self.mwm_api.is_inventory_fresh())
+        deltas = self.mwm_api.sync_inventory()
+        self.assertEqual(len(deltas[KIND_MANAGED_DEVICES]), len(fleet.managed_devices))
+        self.assertTrue(self.mwm_api.is_inventory_fresh())
+        key = self.mwm_api.get_session_key()
+        active = sum(1 for md in fleet.managed_devices if md["active"])
+        counts = self.store.count_devices_by_location(key)
+        self.assertEqual(sum(count[0] for count in counts.values()), active)
+        self.assertEqual(sum(count[1] for count in counts.values()), len(fleet.managed_devices) - active)
+
+        # Incremental: only the device that went down
+        boxid = [md["boxId"] for md in fleet.managed_devices if md["active"]][0]
+        fleet.set_device_active(boxid, False)
+        deltas = self.mwm_api.sync_inventory(kinds=(KIND_MANAGED_DEVICES,))
+        self.assertEqual(get_changes(deltas[KIND_MANAGED_DEVICES]), [(CHANGE_DOWN, str(boxid))])
+
+        fleet.remove_device(boxid)
+        deltas = self.mwm_api.sync_inventory(kinds=(KIND_MANAGED_DEVICES,), full=True)
+        self.assertEqual(get_changes(deltas[KIND_MANAGED_DEVICES]), [(CHANGE_REMOVED, str(boxid))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+
+from mwmLocations import LocationIndex, normalize_location_name, tokenize_location_name
+
+
+def build_tree(locations):
+    """ locations/tree payload from (id, parent id, name) tuples """
+    return {"locations": dict((str(locid), {"id": {"type": "locallocationid", "id": locid}, "name": name,
+                                           "parentId": parent})
+                              for locid, parent, name in locations)}
+
+
+#   0 Global
+#     1 Campus A
+#       3 Corporate
+#       4 Joe's Cafe
+#     2 Campus B
+#       5 Corporate
+#       6 Building Five
+TREE = build_tree([
+    (0, None, "Global"),
+    (1, 0, "Campus A"),
+    (2, 0, "Campus B"),
+    (3, 1, "Corporate"),
+    (4, 1, "Joe's Cafe"),
+    (5, 2, "Corporate"),
+    (6, 2, "Building Five"),
+])
+
+
+class TokenizeTest(unittest.TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(tokenize_location_name("Joe's Cafe - Building Five"), ["joes", "cafe", "building", "5"])
+        self.assertEqual(normalize_location_name("R&D  Lab"), "r and d lab")
+        self.assertEqual(tokenize_location_name(None), [])
+
+
+class LocationIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = LocationIndex(TREE, 100.0)
+
+    def test_hierarchy(self):
+        index = self.index
+        self.assertEqual(len(index), 7)
+        self.assertEqual(index.get_roots(), [0])
+        self.assertEqual(index.get_children(0), [1, 2])
+        self.assertEqual(index.get_descendants(2), [2, 5, 6])
+        self.assertEqual(sorted(index.get_leaves()), [3, 4, 5, 6])
+        self.assertEqual(index.get_path(6), [0, 2, 6])
+        self.assertEqual(index.get_depth(6), 2)
+        self.assertEqual(index.get_parent(4), 1)
+        self.assertTrue(index.is_under(5, 2))
+        self.assertTrue(index.is_under(2, 2))
+        self.assertFalse(index.is_under(5, 1))
+        self.assertFalse(index.is_under(99, 0))
+
+    def test_find(self):
+        index = self.index
+        self.assertEqual(index.find("joes cafe"), 4)
+        self.assertEqual(index.find("building 5"), 6)
+        self.assertEqual(index.find("building5"), 6)
+        # Same named locations: the first in tree order
+        self.assertEqual(index.find("corporate"), 3)
+        self.assertEqual(index.find_ids("Corporate"), [3, 5])
+        self.assertEqual(index.find("nowhere at all"), None)
+
+    def test_find_near_miss(self):
+        self.assertEqual(self.index.find("jose cafe"), 4)
+        self.assertEqual(self.index.find("corporat"), 3)
+
+    def test_find_scope(self):
+        index = self.index
+        self.assertEqual(index.find("corporate", 2), 5)
+        self.assertEqual(index.find("joes cafe", 2), None)
+        self.assertEqual(index.find("corporate in campus b"), 5)
+        self.assertEqual(index.find("corporate under campus a"), 3)
+        self.assertEqual(index.find_ids("corporate", 1), [3])
+
+    def test_find_prefix(self):
+        index = self.index
+        self.assertEqual(index.find_prefix("corp"), [3, 5])
+        self.assertEqual(index.find_prefix("caf"), [4])
+        self.assertEqual(index.find_prefix("joes c"), [4])
+        self.assertEqual(index.find_prefix("campus"), [1, 2])
+        self.assertEqual(index.find_prefix("campus", limit=1), [1])
+        self.assertEqual(index.find_prefix("corp", scope=2), [5])
+        self.assertEqual(index.find_prefix("x"), [])
+        self.assertEqual(index.find_prefix(""), [])
+
+    def test_distinguishing_names(self):
+        self.assertEqual(self.index.get_distinguishing_names([3, 5]),
+                         {3: "Corporate in Campus A", 5: "Corporate in Campus B"})
+
+    def test_parent_cycle_and_unknown_parent(self):
+        index = LocationIndex(build_tree([(1, 2, "A"), (2, 1, "B"), (3, 42, "C")]))
+        self.assertEqual(sorted(index.get_roots()), [1, 3])
+        self.assertEqual(index.get_descendants(1), [1, 2])
+
+    def test_empty_tree(self):
+        index = LocationIndex(None)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.find("anything"), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
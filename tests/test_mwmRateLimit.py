@@ -0,0 +1,136 @@
+import time
+import unittest
+
+import mwmRateLimit
+from mwmRateLimit import AimdLimit, RateLimiter, TokenBucket, get_retry_delay
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(100, 3)
+        for i in range(3):
+            self.assertTrue(bucket.acquire(0))
+        # Empty: the next token comes in 10 ms
+        self.assertFalse(bucket.acquire(0))
+        start = time.time()
+        self.assertTrue(bucket.acquire(1))
+        self.assertTrue(time.time() - start < 0.5)
+
+
+class AimdLimitTest(unittest.TestCase):
+
+    def test_acquire_timeout(self):
+        limit = AimdLimit(initial=2)
+        self.assertTrue(limit.acquire(0))
+        self.assertTrue(limit.acquire(0))
+        self.assertFalse(limit.acquire(0.01))
+        limit.cancel()
+        self.assertTrue(limit.acquire(0))
+
+    def test_decrease_on_throttling_and_failure(self):
+        limit = AimdLimit(initial=10)
+        limit.acquire()
+        limit.release(0, 429)
+        self.assertAlmostEqual(limit.limit, 7.0)
+        limit.acquire()
+        limit.release(0, None)
+        self.assertAlmostEqual(limit.limit, 4.9)
+        limit.acquire()
+        limit.release(0, 500)
+        self.assertEqual(limit.decreases, 3)
+
+    def test_decrease_once_per_burst(self):
+        limit = AimdLimit(initial=10)
+        for i in range(4):
+            limit.acquire()
+        # Calls sent before the first decrease do not decrease again
+        for i in range(4):
+            limit.release(1.0, 503)
+        self.assertAlmostEqual(limit.limit, 7.0)
+        self.assertEqual(limit.decreases, 1)
+
+    def test_minimum(self):
+        limit = AimdLimit(initial=1, minimum=1)
+        limit.acquire()
+        limit.release(0, 429)
+        self.assertEqual(limit.limit, 1)
+
+    def test_increase_only_when_busy(self):
+        limit = AimdLimit(initial=4)
+        limit.acquire()
+        limit.release(0.1, 200)
+        self.assertEqual(limit.limit, 4)
+        limit.acquire()
+        limit.acquire()
+        limit.release(0.1, 200)
+        self.assertAlmostEqual(limit.limit, 4.25)
+        limit.release(0.1, 200)
+
+    def test_maximum(self):
+        limit = AimdLimit(initial=4, maximum=4)
+        for i in range(4):
+            limit.acquire()
+        limit.release(0.1, 200)
+        self.assertEqual(limit.limit, 4)
+
+    def test_slow_call_is_congestion(self):
+        limit = AimdLimit(initial=10)
+        limit.acquire()
+        limit.release(0.1, 200)
+        limit.acquire()
+        limit.release(mwmRateLimit.LATENCY_MIN_CONGESTION + 0.5, 200)
+        self.assertEqual(limit.decreases, 1)
+        self.assertAlmostEqual(limit.usual_latency, 0.1)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_retry_budget(self):
+        limiter = RateLimiter()
+        limiter.retry_tokens = 1.0
+        self.assertTrue(limiter.take_retry())
+        self.assertFalse(limiter.take_retry())
+        # First attempts earn budget, retries do not
+        for i in range(10):
+            limiter.acquire()
+            limiter.release(0.01, 200, retry=True)
+        self.assertFalse(limiter.take_retry())
+        for i in range(11):
+            limiter.acquire()
+            limiter.release(0.01, 200)
+        self.assertTrue(limiter.take_retry())
+        stats = limiter.stats()
+        self.assertEqual((stats["calls"], stats["retries"], stats["retries_denied"]), (21, 2, 2))
+
+    def test_throttled_count(self):
+        limiter = RateLimiter()
+        limiter.acquire()
+        limiter.release(0.01, 429)
+        self.assertEqual(limiter.stats()["throttled"], 1)
+        self.assertEqual(limiter.stats()["concurrency_decreases"], 1)
+
+    def test_acquire_timeout(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.acquire(0))
+        limiter.release(0.01, 200)
+        self.assertFalse(limiter.acquire(0.01))
+
+
+class RetryDelayTest(unittest.TestCase):
+
+    def test_jittered_backoff(self):
+        for attempt in range(6):
+            delay = get_retry_delay(attempt)
+            self.assertTrue(0 <= delay <= min(mwmRateLimit.RETRY_MAX_DELAY,
+                                              mwmRateLimit.RETRY_BASE_DELAY * (2 ** attempt)))
+
+    def test_retry_after(self):
+        self.assertTrue(get_retry_delay(0, "3") >= 3)
+        self.assertEqual(get_retry_delay(0, str(mwmRateLimit.RETRY_AFTER_MAX_DELAY + 1)), None)
+        # HTTP date form: the jittered delay
+        self.assertTrue(get_retry_delay(0, "Sun, 18 Oct 2026 10:00:00 GMT") <= mwmRateLimit.RETRY_BASE_DELAY)
+
+
+if __name__ == "__main__":
+    unittest.main()
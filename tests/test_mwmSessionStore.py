@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from mwmSessionStore import FileSessionStore, MemorySessionStore, open_session_store
+
+KEY = ("host", "TENANT", "KEY-TEST")
+
+
+class SessionStoreTests:
+    """ Tests run against each store, mixed into a TestCase creating self.store """
+
+    def test_put_get(self):
+        self.assertEqual(self.store.get(KEY), None)
+        self.store.put(KEY, {"JSESSIONID": "1"}, time.time() + 60)
+        self.assertEqual(self.store.get(KEY)["cookies"], {"JSESSIONID": "1"})
+        self.assertEqual(self.store.get(("host", "TENANT", "KEY-OTHER")), None)
+
+    def test_expiry(self):
+        self.store.put(KEY, {"JSESSIONID": "1"}, time.time() - 1)
+        self.assertEqual(self.store.get(KEY), None)
+        # An expired session is replaced by a new login
+        record = self.store.get_or_login(KEY, lambda: ({"JSESSIONID": "2"}, time.time() + 60))
+        self.assertEqual(record["cookies"], {"JSESSIONID": "2"})
+        self.assertEqual(self.store.stats()["logins"], 1)
+
+    def test_reuse(self):
+        logins = []
+
+        def login():
+            logins.append(1)
+            return {"JSESSIONID": str(len(logins))}, time.time() + 60
+
+        self.store.get_or_login(KEY, login)
+        record = self.store.get_or_login(KEY, login)
+        self.assertEqual(record["cookies"], {"JSESSIONID": "1"})
+        self.assertEqual(self.store.stats(), {"logins": 1, "hits": 1})
+
+    def test_invalidate_rejected_session(self):
+        self.store.put(KEY, {"JSESSIONID": "1"}, time.time() + 60)
+        # A caller still holding an older rejected session leaves the newer one
+        self.store.invalidate(KEY, {"JSESSIONID": "0"})
+        self.assertNotEqual(self.store.get(KEY), None)
+        self.store.invalidate(KEY, {"JSESSIONID": "1"})
+        self.assertEqual(self.store.get(KEY), None)
+        self.store.put(KEY, {"JSESSIONID": "2"}, time.time() + 60)
+        self.store.invalidate(KEY)
+        self.assertEqual(self.store.get(KEY), None)
+
+    def test_single_login(self):
+        release = threading.Event()
+        started = threading.Event()
+        logins = []
+
+        def login():
+            logins.append(1)
+            started.set()
+            release.wait()
+            return {"JSESSIONID": "1"}, time.time() + 60
+
+        records = []
+        threads = [threading.Thread(target=lambda: records.append(self.store.get_or_login(KEY, login)))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        started.wait()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(logins), 1)
+        self.assertEqual([record["cookies"] for record in records], [{"JSESSIONID": "1"}] * 4)
+        self.assertEqual(self.store.stats(), {"logins": 1, "hits": 3})
+
+    def test_failed_login(self):
+        def login():
+            raise RuntimeError("Invalid key")
+
+        self.assertRaises(RuntimeError, self.store.get_or_login, KEY, login)
+        self.assertEqual(self.store.get(KEY), None)
+        record = self.store.get_or_login(KEY, lambda: ({"JSESSIONID": "1"}, time.time() + 60))
+        self.assertEqual(record["cookies"], {"JSESSIONID": "1"})
+
+
+class MemorySessionStoreTest(SessionStoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.store = MemorySessionStore()
+
+
+class FileSessionStoreTest(SessionStoreTests, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "sessions.json")
+        self.store = open_session_store(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_stores(self):
+        self.assertTrue(isinstance(self.store, FileSessionStore))
+        self.store.put(KEY, {"JSESSIONID": "1"}, time.time() + 60)
+        self.assertEqual(FileSessionStore(self.path).get(KEY)["cookies"], {"JSESSIONID": "1"})
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_unreadable_file(self):
+        with open(self.path, "w") as f:
+            f.write("not json")
+        self.assertEqual(self.store.get(KEY), None)
+        self.store.put(KEY, {"JSESSIONID": "1"}, time.time() + 60)
+        self.assertNotEqual(self.store.get(KEY), None)
+
+
+class MwmApiSessionTest(unittest.TestCase):
+    """ Login sessions of MwmApi instances sharing a store, against the fake server """
+
+    def setUp(self):
+        from mwmFakeServer import FakeFleet, start_fake_server
+        self.server = start_fake_server(FakeFleet(3, 2, 1))
+        self.store = MemorySessionStore()
+
+    def tearDown(self):
+        from mwmApi import get_http_session, response_cache
+        response_cache.invalidate()
+        get_http_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_mwm_api(self):
+        from mwmApi import MwmApi
+        mwm_api = MwmApi(self.server.get_hostname(), None, scheme="http")
+        mwm_api.set_credentials("api-client", "3000", {"keyId": "KEY-TEST", "keyValue": "secret", "cname": "TEST"})
+        mwm_api.set_session_store(self.store)
+        mwm_api.acquire_session()
+        return mwm_api
+
+    def get_logins(self):
+        counts = self.server.get_request_counts()
+        return sum(counts[name] for name in counts if "login" in name)
+
+    def test_instances_share_one_login(self):
+        first = self.create_mwm_api()
+        second = self.create_mwm_api()
+        self.assertEqual(self.get_logins(), 1)
+        self.assertEqual(second.get_cookiejar_dict(), first.get_cookiejar_dict())
+
+    def test_rejected_session_is_replaced(self):
+        from mwmApi import PATH_CLIENTS
+        mwm_api = self.create_mwm_api()
+        rejected = mwm_api.get_cookiejar_dict()
+        # The server forgets the session: the 401 drops it from the store and logs in again
+        self.server.sessions.clear()
+        self.assertEqual(mwm_api.request(PATH_CLIENTS).status_code, 200)
+        self.assertEqual(self.get_logins(), 2)
+        self.assertNotEqual(self.store.get(mwm_api.get_session_key())["cookies"], rejected)
+        self.assertEqual(self.create_mwm_api().get_cookiejar_dict(), mwm_api.get_cookiejar_dict())
+        self.assertEqual(self.get_logins(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from mwmStream import iter_json_array_items, iter_response_items
+
+
+def split_bytes(text, size):
+    data = text.encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class FakeResponse:
+    """ Streamed response stand-in, iter_content() yields the body in pieces """
+
+    def __init__(self, text, size):
+        self.text = text
+        self.size = size
+
+    def iter_content(self, chunk_size):
+        return split_bytes(self.text, self.size)
+
+
+RECORDS = [
+    {"boxId": 1, "name": u"Café \"Corner\"", "active": True, "tags": ["a", "b"]},
+    {"boxId": 22, "name": "back\\slash, [brackets] {braces}", "active": False, "tags": []},
+    {"boxId": 333, "name": "managedDevices", "uptime": 12345678, "ratio": -0.25e-3, "meta": None},
+]
+
+
+class IterJsonArrayItemsTest(unittest.TestCase):
+
+    def test_top_level_array(self):
+        text = json.dumps(RECORDS)
+        self.assertEqual(list(iter_json_array_items([text])), RECORDS)
+
+    def test_items_key_at_every_split(self):
+        # The array comes after values holding the key name, brackets and escapes
+        text = json.dumps({"note": "managedDevices", "other": [[1, 2], {"managedDevices": []}],
+                           "managedDevices": RECORDS, "total": 3}, ensure_ascii=False)
+        for size in (1, 2, 3, 7, 64):
+            self.assertEqual(list(iter_json_array_items(split_bytes(text, size), "managedDevices")), RECORDS,
+                             "chunk size %d" % size)
+
+    def test_number_split_between_chunks(self):
+        self.assertEqual(list(iter_json_array_items(["[12", "34, 5", "6]"])), [1234, 56])
+
+    def test_empty_and_missing_array(self):
+        self.assertEqual(list(iter_json_array_items(['{"clients": []}'], "clients")), [])
+        self.assertEqual(list(iter_json_array_items(['{"status": 1}'], "clients")), [])
+
+    def test_truncated_item_raises(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array_items(['{"clients": [{"a": 1}, {"b": '], "clients"))
+
+    def test_stats(self):
+        stats = {"bytes": 0, "secs": 0.0}
+        chunks = split_bytes(json.dumps(RECORDS), 10)
+        list(iter_json_array_items(chunks, None, stats))
+        self.assertEqual(stats["bytes"], sum(len(chunk) for chunk in chunks))
+        self.assertTrue(stats["secs"] >= 0)
+
+
+class IterResponseItemsTest(unittest.TestCase):
+
+    def test_streamed_response(self):
+        response = FakeResponse(json.dumps({"managedDevices": RECORDS}), 5)
+        self.assertEqual(list(iter_response_items(response, "managedDevices")), RECORDS)
+
+
+if __name__ == "__main__":
+    unittest.main()